@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+'''
+Time for generating assessment XML for a quiz with many items of mixed
+question types.  Markdown is rendered by a first, untimed run, so that only
+XML generation is timed.  `--root` gives another source tree to import
+text2qti from, for comparing versions; the XML digest shows whether their
+output is identical.
+
+    python benchmarks/item_emitters.py [--items N] [--repeat N] [--root DIR]
+'''
+
+
+import argparse
+import hashlib
+import pathlib
+import sys
+import time
+
+
+# Question bodies that cover every question type
+ITEM_BODIES = [
+    ['a)  Option a', '... Not this one.', '*b) Option b', 'c)  Option c'],
+    ['*a) True', 'b)  False'],
+    ['*   answer', '*   other answer'],
+    ['[*] 2', '[*] 3', '[ ] 4', '... Four is composite.'],
+    ['=   [1.5, 2.5]'],
+    ['=   100 +- 5%'],
+    ['____'],
+    ['^^^^'],
+]
+
+
+def quiz_source(n_items: int) -> str:
+    lines = ['Quiz title: Benchmark', '']
+    for n in range(n_items):
+        lines.extend([f'{n+1}.  Question {n} with *emphasis*.', '...  General feedback.'])
+        lines.extend(ITEM_BODIES[n % len(ITEM_BODIES)])
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=100_000, help='number of items (default 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs (default 3)')
+    parser.add_argument('--root', default=str(pathlib.Path(__file__).resolve().parent.parent),
+                        help='source tree to import text2qti from (default this tree)')
+    args = parser.parse_args()
+    sys.path.insert(0, args.root)
+    from text2qti.config import Config
+    from text2qti.quiz import Quiz
+    from text2qti.xml_assessment import assessment
+
+    t = time.perf_counter()
+    quiz = Quiz(quiz_source(args.items), config=Config())
+    print(f'Parsed {args.items} items in {time.perf_counter() - t:.1f} s')
+    kwargs = {'quiz': quiz, 'assessment_identifier': 'benchmark', 'title_xml': 'Benchmark'}
+    expected = assessment(**kwargs)
+    times = []
+    for _ in range(args.repeat):
+        t = time.perf_counter()
+        xml = assessment(**kwargs)
+        times.append(time.perf_counter() - t)
+        if xml != expected:
+            sys.exit('Assessment XML differs between runs')
+    best = min(times)
+    print(f'assessment():  {best:.2f} s, {best/args.items*1e6:.1f} µs/item, '
+          f'{len(expected.encode("utf8"))/1e6:.0f} MB (best of {args.repeat})')
+    print(f'XML digest:  {hashlib.blake2b(expected.encode("utf8")).hexdigest()[:16]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+'''
+Time per equation for converting LaTeX to MathML in process with
+`LaTeXToMathML`, and with Pandoc as a subprocess per equation and as a
+server when Pandoc is available.  Equations come from the corpus of Pandoc
+output in the tests, and in-process output is checked against it first.
+
+    python benchmarks/latex_to_mathml.py [--equations N]
+'''
+
+
+import argparse
+import json
+import pathlib
+import shutil
+import sys
+import time
+
+root = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from text2qti.config import Config
+from text2qti.markdown import LaTeXToMathML, Markdown
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--equations', type=int, default=100_000,
+                        help='number of equations for in-process conversion (default 100000)')
+    args = parser.parse_args()
+    corpus = json.loads((root / 'tests' / 'quizzes' / 'pandoc_mathml.json').read_text(encoding='utf8'))
+    converter = LaTeXToMathML()
+    for latex, mathml in corpus.items():
+        if converter.convert(latex) != mathml:
+            sys.exit(f'In-process MathML differs from Pandoc for "{latex}"')
+    latex_list = list(corpus)
+    equations = [latex_list[n % len(latex_list)] for n in range(args.equations)]
+    t = time.perf_counter()
+    for latex in equations:
+        converter.convert(latex)
+    t = time.perf_counter() - t
+    print(f'{"LaTeXToMathML":>16}:  {t/len(equations)*1e6:9.1f} µs/equation ({len(equations)} equations)')
+    if shutil.which('pandoc') is None:
+        print('Pandoc was not found, so it was not timed')
+        return
+    for pandoc_server in (False, True):
+        config = Config()
+        config['pandoc_server'] = pandoc_server
+        md = Markdown(config)
+        # Start any server before timing
+        md._run_pandoc_mathml('$x$')
+        t = time.perf_counter()
+        for latex in latex_list:
+            md._run_pandoc_mathml(f'${latex}$')
+        t = time.perf_counter() - t
+        name = 'Pandoc server' if pandoc_server else 'Pandoc process'
+        print(f'{name:>16}:  {t/len(latex_list)*1e6:9.1f} µs/equation ({len(latex_list)} equations)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+'''
+Memory retained per question for a large synthetic question bank, measured
+with tracemalloc, with and without `low_memory`.
+
+    python benchmarks/memory_per_question.py [--questions N]
+'''
+
+
+import argparse
+import gc
+import pathlib
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from text2qti.config import Config
+from text2qti.quiz import Quiz
+
+
+def question_bank(n_questions: int) -> str:
+    '''
+    Source for a quiz with a mix of true/false, multiple-choice, and
+    short-answer questions.
+    '''
+    lines = []
+    for n in range(n_questions):
+        lines.append(f'{n+1}.  Question number {n} asks about item {n*7919 % 1000003} with *emphasis*.')
+        if n % 3 == 0:
+            lines.extend(['*a) True', 'b)  False'])
+        elif n % 3 == 1:
+            lines.extend([f'a) Option {n}a', f'*b) Option {n}b', f'c) Option {n}c', f'...  Feedback for {n}'])
+        else:
+            lines.extend([f'*   answer{n}', f'*   other{n}'])
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def measure(source: str, *, low_memory: bool):
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    t = time.perf_counter()
+    quiz = Quiz(source, config=Config(), low_memory=low_memory)
+    t = time.perf_counter() - t
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    n_questions = len(quiz.questions_and_delims)
+    print(f'{"low_memory" if low_memory else "default":>10}:  {n_questions} questions, '
+          f'{(current - base)/n_questions:.0f} bytes/question retained, '
+          f'peak {(peak - base)/1e6:.1f} MB, {t:.1f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--questions', type=int, default=50_000, help='number of questions (default 50000)')
+    args = parser.parse_args()
+    source = question_bank(args.questions)
+    for low_memory in (False, True):
+        measure(source, low_memory=low_memory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+'''
+Time for matching start patterns on every line of a large synthetic quiz,
+with `StartPatternMatcher` and with the single regex alternation that it
+replaces.  The token streams are checked to be identical first.
+
+    python benchmarks/start_patterns.py [--questions N] [--repeat N]
+'''
+
+
+import argparse
+import pathlib
+import re
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from text2qti.quiz import no_content, start_patterns, start_re
+
+
+alternation_re = re.compile('|'.join(r'(?P<{0}>{1}[ \t]+(?=\S))'.format(name, pattern)
+                                     if name not in no_content else
+                                     r'(?P<{0}>{1}\s*)$'.format(name, pattern)
+                                     for name, pattern in start_patterns.items()))
+
+
+def quiz_lines(n_questions: int):
+    '''
+    Lines for a quiz in which, as in typical question banks, most lines are
+    plain text such as wrapped continuation lines.
+    '''
+    lines = ['Quiz title: Benchmark', '']
+    for n in range(n_questions):
+        lines.extend([f'{n+1}.  Question number {n} with some text',
+                      '    and a continuation line',
+                      f'*a) Answer {n}',
+                      f'b)  Other {n}',
+                      '... Feedback',
+                      '    more feedback text',
+                      ''])
+    return lines
+
+
+def tokens(regex, lines):
+    tokens = []
+    for line in lines:
+        match = regex.match(line)
+        tokens.append(None if match is None else (match.lastgroup, match.span()))
+    return tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--questions', type=int, default=20_000, help='number of questions (default 20000)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs (default 5)')
+    args = parser.parse_args()
+    lines = quiz_lines(args.questions)
+    if tokens(start_re, lines) != tokens(alternation_re, lines):
+        sys.exit('Token streams differ')
+    for name, regex in (('alternation', alternation_re), ('StartPatternMatcher', start_re)):
+        times = []
+        for _ in range(args.repeat):
+            t = time.perf_counter()
+            for line in lines:
+                regex.match(line)
+            times.append(time.perf_counter() - t)
+        print(f'{name:>19}:  {min(times)*1000:.1f} ms for {len(lines)} lines (best of {args.repeat})')
+
+
+if __name__ == '__main__':
+    main()
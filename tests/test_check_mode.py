@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import os
+
+import pytest
+
+from text2qti.config import Config
+from text2qti.err import Text2qtiError
+from text2qti.quiz import Quiz
+
+
+def quiz_error(source, *, render):
+    try:
+        Quiz(source, config=Config(), render=render)
+    except Text2qtiError as e:
+        return str(e)
+    return None
+
+
+@pytest.mark.parametrize('image', ['![alt](missing.png)', '![alt](<missing.png> "Title")', r'![a\]b](missing.png)'])
+def test_missing_image(tmp_path, monkeypatch, image):
+    monkeypatch.chdir(tmp_path)
+    source = f'Quiz title: Images\n\n1.  Question {image}\n*a) Yes\nb) No\n'
+    error = quiz_error(source, render=True)
+    assert 'File "missing.png" does not exist' in error
+    assert quiz_error(source, render=False) == error
+
+
+def test_existing_and_skipped_images(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'image.png').write_bytes(b'png')
+    source = ('Quiz title: Images\n\n'
+              '1.  Question ![alt](image.png) ![remote](https://example.com/x.png)\n'
+              '    `![code](missing.png)` <!-- ![comment](missing.png) --> \\![escaped](missing.png)\n'
+              '*a) Yes\nb) No\n')
+    assert quiz_error(source, render=True) is None
+    assert quiz_error(source, render=False) is None
+
+
+@pytest.mark.skipif(os.name != 'posix' or os.geteuid() == 0, reason='POSIX permissions as non-root user')
+def test_unreadable_image(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'image.png').write_bytes(b'png')
+    (tmp_path / 'image.png').chmod(0)
+    source = 'Quiz title: Images\n\n1.  Question ![alt](image.png)\n*a) Yes\nb) No\n'
+    error = quiz_error(source, render=True)
+    assert 'cannot be read due to permission error' in error
+    assert quiz_error(source, render=False) == error
+
+
+def test_duplicate_choices():
+    # Identical Markdown is a duplicate either way
+    source = 'Quiz title: Duplicates\n\n1.  Question\n*a) *Yes*\nb) *Yes*\n'
+    error = quiz_error(source, render=True)
+    assert 'Duplicate choice' in error
+    assert quiz_error(source, render=False) == error
+    # Markdown that only matches after rendering is found only when rendering
+    source = 'Quiz title: Duplicates\n\n1.  Question\n*a) *Yes*\nb) _Yes_\n'
+    assert 'Duplicate choice' in quiz_error(source, render=True)
+    assert quiz_error(source, render=False) is None
+
+
+def test_deleted_image_with_previous_quiz(tmp_path, monkeypatch):
+    # Blocks with images are not reused, so an image that was deleted after
+    # the previous parse is still found
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'image.png').write_bytes(b'png')
+    source = 'Quiz title: Images\n\n1.  Question ![alt](image.png)\n*a) Yes\nb) No\n\n2.  Other\n*a) Yes\nb) No\n'
+    previous = Quiz(source, config=Config(), render=False)
+    (tmp_path / 'image.png').unlink()
+    source = source.replace('Other', 'Other edited')
+    with pytest.raises(Text2qtiError, match='does not exist'):
+        Quiz(source, config=Config(), render=False, previous=previous)
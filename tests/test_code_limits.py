@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from text2qti.code_server import resource_limits, resource_limits_command
+from text2qti.config import Config
+from text2qti.err import Text2qtiError
+from text2qti.quiz import Quiz
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='resource limits are only supported on Linux')
+
+
+@pytest.mark.skipif(shutil.which('sh') is None, reason='requires sh')
+def test_limits_apply_before_exec():
+    # The shell reports its limits as soon as it starts, before anything
+    # could set them on the running process
+    rlimits = resource_limits(memory_limit=500, cpu_limit=2.5)
+    cmd = [shutil.which('sh'), '-c', 'ulimit -t; ulimit -v']
+    proc = subprocess.run(resource_limits_command(rlimits, cmd), capture_output=True, check=True)
+    assert proc.stdout.split() == [b'3', str(500*1024).encode()]
+    assert resource_limits_command({}, cmd) is cmd
+
+
+def test_code_reaching_memory_limit_immediately():
+    config = Config()
+    config['run_code_blocks'] = True
+    config['code_memory_limit'] = 200
+    source = ('Quiz title: Limits\n\n'
+              '```{.python .run}\nx = bytearray(1024**3)\n```\n\n'
+              '1.  Question\n*a) Yes\nb) No\n')
+    with pytest.raises(Text2qtiError) as exc_info:
+        Quiz(source, config=config)
+    assert exc_info.value.code == 'code-memory-limit'
+
+
+def test_limits_with_jobs():
+    # Code blocks run from several threads at once, and each still gets the
+    # limits
+    config = Config()
+    config['run_code_blocks'] = True
+    config['code_memory_limit'] = 500
+    config['code_cpu_limit'] = 2.5
+    blocks = []
+    for n in range(1, 9):
+        blocks.append('```{.python .run}\n'
+                      'import resource\n'
+                      'limits = [resource.getrlimit(x)[0] for x in (resource.RLIMIT_CPU, resource.RLIMIT_AS)]\n'
+                      f'print(f"{n}.  Question {n} {{limits}}")\n'
+                      'print("*a) Yes")\n'
+                      'print("b) No")\n'
+                      '```\n')
+    source = 'Quiz title: Limits\n\n' + '\n'.join(blocks)
+    quiz = Quiz(source, config=config, jobs=4)
+    assert ([question.question_raw for question in quiz.questions_and_delims] ==
+            [f'Question {n} [3, {500*1024**2}]' for n in range(1, 9)])
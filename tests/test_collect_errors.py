@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import pytest
+
+from text2qti.config import Config
+from text2qti.err import Text2qtiError
+from text2qti.quiz import Quiz
+
+
+# Quiz sources with errors.  Each error is a pair of lines, `(invalid,
+# valid)`, so that every error can also be parsed on its own with the same
+# line numbers.
+SOURCES = [
+    [
+        'Quiz title: Errors',
+        '',
+        '1.  Question 1',
+        '*a) x',
+        ('', 'b) y'),
+        ('2.Question 2', '2.  Question 2'),
+        '*a) x',
+        'b) y',
+        '',
+        '3.  Question 3',
+        '*a) x',
+        'b) y',
+    ],
+    [
+        'Quiz title: Errors',
+        '',
+        '1.  Question 1',
+        ('*a)x', '*a) x'),
+        'b) y',
+        '',
+        '2.  Question 2',
+        '*a) x',
+        ('b) x', 'b) y'),
+        '',
+        '3.  Question 3',
+        '*a) x',
+        'b) y',
+        ('Text:', 'Text: Some text'),
+        '',
+        '4.  Question 4',
+        '*a) x',
+        'b) y',
+    ],
+    [
+        'Quiz title: Errors',
+        '',
+        '1.  Question 1',
+        '*a) x',
+        ('', 'b) y'),
+        'GROUP',
+        ('pick: x', 'pick: 1'),
+        '2.  Question 2',
+        '*a) x',
+        'b) y',
+        '',
+        '3.  Question 3',
+        '*a) x',
+        'b) y',
+        'END_GROUP',
+    ],
+]
+
+
+def source_lines(lines, invalid):
+    return '\n'.join(line[0] if isinstance(line, tuple) and i in invalid else line[1] if isinstance(line, tuple) else line
+                     for i, line in enumerate(lines)) + '\n'
+
+
+def diagnostics(source, *, collect_errors):
+    try:
+        Quiz(source, config=Config(), collect_errors=collect_errors)
+    except Text2qtiError as e:
+        return [(d.line, d.column, d.code) for d in e.diagnostics]
+    return []
+
+
+@pytest.mark.parametrize('lines', SOURCES)
+def test_collected_errors_match_single_errors(lines):
+    error_indices = [i for i, line in enumerate(lines) if isinstance(line, tuple)]
+    assert diagnostics(source_lines(lines, set()), collect_errors=False) == []
+    expected = []
+    for i in error_indices:
+        single = diagnostics(source_lines(lines, {i}), collect_errors=False)
+        assert len(single) == 1
+        expected.extend(single)
+    source = source_lines(lines, set(error_indices))
+    collected = diagnostics(source, collect_errors=True)
+    assert sorted(collected) == sorted(expected)
+    # The first error is the one that stops parsing without collected errors
+    assert collected[:1] == diagnostics(source, collect_errors=False)
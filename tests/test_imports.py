@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import json
+import pathlib
+import subprocess
+import sys
+
+
+def test_quiz_import_does_not_load_heavy_dependencies():
+    # Python-Markdown, BespON, and Pygments are imported on first use, so
+    # importing the quiz module stays fast.  This runs in a new interpreter,
+    # since other tests import these modules.
+    code = ('import json, sys\n'
+            'import text2qti.quiz\n'
+            'print(json.dumps(sorted(name for name in sys.modules '
+            'if name.split(".")[0] in ("markdown", "bespon", "pygments"))))\n')
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, check=True, text=True,
+                          cwd=pathlib.Path(__file__).resolve().parent.parent)
+    assert json.loads(proc.stdout) == []
+
+
+def test_cmdline_import_time():
+    # The budget is generous, so that only a heavy import at startup, such
+    # as loading Markdown or Pygments eagerly again, makes it fail
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import text2qti.cmdline'],
+                          capture_output=True, check=True, text=True,
+                          cwd=pathlib.Path(__file__).resolve().parent.parent)
+    cumulative_us = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        cumulative_us[name.strip()] = int(cumulative)
+    assert cumulative_us['text2qti.cmdline'] < 1_500_000
+    assert not any(name.split('.')[0] in ('markdown', 'bespon', 'pygments') for name in cumulative_us)
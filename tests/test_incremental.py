@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import pytest
+
+from text2qti.config import Config
+from text2qti.err import Text2qtiError
+from text2qti.qti import QTI
+from text2qti.quiz import Quiz
+
+
+QUIZ = '''\
+Quiz title: Incremental
+
+Text: Some intro text.
+
+1.  What is 1 + 1?
+*a) 2
+b) 3
+... Feedback for 3
+
+2.  What is 1 + 2?
+```{.python .run}
+print('*a) 3')
+print('b) 4')
+```
+
+GROUP
+pick: 1
+points per question: 2
+
+3.  Group question A
+*a) x
+b) y
+
+4.  Group question B
+[*] x
+[ ] y
+END_GROUP
+
+5.  Short answer
+* answer
+
+6.  Other question
+*a) yes
+b) no
+'''
+
+EDITS = [
+    ('Other question', 'Other question edited'),
+    ('Some intro text.', 'Different intro text.'),
+    ("print('b) 4')", "print('b) 5')"),
+    ('Group question B', 'Group question C'),
+    ('5.  Short answer', 'Title: Added\n5.  Short answer'),
+    ('6.  Other question', '```{.python .run}\nprint("... More feedback")\n```\n\n6.  Other question'),
+    ('2.  What is 1 + 2?', '2.  What is 1 + 1?'),
+    ('*a) yes', '*a) 2'),
+]
+
+
+def result(source, config, previous=None):
+    try:
+        quiz = Quiz(source, config=config, previous=previous)
+    except Text2qtiError as e:
+        return str(e)
+    qti = QTI(quiz)
+    return (quiz.points_possible, qti.assessment,
+            [getattr(x, 'source_span', None) for x in quiz.questions_and_delims])
+
+
+@pytest.mark.parametrize('old,new', EDITS)
+def test_incremental_matches_fresh_parse(old, new):
+    config = Config()
+    config['run_code_blocks'] = True
+    previous = Quiz(QUIZ, config=config)
+    previous_result = result(QUIZ, config)
+    source = QUIZ.replace(old, new)
+    assert source != QUIZ
+    assert result(source, config, previous) == result(source, config)
+    # The previous quiz is not modified
+    assert result(QUIZ, config, previous) == previous_result
+    assert [choice.choice_raw for choice in previous.questions_and_delims[2].choices] == ['3', '4']
+
+
+IMAGE_QUIZ = '''\
+Quiz title: Images
+
+1.  What is shown? ![alt](image.png)
+*a) A
+b) B
+
+2.  Other question
+*a) yes
+b) no
+'''
+
+
+def image_result(source, render, previous=None):
+    try:
+        quiz = Quiz(source, config=Config(), render=render, previous=previous)
+    except Text2qtiError as e:
+        return str(e)
+    if render:
+        return (quiz.points_possible, QTI(quiz).assessment, sorted(quiz.images))
+    return [(x.question_raw, getattr(x, 'source_span', None)) for x in quiz.questions_and_delims]
+
+
+@pytest.mark.parametrize('render', [True, False])
+@pytest.mark.parametrize('change', ['modified', 'deleted'])
+def test_incremental_with_changed_image(tmp_path, monkeypatch, render, change):
+    # Blocks with images are reparsed, so changes to image files after the
+    # previous parse are found in both render modes
+    monkeypatch.chdir(tmp_path)
+    image_path = tmp_path / 'image.png'
+    image_path.write_bytes(b'png')
+    previous = Quiz(IMAGE_QUIZ, config=Config(), render=render)
+    if change == 'modified':
+        image_path.write_bytes(b'other png')
+    else:
+        image_path.unlink()
+    source = IMAGE_QUIZ.replace('Other question', 'Other question edited')
+    fresh = image_result(source, render)
+    assert image_result(source, render, previous) == fresh
+    if change == 'deleted':
+        assert 'does not exist' in fresh
+    else:
+        quiz = Quiz(source, config=Config(), render=render, previous=previous)
+        assert quiz.questions_and_delims[0] is not previous.questions_and_delims[0]
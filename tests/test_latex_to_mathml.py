@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import json
+import pathlib
+import shutil
+import subprocess
+
+import pytest
+
+from text2qti.config import Config
+from text2qti.markdown import LaTeXToMathML, Markdown
+
+
+requires_pandoc = pytest.mark.skipif(shutil.which('pandoc') is None, reason='requires Pandoc')
+
+
+LATEX = [
+    'x', 'x^2', 'x_1', 'x_i^2', 'a + b', 'a - b', '-x', '-1', '2x + 3y = 7', '3.14', '.5', 'a/b',
+    r'\frac{1}{2}', r'\frac{a+b}{c}', r'\sqrt{2}', r'\sqrt{x^2 + y^2}',
+    r'\alpha + \beta', r'\theta_0', r'\varepsilon', r'\omega^2',
+    r'a \times b', r'a \cdot b', r'\pm 1', r'x \le y', r'x \neq 0', r'a \approx b', r'x \to \infty',
+    r'x \in A', r'\text{m}', r'\mathrm{kg}', r'a\,b', r'a\quad b',
+    r'e^{i\pi} + 1 = 0', r'10^{-3}',
+]
+# LaTeX outside the supported subset, which is left to Pandoc
+UNSUPPORTED = [r'f(x) = x^2', r'|x| < 1', r'\begin{matrix} a \end{matrix}', r'\sum_{i=1}^n i']
+# LaTeX from siunitx macros
+SIUNITX = [r'\SI{9.81}{m/s^2}', r'\SI{3.0e8}{\meter\per\second}', r'\num{1.5e-3}', r'\si{\kilo\gram}', r'\SI{20}{\celsius}']
+
+
+# Pandoc `--mathml` output for `LATEX` and for the supported LaTeX from
+# `SIUNITX`, so that conversion can be checked without Pandoc.  Generated
+# with `pandoc_mathml()`; Pandoc 3.5 and 3.9 give the same output.
+PANDOC_MATHML_PATH = pathlib.Path(__file__).parent / 'quizzes' / 'pandoc_mathml.json'
+
+
+def pandoc_mathml(latex):
+    proc = subprocess.run(['pandoc', '-f', 'markdown', '-t', 'html', '--mathml'], input=f'${latex}$',
+                          capture_output=True, check=True, encoding='utf8')
+    return Markdown(Config())._html_to_pandoc_mathml(proc.stdout)
+
+
+@requires_pandoc
+@pytest.mark.parametrize('latex', LATEX)
+def test_latex_matches_pandoc(latex):
+    mathml = LaTeXToMathML().convert(latex)
+    assert mathml is not None
+    assert mathml == pandoc_mathml(latex)
+
+
+@pytest.mark.parametrize('latex', UNSUPPORTED)
+def test_unsupported_latex(latex):
+    assert LaTeXToMathML().convert(latex) is None
+
+
+@requires_pandoc
+def test_siunitx_matches_pandoc():
+    latex_list = Markdown(Config()).find_latex([f'${x}$' for x in SIUNITX])
+    supported = [latex for latex in latex_list if LaTeXToMathML().convert(latex) is not None]
+    assert len(supported) >= len(SIUNITX) // 2
+    for latex in supported:
+        assert LaTeXToMathML().convert(latex) == pandoc_mathml(latex)
+
+
+def test_latex_matches_pandoc_corpus():
+    corpus = json.loads(PANDOC_MATHML_PATH.read_text(encoding='utf8'))
+    assert set(LATEX) < set(corpus)
+    for latex, mathml in corpus.items():
+        assert LaTeXToMathML().convert(latex) == mathml
+
+
+@requires_pandoc
+def test_pandoc_corpus_is_current():
+    corpus = json.loads(PANDOC_MATHML_PATH.read_text(encoding='utf8'))
+    for latex, mathml in corpus.items():
+        assert pandoc_mathml(latex) == mathml
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import random
+
+import pytest
+
+from text2qti.config import Config
+from text2qti.markdown import Markdown
+
+
+# Characters that plain text may contain, plus characters and sequences
+# with Markdown, HTML, smarty, or math meaning
+ALPHABET = (['a', 'Z', 'é', 'ß', 'ж', '中', '0', '7', '١', '٣', '²', '½', '_'] +
+            list(' ,.;:?!()%/+=@-') + ['  ', '--', '...', '. ', '1. ', '١. ', '+ ', '- ', '* '] +
+            list('*`$\\<>&[]#"\'~^|{}\t'))
+
+
+def full_render(md, markdown_string, strip_p_tags):
+    html = md.markdown_processor.reset().convert(md.sub_math_siunitx_to_canvas_img(markdown_string))
+    if strip_p_tags:
+        if html.startswith('<p>'):
+            html = html[3:]
+        if html.endswith('</p>'):
+            html = html[:-4]
+    return md.xml_escape(html, squotes=False, dquotes=False)
+
+
+@pytest.mark.parametrize('markdown_string', ['١. item', '1. item', '1.', '+ item', '- item', 'a -- b', 'a...', 'Yes'])
+def test_plain_text_examples(markdown_string):
+    md = Markdown(Config())
+    for strip_p_tags in (False, True):
+        assert md._md_to_html_xml(markdown_string, strip_p_tags) == full_render(md, markdown_string, strip_p_tags)
+
+
+def test_plain_text_fuzz():
+    md = Markdown(Config())
+    rng = random.Random(0)
+    matched = 0
+    for _ in range(20000):
+        markdown_string = ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 8)))
+        # Other strings are always rendered in full
+        if not md.plain_text_re.match(markdown_string):
+            continue
+        matched += 1
+        for strip_p_tags in (False, True):
+            assert md._md_to_html_xml(markdown_string, strip_p_tags) == full_render(md, markdown_string, strip_p_tags), markdown_string
+    # Enough strings take the fast path for this to test it
+    assert matched > 1000
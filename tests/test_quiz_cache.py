@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import hashlib
+import os
+import sys
+
+import pytest
+
+from text2qti.cmdline import main
+from text2qti.config import Config
+from text2qti.qti import QTI
+from text2qti.quiz_cache import QuizCache
+
+
+QUIZ = '''\
+Quiz title: Cache
+
+1.  What is 1 + 1?
+*a) 2
+b) 3
+'''
+
+
+def test_key_includes_code_config(tmp_path):
+    cache = QuizCache(tmp_path / 'cache')
+    digest = hashlib.blake2b(b'quiz').digest()
+    config = Config()
+    key = cache.key(digest, config=config)
+    assert cache.key(digest, config=Config()) == key
+    for k, v in (('run_code_blocks', True), ('code_timeout', 5), ('python_preload_modules', ['numpy'])):
+        other = Config()
+        other[k] = v
+        assert cache.key(digest, config=other) != key
+
+
+def test_cache_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    quiz_path = tmp_path / 'quiz.txt'
+    quiz_path.write_text(QUIZ, encoding='utf8')
+    cache = QuizCache(tmp_path / 'cache')
+    quiz = cache.quiz_from_path(quiz_path, config=Config())
+    assert (cache.hits, cache.misses) == (0, 1)
+    cached = QuizCache(tmp_path / 'cache').quiz_from_path(quiz_path, config=Config())
+    assert QTI(cached).assessment == QTI(quiz).assessment
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX permissions')
+def test_cache_refuses_writable_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    quiz_path = tmp_path / 'quiz.txt'
+    quiz_path.write_text(QUIZ, encoding='utf8')
+    cache_path = tmp_path / 'cache'
+    QuizCache(cache_path).quiz_from_path(quiz_path, config=Config())
+    assert list(cache_path.glob('*.pickle'))
+    cache_path.chmod(0o777)
+    cache = QuizCache(cache_path)
+    cache.quiz_from_path(quiz_path, config=Config())
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_cache_is_opt_in_and_stats_report_hits(tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'xdg'))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    quiz_path = tmp_path / 'quiz.txt'
+    quiz_path.write_text(QUIZ, encoding='utf8')
+    monkeypatch.setattr(sys, 'argv', ['text2qti', '--stats', str(quiz_path)])
+    main()
+    assert not (tmp_path / 'xdg').exists()
+    assert 'Markdown memo:' in capsys.readouterr().err
+    monkeypatch.setattr(sys, 'argv', ['text2qti', '--cache', '--stats', str(quiz_path)])
+    main()
+    assert 'Quiz cache: miss' in capsys.readouterr().err
+    main()
+    err = capsys.readouterr().err
+    assert 'Quiz cache: hit' in err
+    assert '0 hits, 0 misses' not in err
+    assert list((tmp_path / 'xdg' / 'text2qti' / 'quizzes').glob('*.pickle'))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import pathlib
+
+import pytest
+
+from text2qti.config import Config
+from text2qti.markdown import Markdown
+from text2qti.qti import QTI
+from text2qti.quiz import Choice, Question, Quiz, RenderedMarkdown, TextRegion
+
+
+QUIZ_PATH = pathlib.Path(__file__).parent / 'quizzes' / 'all_question_types.txt'
+
+
+@pytest.fixture
+def quiz_dir(monkeypatch):
+    monkeypatch.chdir(QUIZ_PATH.parent)
+
+
+def rendered_attrs(obj):
+    for cls in type(obj).__mro__:
+        for name, value in vars(cls).items():
+            if isinstance(value, RenderedMarkdown):
+                yield name, value.raw_attr
+
+
+def objects(quiz):
+    for x in quiz.questions_and_delims:
+        if isinstance(x, (Question, TextRegion)):
+            yield x
+        if isinstance(x, Question):
+            yield from x.choices
+
+
+def test_lazy_matches_eager_rendering(quiz_dir):
+    # Without rendering during parsing, HTML is converted on first access
+    quiz = Quiz.from_path(QUIZ_PATH, config=Config(), render=False)
+    md = Markdown(Config())
+    count = 0
+    for obj in objects(quiz):
+        for name, raw_attr in rendered_attrs(obj):
+            raw = getattr(obj, raw_attr)
+            if raw is not None:
+                assert getattr(obj, name) == md.md_to_html_xml(raw)
+                count += 1
+    assert count > 30
+    assert any(isinstance(obj, Choice) and obj.feedback_raw is not None for obj in objects(quiz))
+
+
+def test_lazy_matches_rendered_quiz(quiz_dir):
+    rendered = list(objects(Quiz.from_path(QUIZ_PATH, config=Config())))
+    lazy = list(objects(Quiz.from_path(QUIZ_PATH, config=Config(), render=False)))
+    assert len(lazy) == len(rendered)
+    for lazy_obj, rendered_obj in zip(lazy, rendered):
+        for name, _ in rendered_attrs(rendered_obj):
+            assert getattr(lazy_obj, name) == getattr(rendered_obj, name)
+
+
+def test_low_memory_qti_is_identical(quiz_dir):
+    assessment = QTI(Quiz.from_path(QUIZ_PATH, config=Config())).assessment
+    assert QTI(Quiz.from_path(QUIZ_PATH, config=Config(), low_memory=True)).assessment == assessment
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import random
+import re
+
+import pytest
+
+from text2qti.quiz import (no_content, start_missing_content_re, start_missing_whitespace_re,
+                           start_patterns, start_re)
+
+
+# Single regex alternations of all start patterns, which the matchers
+# replace
+ALTERNATIONS = {
+    'start_re': (start_re, re.compile('|'.join(r'(?P<{0}>{1}[ \t]+(?=\S))'.format(name, pattern)
+                                               if name not in no_content else
+                                               r'(?P<{0}>{1}\s*)$'.format(name, pattern)
+                                               for name, pattern in start_patterns.items()))),
+    'start_missing_content_re': (start_missing_content_re,
+                                 re.compile('|'.join(r'(?P<{0}>{1}[ \t]*$)'.format(name, pattern)
+                                                     for name, pattern in start_patterns.items()
+                                                     if name not in no_content))),
+    'start_missing_whitespace_re': (start_missing_whitespace_re,
+                                    re.compile('|'.join(r'(?P<{0}>{1}(?=\S))'.format(name, pattern)
+                                                        for name, pattern in start_patterns.items()
+                                                        if name not in no_content))),
+}
+
+LINE_STARTS = ['1.', '12.', '١.', '*a)', 'a)', 'B)', '[*]', '[ ]', '*', '...', '+', '-', '!', '___', '^^^',
+               '=', 'Title:', 'title:', 'Points:', 'Text title:', 'Text:', 'Quiz title:', 'Quiz description:',
+               'GROUP', 'END_GROUP', 'pick:', 'solutions pick:', 'points per question:', '```', '```{.python .run}',
+               'shuffle answers:', 'show correct answers:', 'one question at a time:', "can't go back:",
+               'feedback is solution:', 'solutions sample groups:', 'solutions randomize groups:',
+               '    ', '\t', '', 'x', 'Q', 'T', 'S']
+LINE_ENDS = ['', ' ', '  ', '\t', ' text', 'text', ' \t', ' x y', '\n', ' true']
+
+
+def match_result(match):
+    if match is None:
+        return None
+    # Each matcher regex only has groups for some patterns, so unmatched
+    # groups are omitted
+    return (match.lastgroup, match.span(), {k: v for k, v in match.groupdict().items() if v is not None})
+
+
+@pytest.mark.parametrize('name', ALTERNATIONS)
+def test_matchers_equal_alternations(name):
+    matcher, alternation = ALTERNATIONS[name]
+    lines = [start + end for start in LINE_STARTS for end in LINE_ENDS]
+    rng = random.Random(0)
+    for _ in range(20000):
+        lines.append(''.join(rng.choice(LINE_STARTS + LINE_ENDS) for _ in range(rng.randint(1, 3))))
+    for line in lines:
+        assert match_result(matcher.match(line)) == match_result(alternation.match(line)), repr(line)
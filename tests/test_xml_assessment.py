@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import pathlib
+
+import pytest
+
+from text2qti.config import Config
+from text2qti.qti import QTI
+from text2qti.quiz import Question, Quiz
+from text2qti.xml_assessment import _ITEM_EMITTERS
+
+
+QUIZZES_PATH = pathlib.Path(__file__).parent / 'quizzes'
+
+
+@pytest.mark.parametrize('name', ['all_question_types', 'feedback'])
+def test_assessment_matches_expected(name, monkeypatch):
+    # Expected output was generated with the original template-based
+    # assessment(), before per-type item emitters
+    monkeypatch.chdir(QUIZZES_PATH)
+    quiz = Quiz.from_path(QUIZZES_PATH / f'{name}.txt', config=Config())
+    expected = (QUIZZES_PATH / f'{name}.assessment.xml').read_text(encoding='utf8')
+    assert QTI(quiz).assessment == expected
+
+
+def test_every_question_type_is_covered(monkeypatch):
+    monkeypatch.chdir(QUIZZES_PATH)
+    types = set()
+    for name in ('all_question_types', 'feedback'):
+        quiz = Quiz.from_path(QUIZZES_PATH / f'{name}.txt', config=Config())
+        types.update(x.type for x in quiz.questions_and_delims if isinstance(x, Question))
+    assert types == set(_ITEM_EMITTERS)
@@ -19,9 +19,11 @@ import textwrap
 from .version import __version__ as version
 from .err import Text2qtiError
 from .config import Config
+from .code_cache import CodeOutputCache
+from .mathml_cache import MathMLCache, shared_cache_dir
 from .quiz import Quiz
+from .quiz_cache import QuizCache
 from .qti import QTI
-from .export import quiz_to_pandoc
 
 
 
@@ -37,8 +39,40 @@ def main():
                         help='URL for rendering LaTeX equations')
     parser.add_argument('--run-code-blocks', action='store_const', const=True,
                         help='Allow special code blocks to be executed and insert their output (off by default for security)')
+    parser.add_argument('--cache-code-output', action='store_const', const=True,
+                        help=f'Save the output of code blocks in "{CodeOutputCache.default_path}" in the quiz file directory, and reuse it when the code, executable, and seed are unchanged '
+                             '(only use this for code blocks that give the same output each time, for example with a "seed=" attribute)')
+    parser.add_argument('--python-fork-server', action='store_const', const=True,
+                        help='Run Python code blocks by forking a warm Python process, rather than starting a new Python process for each block (not available on Windows)')
+    parser.add_argument('--python-preload', action='append', metavar='MODULE',
+                        help='Import a module once in the warm Python process used by --python-fork-server (can be used multiple times)')
+    parser.add_argument('--code-timeout', type=float, metavar='SECONDS',
+                        help='Stop any code block that runs longer than SECONDS (wall-clock time), and report an error')
+    parser.add_argument('--code-quiz-timeout', type=float, metavar='SECONDS',
+                        help='Stop running code blocks, and report an error, once SECONDS (wall-clock time) have passed since processing of a quiz started')
+    parser.add_argument('--code-memory-limit', type=int, metavar='MB',
+                        help='Limit the address space of each code block to MB megabytes (Linux only)')
+    parser.add_argument('--code-cpu-limit', type=float, metavar='SECONDS',
+                        help='Limit the CPU time of each code block to SECONDS, rounded up to whole seconds (Linux only)')
     parser.add_argument('--pandoc-mathml', action='store_const', const=True,
-                        help='Convert LaTeX math to MathML using Pandoc (this will create a cache file "_text2qti_cache.zip" in the quiz file directory)')
+                        help=f'Convert LaTeX math to MathML using Pandoc (this will create a cache file "{MathMLCache.default_path}" in the quiz file directory)')
+    parser.add_argument('--mathml-cache', choices=['directory', 'shared'],
+                        help=f'Where --pandoc-mathml caches MathML: "directory" uses "{MathMLCache.default_path}" in the quiz file directory (default), '
+                             f'and "shared" uses one cache for all quizzes in "{shared_cache_dir()}" (under $XDG_CACHE_HOME when it is set)')
+    parser.add_argument('--mathml-cache-max-size', type=int, metavar='MB',
+                        help='Limit the shared MathML cache to MB megabytes by removing the least recently used equations (default 64)')
+    parser.add_argument('--pandoc-server', action='store_const', const=True,
+                        help='Run Pandoc once as a long-lived process ("pandoc lua", over pipes) for LaTeX to MathML and HTML solutions, '
+                             'rather than once per conversion (requires a recent Pandoc, and otherwise runs Pandoc for each conversion)')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='Render Markdown for large quizzes using N worker processes, and run up to N code blocks at a time (default 1)')
+    parser.add_argument('--cache', action='store_true',
+                        help=f'Cache parsed quizzes in "{shared_cache_dir() / QuizCache.default_dirname}", so that unchanged quizzes '
+                             'go straight to QTI packaging')
+    parser.add_argument('--cache-code-blocks', action='store_true',
+                        help='With --cache, also cache quizzes with executable code blocks, so that code is not run again until the quiz changes')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print statistics for the quiz cache and the memo of rendered Markdown strings')
     soln_group = parser.add_mutually_exclusive_group()
     soln_group.add_argument('--solutions', action='append', metavar='SOLUTIONS_FILE',
                             help='Save solutions in Pandoc Markdown (.md), PDF (.pdf), or HTML (.html) format, and also create a QTI file. '
@@ -89,19 +123,35 @@ def main():
         config['latex_render_url'] = args.latex_render_url
     if args.run_code_blocks is not None:
         config['run_code_blocks'] = args.run_code_blocks
+    if args.cache_code_output is not None:
+        config['cache_code_output'] = args.cache_code_output
+    if args.python_fork_server is not None:
+        config['python_fork_server'] = args.python_fork_server
+    if args.python_preload is not None:
+        config['python_preload_modules'] = args.python_preload
+    for key in ('code_timeout', 'code_quiz_timeout', 'code_memory_limit', 'code_cpu_limit'):
+        value = getattr(args, key)
+        if value is not None:
+            if value <= 0:
+                raise Text2qtiError(f'--{key.replace("_", "-")} must be positive')
+            config[key] = value
     if args.pandoc_mathml is not None:
         config['pandoc_mathml'] = args.pandoc_mathml
+    if args.mathml_cache is not None:
+        config['mathml_cache'] = args.mathml_cache
+    if args.mathml_cache_max_size is not None:
+        if args.mathml_cache_max_size <= 0:
+            raise Text2qtiError('--mathml-cache-max-size must be positive')
+        config['mathml_cache_max_size'] = args.mathml_cache_max_size
+    if args.pandoc_server is not None:
+        config['pandoc_server'] = args.pandoc_server
+    if args.jobs < 1:
+        raise Text2qtiError('--jobs must be a positive integer')
 
     file_path = pathlib.Path(args.file).expanduser()
     file_path_abs = file_path.absolute()
-    try:
-        text = file_path.read_text(encoding='utf-8-sig')  # Handle BOM for Windows
-    except FileNotFoundError:
+    if not file_path.is_file():
         raise Text2qtiError(f'File "{file_path}" does not exist')
-    except PermissionError as e:
-        raise Text2qtiError(f'File "{file_path}" cannot be read due to permission error:\n{e}')
-    except UnicodeDecodeError as e:
-        raise Text2qtiError(f'File "{file_path}" is not encoded in valid UTF-8:\n{e}')
 
     cwd = pathlib.Path.cwd()
     if args.solutions:
@@ -123,8 +173,15 @@ def main():
     try:
         # Quiz and any solutions should only be generated once each so that
         # any randomization is only invoked once.
-        quiz = Quiz(text, config=config, source_name=file_path.as_posix())
+        # The quiz file is streamed rather than read into memory up front.
+        if args.cache:
+            quiz_cache = QuizCache(include_code=args.cache_code_blocks)
+            quiz = quiz_cache.quiz_from_path(file_path_abs, config=config, source_name=file_path.as_posix(), jobs=args.jobs)
+        else:
+            quiz_cache = None
+            quiz = Quiz.from_path(file_path_abs, config=config, source_name=file_path.as_posix(), jobs=args.jobs)
         if solutions_paths is not None:
+            from .export import quiz_to_pandoc
             solutions_text = quiz_to_pandoc(quiz, solutions=True)
             for solutions_path in solutions_paths:
                 if solutions_path.suffix.lower() == '.pdf':
@@ -149,6 +206,16 @@ def main():
                 elif solutions_path.suffix.lower() == '.html':
                     if not shutil.which('pandoc'):
                         raise Text2qtiError('Exporting solutions in HTML format requires Pandoc (https://pandoc.org/)')
+                    if config['pandoc_server']:
+                        from .pandoc_server import get_pandoc_server
+                        pandoc_server = get_pandoc_server()
+                        if pandoc_server is not None:
+                            solutions_html = pandoc_server.convert(solutions_text, {'from': 'markdown', 'to': 'html',
+                                                                                    'html-math-method': 'mathjax',
+                                                                                    'standalone': True})
+                            if solutions_html is not None:
+                                solutions_path.write_text(solutions_html, encoding='utf8')
+                                continue
                     if platform.system() == 'Windows':
                         cmd = [shutil.which('pandoc'), '-f', 'markdown', '-o', str(solutions_path), '--mathjax', '-s']
                     else:
@@ -172,3 +239,13 @@ def main():
             qti.save(qti_path)
     finally:
         os.chdir(cwd)
+    if args.stats:
+        if quiz_cache is not None:
+            print(f'Quiz cache: {"hit" if quiz_cache.hits else "miss"}', file=sys.stderr)
+        if quiz_cache is not None and quiz_cache.hits:
+            print('Markdown memo: not used, since the quiz was loaded from the quiz cache', file=sys.stderr)
+        else:
+            memo_info = quiz.md.memo_info()
+            print(f'Markdown memo: {memo_info.hits} hits, {memo_info.misses} misses '
+                  f'({memo_info.hit_rate:.1%} hit rate)',
+                  file=sys.stderr)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import hashlib
+import os
+import pathlib
+import tempfile
+from typing import Optional, Union
+
+
+
+
+class CodeOutputCache(object):
+    '''
+    On-disk cache of the output of executable code blocks, so that unchanged
+    code blocks are not run again when a quiz is rebuilt.
+
+    Entries are keyed on a hash of the code, the resolved path of the
+    executable, and the seed from the code block's `seed=` attribute, if
+    any.  Only output from code that runs successfully is cached.  Since a
+    cached block gives the same output every time, this is only appropriate
+    for code that is deterministic given its seed, which is why the cache is
+    opt-in.  When the total size of all entries exceeds `max_bytes`, the
+    least recently used entries are deleted.
+    '''
+    default_path = pathlib.Path('_text2qti_code_cache')
+    default_max_bytes = 50*1024**2
+    entry_suffix = '.out'
+
+    def __init__(self, path: Optional[Union[str, pathlib.Path]]=None, *,
+                 max_bytes: Optional[int]=None):
+        if path is None:
+            path = self.default_path
+        elif isinstance(path, str):
+            path = pathlib.Path(path)
+        elif not isinstance(path, pathlib.Path):
+            raise TypeError
+        self.path = path
+        self.max_bytes = self.default_max_bytes if max_bytes is None else max_bytes
+
+
+    def key(self, code: str, *, executable: str, seed: Optional[str]=None) -> str:
+        '''
+        Cache key for code run with an executable, which should be a resolved
+        path, and an optional seed.
+        '''
+        h = hashlib.blake2b(code.encode('utf8'))
+        for x in (executable, seed):
+            h.update(h.digest())
+            h.update(repr(x).encode('utf8'))
+        return h.hexdigest()[:64]
+
+
+    def _entry_path(self, key: str) -> pathlib.Path:
+        return self.path / f'{key}{self.entry_suffix}'
+
+
+    def get(self, key: str) -> Optional[str]:
+        '''
+        Return the cached output for a key, or `None` if there is no entry.
+        '''
+        entry_path = self._entry_path(key)
+        try:
+            # newline='' gives output exactly as saved
+            with entry_path.open(encoding='utf8', newline='') as f:
+                output = f.read()
+        except FileNotFoundError:
+            return None
+        except (OSError, UnicodeDecodeError):
+            self._unlink(entry_path)
+            return None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return output
+
+
+    def put(self, key: str, output: str):
+        '''
+        Save output under a key.  Failing to write to the cache is not an
+        error, since the cache is only an optimization.
+        '''
+        try:
+            self.path.mkdir(exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            # newline='' keeps output exactly as given
+            with os.fdopen(fd, 'w', encoding='utf8', newline='') as f:
+                f.write(output)
+            os.replace(temp_path, self._entry_path(key))
+        except Exception:
+            self._unlink(pathlib.Path(temp_path))
+            return
+        self._evict()
+
+
+    def _unlink(self, path: pathlib.Path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        '''
+        Delete least recently used entries until the cache is within its size
+        limit.
+        '''
+        entries = []
+        total_bytes = 0
+        for entry_path in self.path.glob(f'*{self.entry_suffix}'):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total_bytes += stat.st_size
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            self._unlink(entry_path)
+            total_bytes -= size
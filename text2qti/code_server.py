@@ -0,0 +1,604 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020-2021, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+'''
+Long-lived Python processes for executing code blocks.  A fork server
+imports a list of modules once and then forks a fresh child process for each
+code block, so that each block runs in a clean interpreter without paying
+for interpreter startup and imports again.  A session runs a sequence of
+code blocks in one shared namespace.
+'''
+
+
+import atexit
+import concurrent.futures
+import json
+import math
+import os
+import pathlib
+import subprocess
+import sys
+import textwrap
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+from .err import Text2qtiError
+
+
+
+
+# Source for the server, which is run with `python -c` so that it works with
+# any Python 3 executable, whether or not text2qti is installed for it.
+#
+# Requests and replies are single lines of JSON on the server's stdin and
+# original stdout.  The server's own stdout is redirected to the null device,
+# so that output from imports cannot corrupt replies.  Each request has an
+# id, and its reply is sent with the same id once its child exits, so that
+# several children can run at once.  Each child redirects stdin to the null
+# device and stdout/stderr to files, runs the code as `__main__`, and exits
+# with the same exit code that `python <file>` would give.  Resource limits
+# in a request are applied to its child as soft limits, and a request
+# `{"kill": id}` kills the child that is running the request with that id.
+_server_source = textwrap.dedent(r'''
+    import json
+    import os
+    import signal
+    import sys
+    import threading
+    import traceback
+    import types
+
+    reply_file = os.fdopen(os.dup(1), 'wb')
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 1)
+    send_lock = threading.Lock()
+
+    def send(reply):
+        with send_lock:
+            reply_file.write(json.dumps(reply).encode('utf8') + b'\n')
+            reply_file.flush()
+
+    def set_rlimits(rlimits):
+        if rlimits:
+            import resource
+            for name, value in rlimits.items():
+                limit = getattr(resource, name)
+                hard = resource.getrlimit(limit)[1]
+                if hard != resource.RLIM_INFINITY:
+                    value = min(value, hard)
+                resource.setrlimit(limit, (value, hard))
+
+    for module_name in json.loads(sys.argv[1]):
+        try:
+            __import__(module_name)
+        except BaseException:
+            send({'error': traceback.format_exc()})
+            sys.exit(1)
+    send({'ready': True})
+
+    def run_child(request):
+        os.dup2(null_fd, 0)
+        stdout_fd = os.open(request['stdout'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(stdout_fd, 1)
+        stderr_fd = os.open(request['stderr'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(stderr_fd, 2)
+        # The reply file may be locked by the reaper thread, which does not
+        # exist in the child, so it is closed at the descriptor level
+        os.close(reply_file.fileno())
+        sys.stdin = open(os.devnull)
+        code_path = request['path']
+        returncode = 0
+        try:
+            set_rlimits(request['rlimits'])
+            os.chdir(request['cwd'])
+            if request['env'] is not None:
+                os.environ.clear()
+                os.environ.update(request['env'])
+            sys.argv = [code_path]
+            sys.path[0] = os.path.dirname(code_path)
+            # Forked children share the random state of the server.  Python's
+            # random module reseeds itself after fork, but NumPy's global
+            # generator does not.
+            if 'numpy' in sys.modules:
+                sys.modules['numpy'].random.seed()
+            with open(code_path, 'rb') as f:
+                code = compile(f.read(), code_path, 'exec')
+            main_module = types.ModuleType('__main__')
+            main_module.__file__ = code_path
+            main_module.__builtins__ = __builtins__
+            sys.modules['__main__'] = main_module
+            exec(code, main_module.__dict__)
+        except SystemExit as e:
+            if e.code is None:
+                returncode = 0
+            elif isinstance(e.code, int):
+                returncode = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            while exc_tb is not None and exc_tb.tb_frame.f_code.co_filename != code_path:
+                exc_tb = exc_tb.tb_next
+            traceback.print_exception(exc_type, exc_value, exc_tb)
+            returncode = 1
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            pass
+        os._exit(returncode)
+
+    children_lock = threading.Lock()
+    children = {}
+    child_started = threading.Semaphore(0)
+
+    def reap():
+        while True:
+            child_started.acquire()
+            pid, status = os.wait()
+            with children_lock:
+                request_id = children.pop(pid)
+            if os.WIFSIGNALED(status):
+                returncode = -os.WTERMSIG(status)
+            else:
+                returncode = os.WEXITSTATUS(status)
+            send({'id': request_id, 'returncode': returncode})
+
+    threading.Thread(target=reap, daemon=True).start()
+
+    for line in sys.stdin.buffer:
+        request = json.loads(line)
+        if 'kill' in request:
+            with children_lock:
+                for pid, request_id in children.items():
+                    if request_id == request['kill']:
+                        os.kill(pid, signal.SIGKILL)
+            continue
+        sys.stdout.flush()
+        sys.stderr.flush()
+        with children_lock:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    run_child(request)
+                finally:
+                    os._exit(1)
+            children[pid] = request['id']
+        child_started.release()
+    ''')
+
+
+
+
+class PythonForkServer(object):
+    '''
+    Python process that imports `preload_modules` once and then runs each
+    code file in a forked child process.  `.run()` gives the same exit code,
+    stdout, and stderr as running the file with `executable`.
+
+    Servers are only available on platforms with `os.fork()`.  If the server
+    cannot be started, `.available` is false and the caller should run code
+    in a subprocess instead.
+    '''
+    def __init__(self, executable: str, preload_modules: Iterable[str]=()):
+        self.executable = executable
+        self.preload_modules = tuple(preload_modules)
+        self.available = False
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self._reader: Optional[threading.Thread] = None
+        # Futures for exit codes of running requests, by request id
+        self._pending: Dict[int, concurrent.futures.Future] = {}
+        self._next_id = 0
+        if not hasattr(os, 'fork'):
+            return
+        try:
+            self._proc = subprocess.Popen([executable, '-c', _server_source, json.dumps(self.preload_modules)],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL)
+        except Exception:
+            return
+        reply = self._read_reply()
+        if reply is None or 'error' in reply:
+            self.close()
+            if reply is not None:
+                raise Text2qtiError(f'Failed to import modules {list(self.preload_modules)} for executing code:\n{reply["error"]}')
+            return
+        self.available = True
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+
+    def _read_reply(self) -> Optional[dict]:
+        try:
+            line = self._proc.stdout.readline()
+            return json.loads(line)
+        except Exception:
+            return None
+
+
+    def _read_replies(self):
+        while True:
+            reply = self._read_reply()
+            if reply is None:
+                break
+            with self._lock:
+                future = self._pending.pop(reply['id'])
+            future.set_result(reply['returncode'])
+        with self._lock:
+            self.available = False
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(Text2qtiError('Python code server exited unexpectedly'))
+
+
+    def run(self, code_path: pathlib.Path, *, env: Optional[Dict[str, str]]=None,
+            rlimits: Optional[Dict[str, int]]=None, timeout: Optional[float]=None) -> Tuple[int, bytes, bytes]:
+        '''
+        Run a code file in a fresh child of the server, with the current
+        working directory and, like `subprocess.run()`, with environment
+        `env` if it is given.  `rlimits` are soft resource limits for the
+        child, from `resource_limits()`.  Return exit code, stdout, and
+        stderr.  If the child runs longer than `timeout` seconds, it is killed
+        and `subprocess.TimeoutExpired` is raised.  This may be called from
+        multiple threads, and the code files then run in parallel.
+        '''
+        stdout_path = code_path.with_suffix('.stdout')
+        stderr_path = code_path.with_suffix('.stderr')
+        request = {
+            'path': str(code_path.resolve()),
+            'cwd': os.getcwd(),
+            'stdout': str(stdout_path.resolve()),
+            'stderr': str(stderr_path.resolve()),
+            'env': env,
+            'rlimits': rlimits,
+        }
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            if not self.available:
+                raise Text2qtiError('Python code server is not running')
+            request['id'] = self._next_id
+            self._next_id += 1
+            self._pending[request['id']] = future
+            try:
+                self._send(request)
+            except OSError:
+                del self._pending[request['id']]
+                raise Text2qtiError('Python code server exited unexpectedly')
+        try:
+            returncode = future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                try:
+                    self._send({'kill': request['id']})
+                except OSError:
+                    pass
+            # Wait for the child to be reaped, so that its output files are
+            # no longer in use
+            future.result()
+            raise subprocess.TimeoutExpired(request['path'], timeout)
+        return returncode, stdout_path.read_bytes(), stderr_path.read_bytes()
+
+
+    def _send(self, request: dict):
+        self._proc.stdin.write(json.dumps(request).encode('utf8') + b'\n')
+        self._proc.stdin.flush()
+
+
+    def close(self):
+        self.available = False
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        if self._reader is not None:
+            self._reader.join()
+        self._proc.stdout.close()
+        self._proc = None
+
+
+
+
+# Source for a session, which runs code files one at a time in a single
+# namespace.  The protocol is the same as for the server, except that
+# requests are handled in order, and each reply is sent once its code has
+# run.  stdout and stderr are redirected to files while each code file runs.
+# A CPU time limit in a request applies to that request only, while other
+# resource limits apply to the session from then on.
+_session_source = textwrap.dedent(r'''
+    import json
+    import os
+    import sys
+    import traceback
+    import types
+
+    reply_file = os.fdopen(os.dup(1), 'wb')
+    request_file = os.fdopen(os.dup(0), 'rb')
+    null_fd = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null_fd, 0)
+    os.dup2(null_fd, 1)
+    sys.stdin = open(os.devnull)
+
+    def send(reply):
+        reply_file.write(json.dumps(reply).encode('utf8') + b'\n')
+        reply_file.flush()
+
+    def set_rlimits(rlimits):
+        if rlimits:
+            import resource
+            for name, value in rlimits.items():
+                limit = getattr(resource, name)
+                if limit == resource.RLIMIT_CPU:
+                    # CPU time is limited per request, rather than for the
+                    # life of the session
+                    usage = resource.getrusage(resource.RUSAGE_SELF)
+                    value += int(usage.ru_utime + usage.ru_stime) + 1
+                hard = resource.getrlimit(limit)[1]
+                if hard != resource.RLIM_INFINITY:
+                    value = min(value, hard)
+                resource.setrlimit(limit, (value, hard))
+
+    main_module = types.ModuleType('__main__')
+    main_module.__builtins__ = __builtins__
+    sys.modules['__main__'] = main_module
+    send({'ready': True})
+
+    for line in request_file:
+        request = json.loads(line)
+        code_path = request['path']
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_stdout_fd = os.dup(1)
+        saved_stderr_fd = os.dup(2)
+        stdout_fd = os.open(request['stdout'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(stdout_fd, 1)
+        os.close(stdout_fd)
+        stderr_fd = os.open(request['stderr'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.dup2(stderr_fd, 2)
+        os.close(stderr_fd)
+        returncode = 0
+        exited = False
+        try:
+            set_rlimits(request['rlimits'])
+            os.chdir(request['cwd'])
+            if request['seed'] is None:
+                os.environ.pop('TEXT2QTI_SEED', None)
+            else:
+                os.environ['TEXT2QTI_SEED'] = request['seed']
+            sys.argv = [code_path]
+            sys.path[0] = os.path.dirname(code_path)
+            main_module.__file__ = code_path
+            with open(code_path, 'rb') as f:
+                code = compile(f.read(), code_path, 'exec')
+            exec(code, main_module.__dict__)
+        except SystemExit as e:
+            exited = True
+            if e.code is None:
+                returncode = 0
+            elif isinstance(e.code, int):
+                returncode = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            while exc_tb is not None and exc_tb.tb_frame.f_code.co_filename != code_path:
+                exc_tb = exc_tb.tb_next
+            traceback.print_exception(exc_type, exc_value, exc_tb)
+            returncode = 1
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            pass
+        os.dup2(saved_stdout_fd, 1)
+        os.close(saved_stdout_fd)
+        os.dup2(saved_stderr_fd, 2)
+        os.close(saved_stderr_fd)
+        send({'returncode': returncode, 'exited': exited})
+        if exited:
+            break
+    ''')
+
+
+
+
+class PythonSession(object):
+    '''
+    Python process that runs code files one at a time in a single
+    namespace, so that imports, variables, and functions from one code
+    block are available in later blocks.  `.run()` gives the exit code,
+    stdout, and stderr for each file.  If code calls `sys.exit()`, the
+    session ends, and later code cannot be run in it.
+    '''
+    def __init__(self, executable: str, name: str, *, startupinfo=None):
+        self.executable = executable
+        self.name = name
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        self.available = False
+        try:
+            self._proc = subprocess.Popen([executable, '-c', _session_source],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, startupinfo=startupinfo)
+        except FileNotFoundError as e:
+            raise Text2qtiError(f'Failed to start code session "{name}" (missing executable "{executable}"?):\n{e}')
+        except Exception as e:
+            raise Text2qtiError(f'Failed to start code session "{name}" with executable "{executable}":\n{e}')
+        if self._read_reply() is None:
+            self.close()
+            raise Text2qtiError(f'Failed to start code session "{name}" with executable "{executable}"')
+        self.available = True
+
+
+    def _read_reply(self) -> Optional[dict]:
+        try:
+            line = self._proc.stdout.readline()
+            return json.loads(line)
+        except Exception:
+            return None
+
+
+    def run(self, code_path: pathlib.Path, *, seed: Optional[str]=None,
+            rlimits: Optional[Dict[str, int]]=None, timeout: Optional[float]=None) -> Tuple[int, bytes, bytes]:
+        '''
+        Run a code file in the session, with the current working directory.
+        If `seed` is given, it is available in the environment variable
+        `TEXT2QTI_SEED`.  `rlimits` are soft resource limits from
+        `resource_limits()`.  Return exit code, stdout, and stderr.  If the
+        code runs longer than `timeout` seconds, the session is killed and
+        `subprocess.TimeoutExpired` is raised.  If the session is killed by a
+        signal, for example because a CPU time limit is reached, the session
+        ends and the exit code is negative, as with `subprocess.run()`.
+        '''
+        stdout_path = code_path.with_suffix('.stdout')
+        stderr_path = code_path.with_suffix('.stderr')
+        request = {
+            'path': str(code_path.resolve()),
+            'cwd': os.getcwd(),
+            'stdout': str(stdout_path.resolve()),
+            'stderr': str(stderr_path.resolve()),
+            'seed': seed,
+            'rlimits': rlimits,
+        }
+        with self._lock:
+            if not self.available:
+                raise Text2qtiError(f'Code session "{self.name}" has ended, so code cannot be run in it')
+            timer = None
+            timed_out = threading.Event()
+            if timeout is not None:
+                def kill():
+                    timed_out.set()
+                    self._proc.kill()
+                timer = threading.Timer(timeout, kill)
+                timer.start()
+            try:
+                self._proc.stdin.write(json.dumps(request).encode('utf8') + b'\n')
+                self._proc.stdin.flush()
+            except OSError:
+                reply = None
+            else:
+                reply = self._read_reply()
+            if timer is not None:
+                timer.cancel()
+            if reply is None:
+                returncode = self._proc.wait()
+                self.close()
+                if timed_out.is_set():
+                    raise subprocess.TimeoutExpired(request['path'], timeout)
+                if returncode >= 0:
+                    raise Text2qtiError(f'Code session "{self.name}" exited unexpectedly')
+                reply = {'returncode': returncode, 'exited': True}
+            elif reply['exited']:
+                self.close()
+        return reply['returncode'], stdout_path.read_bytes(), stderr_path.read_bytes()
+
+
+    def close(self):
+        self.available = False
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc.stdout.close()
+        self._proc = None
+
+
+
+
+def resource_limits(*, memory_limit: Optional[int]=None, cpu_limit: Optional[float]=None) -> Dict[str, int]:
+    '''
+    Resource limits for code, as a dict of names from the `resource` module
+    and values:  address space from a memory limit in megabytes, and CPU time
+    from a limit in seconds.  Limits are only supported on Linux, so on
+    other platforms the dict is empty.
+    '''
+    rlimits = {}
+    if not sys.platform.startswith('linux'):
+        return rlimits
+    if memory_limit is not None:
+        rlimits['RLIMIT_AS'] = memory_limit*1024**2
+    if cpu_limit is not None:
+        rlimits['RLIMIT_CPU'] = math.ceil(cpu_limit)
+    return rlimits
+
+
+# Source for a launcher that applies resource limits to itself as soft limits
+# and then replaces itself with a command, so that the limits apply before the
+# command starts.  It is used instead of `subprocess.Popen(preexec_fn=...)`,
+# which is not safe when code runs in several threads at once.
+_limits_launcher_source = textwrap.dedent(r'''
+    import json
+    import os
+    import resource
+    import sys
+
+    for name, value in json.loads(sys.argv[1]).items():
+        limit = getattr(resource, name)
+        hard = resource.getrlimit(limit)[1]
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(limit, (value, hard))
+    os.execv(sys.argv[2], sys.argv[2:])
+    ''')
+
+
+def resource_limits_command(rlimits: Dict[str, int], cmd: List[str]) -> List[str]:
+    '''
+    Command that runs `cmd` under resource limits from `resource_limits()`.
+    The first element of `cmd` must be the full path to an executable.  If
+    there are no limits, `cmd` is returned unchanged.
+    '''
+    if not rlimits:
+        return cmd
+    return [sys.executable, '-c', _limits_launcher_source, json.dumps(rlimits)] + cmd
+
+
+
+
+_servers: Dict[Tuple[str, Tuple[str, ...]], PythonForkServer] = {}
+_servers_lock = threading.Lock()
+
+def get_python_fork_server(executable: str, preload_modules: Iterable[str]=()) -> Optional[PythonForkServer]:
+    '''
+    Return a running server for an executable and set of preloaded modules,
+    starting one if necessary.  Servers last for the life of the process.
+    Return `None` if a server is not available.
+    '''
+    key = (executable, tuple(preload_modules))
+    with _servers_lock:
+        server = _servers.get(key)
+        if server is None:
+            server = PythonForkServer(executable, preload_modules)
+            _servers[key] = server
+    # A server that could not start, or that has exited, is not restarted
+    if not server.available:
+        return None
+    return server
+
+@atexit.register
+def _close_servers():
+    for server in _servers.values():
+        server.close()
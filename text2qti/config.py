@@ -8,7 +8,6 @@
 #
 
 
-import bespon
 import pathlib
 import textwrap
 import warnings
@@ -17,6 +16,12 @@ from .err import Text2qtiError
 
 
 
+def _is_positive_number(x) -> bool:
+    return isinstance(x, (int, float)) and not isinstance(x, bool) and x > 0
+
+
+
+
 class Config(dict):
     '''
     Dict-like configuration that raises an error when invalid keys are set.
@@ -31,12 +36,32 @@ class Config(dict):
     _defaults = {
         'latex_render_url': '/equation_images/',
         'pandoc_mathml': False,
+        'pandoc_server': False,
+        'mathml_cache': 'directory',
+        'mathml_cache_max_size': 64,
         'run_code_blocks': False,
+        'cache_code_output': False,
+        'python_fork_server': False,
+        'python_preload_modules': [],
+        'code_timeout': None,
+        'code_quiz_timeout': None,
+        'code_memory_limit': None,
+        'code_cpu_limit': None,
     }
     _key_check = {
         'latex_render_url': lambda x: isinstance(x, str),
         'pandoc_mathml': lambda x: isinstance(x, bool),
+        'pandoc_server': lambda x: isinstance(x, bool),
+        'mathml_cache': lambda x: x in ('directory', 'shared'),
+        'mathml_cache_max_size': lambda x: isinstance(x, int) and _is_positive_number(x),
         'run_code_blocks': lambda x: isinstance(x, bool),
+        'cache_code_output': lambda x: isinstance(x, bool),
+        'python_fork_server': lambda x: isinstance(x, bool),
+        'python_preload_modules': lambda x: isinstance(x, list) and all(isinstance(y, str) for y in x),
+        'code_timeout': lambda x: x is None or _is_positive_number(x),
+        'code_quiz_timeout': lambda x: x is None or _is_positive_number(x),
+        'code_memory_limit': lambda x: x is None or (isinstance(x, int) and _is_positive_number(x)),
+        'code_cpu_limit': lambda x: x is None or _is_positive_number(x),
     }
     _config_path = pathlib.Path('~/.text2qti.bespon').expanduser()
 
@@ -102,6 +127,12 @@ class Config(dict):
             raise Text2qtiError(f'Could not open text2qti config file "{config_path}" due to UnicodeDecodeError. File may be corrupt.')
 
         if config_text is not None:
+            if all(not line or (line.startswith('#') and not line.startswith('###'))
+                   for line in (x.strip() for x in config_text.splitlines())):
+                # Config files that only contain line comments, like the
+                # default config, are empty, so loading BespON can be skipped
+                return
+            import bespon
             try:
                 config_dict = bespon.loads(config_text, empty_default=dict)
             except Exception as e:
@@ -116,6 +147,7 @@ class Config(dict):
         Save config file.
         '''
         config_path = self._config_path
+        import bespon
         try:
             bespon_text = bespon.dumps(dict(self))
         except Exception as e:
@@ -8,5 +8,44 @@
 #
 
 
+from typing import List, Optional
+
+
+
+
+class Diagnostic(object):
+    '''
+    A problem found in quiz source.  `line` and `column` are 1-based, and are
+    `None` when not applicable.  `code` is a short identifier for the kind of
+    problem, such as "missing-whitespace" or "duplicate-choice".
+    '''
+    def __init__(self, message: str, *, code: str,
+                 line: Optional[int]=None, column: Optional[int]=None,
+                 source_name: Optional[str]=None):
+        self.message = message
+        self.code = code
+        self.line = line
+        self.column = column
+        self.source_name = source_name
+
+    def __str__(self):
+        if self.line is None:
+            return self.message
+        return f'In {self.source_name} on line {self.line}:\n{self.message}'
+
+    def to_dict(self) -> dict:
+        return {'line': self.line, 'column': self.column, 'code': self.code, 'message': self.message}
+
+
+
+
 class Text2qtiError(Exception):
-    pass
+    '''
+    Error in quiz source, configuration, or conversion.  `code` optionally
+    identifies the kind of error.  Errors from parsing quiz source have
+    `diagnostics` with the location of each problem.
+    '''
+    def __init__(self, *args, code: Optional[str]=None, diagnostics: Optional[List[Diagnostic]]=None):
+        super().__init__(*args)
+        self.code = code
+        self.diagnostics: List[Diagnostic] = [] if diagnostics is None else diagnostics
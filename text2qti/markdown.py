@@ -8,62 +8,110 @@
 #
 
 
-import atexit
+import collections
+import concurrent.futures
 import hashlib
-import json
 import pathlib
 import platform
 import re
 import subprocess
-import time
 import typing
-from typing import Dict, Optional, Set
+from typing import BinaryIO, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 import urllib.parse
-import zipfile
-
-import markdown
-# Markdown extensions are imported and initialized explicitly to ensure that
-# pyinstaller identifies them.
-import markdown.extensions
-import markdown.extensions.smarty
-import markdown.extensions.sane_lists
-import markdown.extensions.def_list
-import markdown.extensions.fenced_code
-import markdown.extensions.footnotes
-import markdown.extensions.tables
-import markdown.extensions.md_in_html
-from markdown.inlinepatterns import ImageInlineProcessor, IMAGE_LINK_RE
 
 from .config import Config
 from .err import Text2qtiError
-from .version import __version__ as version
-from . import pymd_pandoc_attr
-
-
-md_extensions = [
-    markdown.extensions.smarty.makeExtension(),
-    markdown.extensions.sane_lists.makeExtension(),
-    markdown.extensions.def_list.makeExtension(),
-    markdown.extensions.fenced_code.makeExtension(),
-    markdown.extensions.footnotes.makeExtension(),
-    markdown.extensions.tables.makeExtension(),
-    markdown.extensions.md_in_html.makeExtension(),
-    pymd_pandoc_attr.makeExtension(),
-]
+from .mathml_cache import MathMLCache
 
 
 
 
 class Image(object):
     '''
-    Raw image data for quiz insertion.
+    Image for quiz insertion, with a lazy source:  a local image file, of
+    which only the path is kept, or a buffer for generated images.  The id is
+    a hash of the data.  The data is only read when the QTI is created, and
+    then in chunks by `.copy_to()`.
     '''
-    def __init__(self, name: str, data: bytes):
+    # Bytes read at a time when hashing and copying image data
+    chunk_size = 1024**2
+
+    def __init__(self, name: str, id: str, *,
+                 path: Optional[pathlib.Path]=None, data: Optional[bytes]=None):
+        if (path is None) == (data is None):
+            raise TypeError('An image needs either a path or data')
         self.name = name
-        self.data = data
+        self.id = id
+        self.path = path
+        self._data = data
+
+    @classmethod
+    def from_data(cls, name: str, data: bytes) -> 'Image':
+        '''
+        Image for data in memory, such as a generated image.
+        '''
+        return cls(name, hashlib.blake2b(data).hexdigest()[:64], data=data)
+
+    @classmethod
+    def file_id(cls, path: pathlib.Path) -> str:
+        '''
+        Image id for the data in a file, hashed in chunks so that large
+        files are never in memory at once.
+        '''
         h = hashlib.blake2b()
-        h.update(data)
-        self.id = h.hexdigest()[:64]
+        with path.open('rb') as f:
+            while True:
+                chunk = f.read(cls.chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+        return h.hexdigest()[:64]
+
+    @property
+    def size(self) -> int:
+        '''
+        Size of the image data in bytes.
+        '''
+        if self._data is not None:
+            return len(self._data)
+        try:
+            return self.path.stat().st_size
+        except OSError as e:
+            raise Text2qtiError(f'Image file "{self.path}" cannot be read:\n{e}')
+
+    @property
+    def data(self) -> bytes:
+        if self._data is not None:
+            return self._data
+        try:
+            return self.path.read_bytes()
+        except OSError as e:
+            raise Text2qtiError(f'Image file "{self.path}" cannot be read:\n{e}')
+
+    def copy_to(self, stream: BinaryIO):
+        '''
+        Write the image data to a stream, in chunks of at most `chunk_size`
+        bytes.  For a file, check that the data still matches the image id,
+        since the file could have changed after it was hashed.
+        '''
+        if self._data is not None:
+            data_view = memoryview(self._data)
+            for n in range(0, len(data_view), self.chunk_size):
+                stream.write(data_view[n:n+self.chunk_size])
+            return
+        h = hashlib.blake2b()
+        try:
+            with self.path.open('rb') as f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    stream.write(chunk)
+        except OSError as e:
+            raise Text2qtiError(f'Image file "{self.path}" cannot be read:\n{e}')
+        if h.hexdigest()[:64] != self.id:
+            raise Text2qtiError(f'Image file "{self.path}" changed after the quiz was parsed')
 
     @property
     def src_path(self):
@@ -80,42 +128,308 @@ class Image(object):
 
 
 
-class Text2qtiImagePattern(ImageInlineProcessor):
+class MemoInfo(NamedTuple):
     '''
-    Custom image processor for Python-Markdown that modifies local image
-    paths to their final QTI form and also accumulates all image data for QTI
-    inclusion.
+    Statistics for the memo of rendered Markdown strings, in the style of
+    `functools.lru_cache().cache_info()`.
     '''
-    def __init__(self, pattern_re, markdown_md, text2qti_md):
-        super().__init__(pattern_re, markdown_md)
-        self.text2qti_md = text2qti_md
-
-    def handleMatch(self, match, data):
-        node, start, end = super().handleMatch(match, data)
-        src = node.attrib.get('src')
-        if src and not any(src.startswith(x) for x in ('http://', 'https://')):
-            src_path = pathlib.Path(src).expanduser()
-            try:
-                data = src_path.read_bytes()
-            except FileNotFoundError:
-                raise Text2qtiError(f'File "{src_path}" does not exist')
-            except PermissionError as e:
-                raise Text2qtiError(f'File "{src_path}" cannot be read due to permission error:\n{e}')
-            image = Image(src_path.name, data)
-            if image.id in self.text2qti_md.images:
-                image = self.text2qti_md.images[image.id]
-            else:
-                if image.name in self.text2qti_md.image_name_set:
-                    n = 8
-                    while image.name in self.text2qti_md.image_name_set:
-                        image.name = f'{src_path.stem}_{image.id[:n]}{src_path.suffix}'
-                        n *= 2
-                        if n >= len(image.id)*2:
-                            raise Text2qtiError('Hash collision occurred during image deduplication')
-                self.text2qti_md.image_name_set.add(image.name)
-                self.text2qti_md.images[image.id] = image
-            node.attrib['src'] = image.src_path
-        return node, start, end
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups else 0.0
+
+
+
+
+class LaTeXToMathML(object):
+    r'''
+    In-process conversion of a subset of LaTeX math into the same MathML that
+    Pandoc gives with `--mathml`, so that common equations do not require
+    Pandoc.  The subset covers the LaTeX that text2qti generates for
+    siunitx macros, plus letters, numbers, arithmetic and relation
+    operators, Greek letters, sub- and superscripts, `\frac`, `\sqrt`,
+    `\text`, `\mathrm`, and spacing commands.
+
+    `.convert()` returns `None` for anything outside the subset, including
+    anything that Pandoc would not treat as inline math, so that the caller
+    can fall back to Pandoc.  Output follows Pandoc's quirks, such as a
+    leading minus sign being an identifier rather than an operator.
+    '''
+    class _Unsupported(Exception):
+        pass
+
+    # Lowercase only, since versions of Pandoc differ in the mathvariant of
+    # uppercase Greek letters
+    greek = {
+        'alpha': 'α', 'beta': 'β', 'gamma': 'γ', 'delta': 'δ', 'epsilon': 'ϵ',
+        'varepsilon': 'ε', 'zeta': 'ζ', 'eta': 'η', 'theta': 'θ', 'vartheta': 'ϑ',
+        'iota': 'ι', 'kappa': 'κ', 'lambda': 'λ', 'mu': 'μ', 'nu': 'ν', 'xi': 'ξ',
+        'pi': 'π', 'rho': 'ρ', 'sigma': 'σ', 'tau': 'τ', 'upsilon': 'υ', 'phi': 'ϕ',
+        'varphi': 'φ', 'chi': 'χ', 'psi': 'ψ', 'omega': 'ω',
+    }
+    # Symbols are ordinary (always `<mi>`), binary operators (`<mo>`, except
+    # at the start of a row or after another operator, where Pandoc uses
+    # `<mi>`), or relations and punctuation (always `<mo>`)
+    ordinary_commands = {
+        'infty': '∞', 'partial': '∂', 'nabla': '∇', 'hbar': 'ℏ', 'prime': '′',
+        'cdots': '⋯', 'ldots': '…', 'dots': '…', 'angle': '∠', 'emptyset': '∅',
+        '$': '$', '%': '%', '#': '#', '_': '_', '&': '&amp;',
+    }
+    binary_commands = {
+        'times': '×', 'cdot': '⋅', 'pm': '±', 'mp': '∓', 'div': '÷', 'circ': '∘',
+        'ast': '*', 'star': '⋆', 'bullet': '•', 'cap': '∩', 'cup': '∪',
+        'wedge': '∧', 'vee': '∨', 'oplus': '⊕', 'otimes': '⊗',
+    }
+    relation_commands = {
+        'le': '≤', 'leq': '≤', 'ge': '≥', 'geq': '≥', 'ne': '≠', 'neq': '≠',
+        'lt': '&lt;', 'gt': '&gt;', 'approx': '≈', 'sim': '∼', 'simeq': '≃',
+        'cong': '≅', 'equiv': '≡', 'propto': '∝', 'll': '≪', 'gg': '≫',
+        'to': '→', 'rightarrow': '→', 'leftarrow': '←', 'Rightarrow': '⇒',
+        'Leftarrow': '⇐', 'leftrightarrow': '↔', 'Leftrightarrow': '⇔', 'iff': '⇔',
+        'implies': '⟹', 'mapsto': '↦', 'in': '∈', 'notin': '∉', 'subset': '⊂',
+        'subseteq': '⊆', 'supset': '⊃', 'parallel': '∥',
+        'colon': ':',
+    }
+    space_commands = {
+        ',': '0.167em', '!': '-0.167em', ':': '0.222em', '>': '0.222em', ' ': '0.222em',
+        ';': '0.278em', 'quad': '1.0em', 'qquad': '2.0em',
+    }
+    ordinary_chars = {'!': '!', '.': '.', '/': '/', '?': '?', '@': '@'}
+    binary_chars = {'+': '+', '-': '−', '*': '*'}
+    relation_chars = {'=': '=', '<': '&lt;', '>': '&gt;', ',': ',', ';': ';', ':': ':'}
+    number_re = re.compile(r'[0-9]+(?:\.[0-9]+)?|\.[0-9]+')
+    # Characters that Pandoc treats specially in `\text{}`, or that would
+    # end the math in Markdown
+    text_unsupported_re = re.compile(r'''[\\{}$%#&~'"`\n\t]|--''')
+
+    def convert(self, latex: str) -> Optional[str]:
+        '''
+        Convert LaTeX to MathML, or return `None` if it is not supported.
+        '''
+        if not latex or latex[0] == ' ' or latex[-1] == ' ' or '"' in latex:
+            return None
+        self._latex = latex
+        self._pos = 0
+        try:
+            elements = self._parse_row(top=True)
+        except self._Unsupported:
+            return None
+        finally:
+            self._latex = None
+        if not elements:
+            return None
+        mathml_list = self._render_row(elements)
+        if len(mathml_list) == 1:
+            mathml = mathml_list[0]
+        else:
+            mathml = '<mrow>{0}</mrow>'.format(''.join(mathml_list))
+        annotation = latex.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace("'", '&#39;')
+        return ('<math display="inline" xmlns="http://www.w3.org/1998/Math/MathML"><semantics>'
+                f'{mathml}<annotation encoding="application/x-tex">{annotation}</annotation></semantics></math>')
+
+    # Elements are `(kind, mathml)` tuples, where `kind` is "ord", "bin",
+    # "rel", or "space".  For "bin", `mathml` is only the symbol, since the
+    # tag depends on the position in the row.
+
+    @staticmethod
+    def _render_row(elements: List[Tuple[str, str]]) -> List[str]:
+        # As in TeX, a binary operator is ordinary at the start of a row,
+        # after another operator or a relation, or before a relation
+        kinds = [kind for kind, mathml in elements]
+        for n, kind in enumerate(kinds):
+            if kind == 'bin' and (n == 0 or kinds[n-1] in ('bin', 'rel')):
+                kinds[n] = 'ord'
+        for n, kind in enumerate(kinds[:-1]):
+            if kind == 'bin' and kinds[n+1] == 'rel':
+                kinds[n] = 'ord'
+        mathml_list = []
+        for (kind, mathml), final_kind in zip(elements, kinds):
+            if kind == 'bin':
+                if final_kind == 'bin':
+                    mathml = f'<mo>{mathml}</mo>'
+                else:
+                    mathml = f'<mi>{mathml}</mi>'
+            mathml_list.append(mathml)
+        return mathml_list
+
+    @staticmethod
+    def _render_element(element: Tuple[str, str]) -> str:
+        kind, mathml = element
+        if kind == 'bin':
+            return f'<mo>{mathml}</mo>'
+        return mathml
+
+    def _skip_spaces(self):
+        latex = self._latex
+        while self._pos < len(latex) and latex[self._pos] == ' ':
+            self._pos += 1
+
+    def _peek(self) -> str:
+        return self._latex[self._pos:self._pos+1]
+
+    def _parse_row(self, top: bool=False) -> List[Tuple[str, str]]:
+        '''
+        Parse elements until the end of the LaTeX (`top=True`) or the end of
+        the current group.
+        '''
+        elements: List[Tuple[str, str]] = []
+        while True:
+            self._skip_spaces()
+            char = self._peek()
+            if not char:
+                if not top:
+                    raise self._Unsupported
+                return elements
+            if char == '}':
+                if top:
+                    raise self._Unsupported
+                self._pos += 1
+                return elements
+            if char in '^_':
+                if elements:
+                    base = elements.pop()
+                else:
+                    base = ('ord', '<mi></mi>')
+                elements.append(self._parse_scripts(base))
+                continue
+            elements.append(self._parse_element())
+
+    def _parse_scripts(self, base: Tuple[str, str]) -> Tuple[str, str]:
+        scripts: Dict[str, str] = {}
+        while True:
+            self._skip_spaces()
+            char = self._peek()
+            if char not in ('^', '_') or not char:
+                break
+            if char in scripts:
+                raise self._Unsupported
+            self._pos += 1
+            self._skip_spaces()
+            scripts[char] = self._render_element(self._parse_element(script=True))
+        base_mathml = self._render_element(base)
+        if len(scripts) == 2:
+            return ('ord', f'<msubsup>{base_mathml}{scripts["_"]}{scripts["^"]}</msubsup>')
+        if '^' in scripts:
+            return ('ord', f'<msup>{base_mathml}{scripts["^"]}</msup>')
+        return ('ord', f'<msub>{base_mathml}{scripts["_"]}</msub>')
+
+    def _parse_group(self) -> Tuple[str, str]:
+        '''
+        Parse a group after its opening brace.  A group with a single element
+        is that element.
+        '''
+        elements = self._parse_row()
+        if len(elements) == 1:
+            return elements[0]
+        return ('ord', '<mrow>{0}</mrow>'.format(''.join(self._render_row(elements))))
+
+    def _parse_braced_group(self) -> Tuple[str, str]:
+        self._skip_spaces()
+        if self._peek() != '{':
+            raise self._Unsupported
+        self._pos += 1
+        return self._parse_group()
+
+    def _parse_braced_raw(self) -> str:
+        self._skip_spaces()
+        if self._peek() != '{':
+            raise self._Unsupported
+        end = self._latex.find('}', self._pos)
+        if end < 0:
+            raise self._Unsupported
+        raw = self._latex[self._pos+1:end]
+        self._pos = end + 1
+        return raw
+
+    def _parse_element(self, script: bool=False) -> Tuple[str, str]:
+        '''
+        Parse a single element.  Sub- and superscripts (`script=True`) are
+        limited to single symbols, numbers, and groups.
+        '''
+        latex = self._latex
+        char = self._peek()
+        if char == '{':
+            self._pos += 1
+            return self._parse_group()
+        if char in ('^', '_', '}', ''):
+            raise self._Unsupported
+        if 'a' <= char <= 'z' or 'A' <= char <= 'Z':
+            self._pos += 1
+            return ('ord', f'<mi>{char}</mi>')
+        match = self.number_re.match(latex, self._pos)
+        if match:
+            self._pos = match.end()
+            return ('ord', f'<mn>{match.group()}</mn>')
+        if char != '\\':
+            self._pos += 1
+            if char == ':' and self._peek() == '=':
+                # Pandoc treats ":=" as a single operator
+                self._pos += 1
+                return ('rel', '<mo>:=</mo>')
+            if char in self.binary_chars:
+                return ('bin', self.binary_chars[char])
+            if char in self.relation_chars:
+                return ('rel', f'<mo>{self.relation_chars[char]}</mo>')
+            if char in self.ordinary_chars:
+                return ('ord', f'<mi>{self.ordinary_chars[char]}</mi>')
+            raise self._Unsupported
+        end = self._pos + 1
+        while end < len(latex) and ('a' <= latex[end] <= 'z' or 'A' <= latex[end] <= 'Z'):
+            end += 1
+        if end == self._pos + 1:
+            end += 1
+        name = latex[self._pos+1:end]
+        self._pos = end
+        if name in self.greek:
+            return ('ord', f'<mi>{self.greek[name]}</mi>')
+        if name in self.ordinary_commands:
+            return ('ord', f'<mi>{self.ordinary_commands[name]}</mi>')
+        if name in self.binary_commands:
+            return ('bin', self.binary_commands[name])
+        if name in self.relation_commands:
+            return ('rel', f'<mo>{self.relation_commands[name]}</mo>')
+        if script:
+            raise self._Unsupported
+        if name in self.space_commands:
+            return ('space', f'<mspace width="{self.space_commands[name]}"></mspace>')
+        if name == 'frac':
+            numerator = self._render_element(self._parse_braced_group())
+            denominator = self._render_element(self._parse_braced_group())
+            return ('ord', f'<mfrac>{numerator}{denominator}</mfrac>')
+        if name == 'sqrt':
+            self._skip_spaces()
+            return ('ord', '<msqrt>{0}</msqrt>'.format(self._render_element(self._parse_braced_group())))
+        if name in ('text', 'textrm'):
+            return ('ord', self._text_to_mathml(self._parse_braced_raw()))
+        if name == 'mathrm':
+            text = self._parse_braced_raw()
+            if not all('a' <= c <= 'z' or 'A' <= c <= 'Z' for c in text):
+                raise self._Unsupported
+            mathml_list = [f'<mi mathvariant="normal">{c}</mi>' for c in text]
+            if len(mathml_list) == 1:
+                return ('ord', mathml_list[0])
+            return ('ord', '<mrow>{0}</mrow>'.format(''.join(mathml_list)))
+        raise self._Unsupported
+
+    def _text_to_mathml(self, text: str) -> str:
+        if self.text_unsupported_re.search(text) or not text.isprintable():
+            raise self._Unsupported
+        text_collapsed = re.sub(' +', ' ', text)
+        escaped = text_collapsed.replace('<', '&lt;').replace('>', '&gt;')
+        mathml = f'<mtext mathvariant="normal">{escaped}</mtext>'
+        if not text.startswith(' ') and not text.endswith(' '):
+            return mathml
+        space = '<mspace width="0.333em"></mspace>'
+        if text.startswith(' '):
+            mathml = space + mathml
+        if text.endswith(' '):
+            mathml = mathml + space
+        return f'<mrow>{mathml}</mrow>'
 
 
 
@@ -130,87 +444,105 @@ class Markdown(object):
     are also supported, with limited features:  `\SI`, `\si`, and `\num`.
     siunitx macros are extracted via regex and then converted into plain
     LaTeX, since Canvas LaTeX support does not cover siunitx.
+
+    With `render=False`, quizzes only check the syntax of LaTeX math and
+    siunitx macros with `.check_markdown()` during parsing, rather than
+    converting Markdown to HTML.  Conversion is still possible on demand, but
+    the Pandoc MathML cache is then kept in memory only.
+
+    Rendered strings are memoized, since quizzes often repeat strings such as
+    "True", "False", and common feedback.  For strings with local images,
+    the images are recorded, and their registration is replayed when the
+    memoized result is used, so that `.images` and image tracking are the
+    same as when every string is rendered.
     '''
-    def __init__(self, config: Optional[Config]=None):
-        self.config = config
+    # Maximum number of memoized strings, and maximum length of a string
+    # for it to be memoized, since long strings are rarely repeated
+    memo_maxsize = 4096
+    memo_max_string_length = 1000
 
-        markdown_processor = markdown.Markdown(extensions=md_extensions)
-        markdown_image_processor = Text2qtiImagePattern(IMAGE_LINK_RE, markdown_processor, self)
-        markdown_processor.inlinePatterns.register(markdown_image_processor, 'image_link', 150)
-        self.markdown_processor = markdown_processor
+    def __init__(self, config: Optional[Config]=None, *, render: bool=True,
+                 mathml_cache: Optional[MathMLCache]=None):
+        self.config = config
+        self.render = render
+        # Python-Markdown processor, created on first use
+        self._markdown_processor = None
 
         self.images: Dict[str, Image] = {}
         self.image_name_set: Set[str] = set()
+        # Image ids for local image paths, for checking whether cached
+        # content is still valid
+        self.image_ids: Dict[str, str] = {}
+        # Markdown rendered ahead of time by `.prerender()`
+        self._prerendered: Dict[Tuple[str, bool], str] = {}
+        # Memo of rendered strings, keyed by Markdown string and
+        # `strip_p_tags`, with the local image references in each string as
+        # `(path, image)`, in least recently used order
+        self._memo: typing.OrderedDict[Tuple[str, bool], Tuple[str, Tuple[Tuple[str, Image], ...]]] = collections.OrderedDict()
+        self._memo_hits = 0
+        self._memo_misses = 0
+        # Local image references found while rendering a string for the memo
+        self._image_refs: Optional[List[Tuple[str, Image]]] = None
 
         if config is None:
             self.latex_to_qti = self._latex_to_qti_unconfigured
         elif config['pandoc_mathml']:
             self.latex_to_qti = self.latex_to_pandoc_mathml
-            self._prep_cache()
+            self._latex_to_mathml = LaTeXToMathML()
+            if mathml_cache is not None:
+                self._mathml_cache = mathml_cache
+            elif config['mathml_cache'] == 'shared':
+                self._mathml_cache = MathMLCache(shared=True, max_size=config['mathml_cache_max_size']*1024**2,
+                                                 in_memory=not render)
+            else:
+                self._mathml_cache = MathMLCache(in_memory=not render)
         else:
             self.latex_to_qti = self.latex_to_canvas_img
 
 
+    @property
+    def markdown_processor(self):
+        # Python-Markdown and its extensions are only imported once Markdown
+        # is converted, which keeps startup fast for validation and for
+        # quizzes loaded from cache.
+        if self._markdown_processor is None:
+            from .pymd_processor import new_markdown_processor
+            self._markdown_processor = new_markdown_processor(self)
+        return self._markdown_processor
+
+
+    def __getstate__(self):
+        # The Markdown processor, Pandoc MathML cache, and memo are not saved
+        # when quizzes are pickled.  Unpickled instances can still convert
+        # Markdown, but without the on-disk MathML cache.
+        state = self.__dict__.copy()
+        state['_markdown_processor'] = None
+        state['_prerendered'] = {}
+        state['_memo'] = collections.OrderedDict()
+        state['_memo_hits'] = 0
+        state['_memo_misses'] = 0
+        state['_image_refs'] = None
+        if '_mathml_cache' in state:
+            state['_mathml_cache'] = MathMLCache(in_memory=True)
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._markdown_processor = None
+
+
     def finalize(self):
+        self._prerendered = {}
+        self._memo.clear()
         if self.config is not None and self.config['pandoc_mathml']:
-            self._save_cache()
-            self._cache_lock_path.unlink()
+            self._mathml_cache.close()
 
 
     def _latex_to_qti_unconfigured(self, latex: str):
         raise Text2qtiError('Cannot convert LaTeX to QTI unless Markdown configuration is provided')
 
 
-    def _prep_cache(self):
-        self._cache_path = pathlib.Path('_text2qti_cache.zip')
-        self._cache_lock_path = pathlib.Path('_text2qti_cache.lock')
-
-        max_lock_wait = 2
-        lock_check_interval = 0.1
-        lock_time = 0
-        while True:
-            try:
-                self._cache_lock_path.touch(exist_ok=False)
-            except FileExistsError:
-                if lock_time > max_lock_wait:
-                    raise Text2qtiError('The text2qti cache is locked; this usually means that another instance of '
-                                        'text2qti is already running and you should try again later')
-                time.sleep(lock_check_interval)
-                lock_time += lock_check_interval
-            else:
-                break
-        def final_cache_cleanup():
-            try:
-                self._cache_lock_path.unlink()
-            except FileNotFoundError:
-                pass
-        atexit.register(final_cache_cleanup)
-
-        default_cache = {
-            'version': version,
-            'pandoc_mathml': {}
-        }
-        try:
-            with zipfile.ZipFile(str(self._cache_path)) as zf:
-                with zf.open('cache.json') as f:
-                    cache = json.load(f)
-        except (FileNotFoundError, KeyError, json.JSONDecodeError):
-            cache = default_cache
-        else:
-            if not isinstance(cache, dict) or cache.get('version') != version:
-                cache = default_cache
-        for v in cache['pandoc_mathml'].values():
-            v['unused_count'] += 1
-        self._cache = cache
-
-
-    def _save_cache(self):
-        self._cache['pandoc_mathml'] = {k: v for k, v in self._cache['pandoc_mathml'].items()
-                                       if v['unused_count'] <= 10}
-        with zipfile.ZipFile(str(self._cache_path), 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr('cache.json', json.dumps(self._cache))
-
-
     XML_ESCAPES = (('&', '&amp;'),
                 ('<', '&lt;'),
                 ('>', '&gt;'),
@@ -262,42 +594,123 @@ class Markdown(object):
                                                     latex_url_escaped=latex_url_escaped)
 
 
-    def latex_to_pandoc_mathml(self, latex: str) -> str:
+    def _run_pandoc_mathml(self, markdown_string: str) -> str:
         '''
-        Convert a LaTeX equation into MathML using Pandoc.
+        Convert Markdown containing LaTeX math to HTML with MathML using
+        Pandoc.  With `pandoc_server`, this uses a long-lived Pandoc process if
+        one is available.
         '''
-        data = self._cache['pandoc_mathml'].get(latex)
-        if data is not None:
-            mathml = data['mathml']
-            data['unused_count'] = 0
+        if self.config['pandoc_server']:
+            from .pandoc_server import get_pandoc_server
+            server = get_pandoc_server()
+            if server is not None:
+                html = server.convert(markdown_string, {'from': 'markdown', 'to': 'html', 'html-math-method': 'mathml'})
+                if html is not None:
+                    return html
+        if platform.system() == 'Windows':
+            # Prevent console from appearing for an instant
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
         else:
-            if platform.system() == 'Windows':
-                # Prevent console from appearing for an instant
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            else:
-                startupinfo = None
+            startupinfo = None
+        try:
+            proc = subprocess.run(['pandoc', '-f', 'markdown', '-t', 'html', '--mathml'],
+                                  input=markdown_string, encoding='utf8',
+                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  startupinfo=startupinfo,
+                                  check=True)
+        except FileNotFoundError as e:
+            raise Text2qtiError(f'Could not find Pandoc:\n{e}')
+        except subprocess.CalledProcessError as e:
+            raise Text2qtiError(f'Running Pandoc failed:\n{e}')
+        return proc.stdout
+
+    def _html_to_pandoc_mathml(self, html: str) -> str:
+        '''
+        Extract MathML for an equation from Pandoc HTML output.
+        '''
+        mathml = html.strip()
+        if mathml.startswith('<p>'):
+            mathml = mathml[len('<p>'):]
+        if mathml.endswith('</p>'):
+            mathml = mathml[:-len('</p>')]
+        return mathml
+
+    def latex_to_pandoc_mathml(self, latex: str) -> str:
+        '''
+        Convert a LaTeX equation into MathML using Pandoc.  Equations that
+        `LaTeXToMathML` supports are converted without Pandoc, and are not
+        cached.
+        '''
+        mathml = self._latex_to_mathml.convert(latex)
+        if mathml is not None:
+            return mathml
+        mathml = self._mathml_cache.get(latex)
+        if mathml is None:
             try:
-                proc = subprocess.run(['pandoc', '-f', 'markdown', '-t', 'html', '--mathml'],
-                                      input='${0}$'.format(latex), encoding='utf8',
-                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                      startupinfo=startupinfo,
-                                      check=True)
-            except FileNotFoundError as e:
-                raise Text2qtiError(f'Could not find Pandoc:\n{e}')
-            except subprocess.CalledProcessError as e:
-                raise Text2qtiError(f'Running Pandoc failed:\n{e}')
-            mathml = proc.stdout.strip()
-            if mathml.startswith('<p>'):
-                mathml = mathml[len('<p>'):]
-            if mathml.endswith('</p>'):
-                mathml = mathml[:-len('</p>')]
-            self._cache['pandoc_mathml'][latex] = {
-                'mathml': mathml,
-                'unused_count': 0,
-            }
+                html = self._run_pandoc_mathml('${0}$'.format(latex))
+            except Text2qtiError as e:
+                raise Text2qtiError(f'Failed to convert LaTeX "{latex}" to MathML:\n{e}')
+            mathml = self._html_to_pandoc_mathml(html)
+            self._mathml_cache.put(latex, mathml)
         return mathml
 
+    # Pandoc passes HTML comments through unchanged, while any "<" in an
+    # equation is escaped in MathML, so this separates equations in output
+    pandoc_mathml_separator = '<!-- text2qti MathML separator -->'
+    # Maximum number of equations converted by a single Pandoc process
+    pandoc_mathml_batch_size = 500
+
+    def batch_latex_to_pandoc_mathml(self, latex_list: Iterable[str]):
+        '''
+        Convert equations that are not supported by `LaTeXToMathML` and are
+        not in the Pandoc MathML cache with one Pandoc process per batch,
+        rather than one per equation, and cache the results.  If a batch
+        fails, its equations are left for `.latex_to_pandoc_mathml()`, which
+        converts them one at a time and gives an error with the equation that
+        fails.
+        '''
+        mathml_cache = self._mathml_cache
+        convert = self._latex_to_mathml.convert
+        uncached = list(dict.fromkeys(x for x in latex_list
+                                      if convert(x) is None and mathml_cache.get(x) is None))
+        separator = f'\n\n{self.pandoc_mathml_separator}\n\n'
+        for n in range(0, len(uncached), self.pandoc_mathml_batch_size):
+            batch = uncached[n:n+self.pandoc_mathml_batch_size]
+            if len(batch) == 1:
+                break
+            try:
+                html = self._run_pandoc_mathml(separator.join('${0}$'.format(latex) for latex in batch))
+            except Text2qtiError:
+                continue
+            html_list = html.split(f'\n{self.pandoc_mathml_separator}\n')
+            if len(html_list) != len(batch):
+                continue
+            mathml_cache.put_many((latex, self._html_to_pandoc_mathml(latex_html))
+                                  for latex, latex_html in zip(batch, html_list))
+
+    def find_latex(self, markdown_strings: Iterable[str]) -> List[str]:
+        '''
+        Find the LaTeX that converting Markdown strings would pass to
+        `.latex_to_qti()`, including LaTeX from siunitx macros.  Strings with
+        invalid siunitx are skipped.
+        '''
+        latex_list: List[str] = []
+        def record_latex(latex: str) -> str:
+            latex_list.append(latex)
+            return ''
+        latex_to_qti = self.latex_to_qti
+        self.latex_to_qti = record_latex
+        try:
+            for markdown_string in markdown_strings:
+                try:
+                    self.sub_math_siunitx_to_canvas_img(markdown_string)
+                except Text2qtiError:
+                    pass
+        finally:
+            self.latex_to_qti = latex_to_qti
+        return latex_list
+
 
     siunitx_num_number_re = re.compile(r'[+-]?(?:0|(?:[1-9][0-9]*(?:\.[0-9]+)?|0?\.[0-9]+)(?:[eE][+-]?(?:[1-9][0-9]*|0+[1-9][0-9]*))?)$')
 
@@ -506,11 +919,113 @@ class Markdown(object):
         '''
         return self.skip_or_html_comment_or_code_math_siunitx_re.sub(self._html_comment_or_inline_code_math_siunitx_dispatch, string)
 
+    # Inline images, in Python-Markdown syntax, with the path either in
+    # angle brackets or up to the first space
+    check_image_re = re.compile(r'(?<!\\)!\[(?:\\.|[^\]\\])*\]\(\s*(?:<(?P<angle_src>[^>\n]*)>|(?P<src>[^\s()]+))')
+    check_image_unescape_re = re.compile(r'\\([!-/:-@\[-`{-~])')
+
+    def check_markdown(self, markdown_string: str):
+        '''
+        Check the LaTeX math and siunitx macros in a string for errors that
+        would occur during conversion, without converting anything.  Local
+        images outside code, comments, and math must exist and be readable,
+        as for conversion, but they are not registered.
+        '''
+        check_images = '![' in markdown_string
+        last_end = 0
+        for match in self.skip_or_html_comment_or_code_math_siunitx_re.finditer(markdown_string):
+            lastgroup = match.lastgroup
+            if lastgroup == 'math':
+                self.sub_siunitx_to_plain_latex(match.group('math'), in_math=True)
+            elif lastgroup in ('SI_unit', 'num_number', 'si_unit'):
+                self._siunitx_dispatch(match, in_math=True)
+            if check_images and lastgroup != 'skip':
+                self._check_image_paths(markdown_string[last_end:match.start()])
+                last_end = match.end()
+        if check_images:
+            self._check_image_paths(markdown_string[last_end:])
+
+    def _check_image_paths(self, markdown_string: str):
+        for match in self.check_image_re.finditer(markdown_string):
+            src = self.check_image_unescape_re.sub(r'\1', match.group('angle_src') or match.group('src') or '')
+            if not src or any(src.startswith(x) for x in ('http://', 'https://')):
+                continue
+            src_path = pathlib.Path(src).expanduser()
+            try:
+                with src_path.open('rb'):
+                    pass
+            except FileNotFoundError:
+                message = f'File "{src_path}" does not exist'
+            except PermissionError as e:
+                message = f'File "{src_path}" cannot be read due to permission error:\n{e}'
+            else:
+                continue
+            # Same as the error from conversion
+            raise Text2qtiError(f'Conversion from Markdown to HTML failed:\n{message}')
+
+    def add_image_ref(self, path: str, image: Image):
+        '''
+        Record a reference to a registered local image at `path`.
+        '''
+        self.image_ids[path] = image.id
+        if self._image_refs is not None:
+            self._image_refs.append((path, image))
+
+    def memo_info(self) -> MemoInfo:
+        '''
+        Hits, misses, and size of the memo of rendered strings.
+        '''
+        return MemoInfo(self._memo_hits, self._memo_misses, self.memo_maxsize, len(self._memo))
+
     def md_to_html_xml(self, markdown_string: str, strip_p_tags: bool=False) -> str:
         '''
         Convert the Markdown in a string to HTML, then escape the HTML for
         embedding in XML.
         '''
+        if self._prerendered:
+            xml = self._prerendered.get((markdown_string, strip_p_tags))
+            if xml is not None:
+                return xml
+        if len(markdown_string) > self.memo_max_string_length:
+            return self._md_to_html_xml(markdown_string, strip_p_tags)
+        key = (markdown_string, strip_p_tags)
+        memo = self._memo
+        entry = memo.get(key)
+        if entry is not None:
+            self._memo_hits += 1
+            memo.move_to_end(key)
+            xml, image_refs = entry
+            for path, image in image_refs:
+                if image.id not in self.images:
+                    self.image_name_set.add(image.name)
+                    self.images[image.id] = image
+                self.add_image_ref(path, image)
+            return xml
+        self._memo_misses += 1
+        self._image_refs = []
+        try:
+            xml = self._md_to_html_xml(markdown_string, strip_p_tags)
+            image_refs = tuple(self._image_refs)
+        finally:
+            self._image_refs = None
+        memo[key] = (xml, image_refs)
+        if len(memo) > self.memo_maxsize:
+            memo.popitem(last=False)
+        return xml
+
+    # Single-line strings that Python-Markdown and its extensions convert
+    # into a single paragraph with the text unchanged.  These are words,
+    # spaces, and punctuation without Markdown, HTML, smarty, math, or
+    # siunitx meaning, and without leading or trailing spaces, ordered list
+    # markers, or sequences like "--" and "..." that smarty replaces.
+    plain_text_re = re.compile(r'(?!\d+\.(?: |$))(?!.*(?:--|\.\.))[^\W_](?:[^\W_]| (?! )|[,.;:?!()%/+=@\-])*(?<! )\Z')
+
+    def _md_to_html_xml(self, markdown_string: str, strip_p_tags: bool) -> str:
+        if self.plain_text_re.match(markdown_string):
+            # Plain text gives the same HTML without running Python-Markdown
+            if strip_p_tags:
+                return markdown_string
+            return f'&lt;p&gt;{markdown_string}&lt;/p&gt;'
         markdown_string_processed_latex = self.sub_math_siunitx_to_canvas_img(markdown_string)
         try:
             html = self.markdown_processor.reset().convert(markdown_string_processed_latex)
@@ -524,6 +1039,52 @@ class Markdown(object):
         xml = self.xml_escape(html, squotes=False, dquotes=False)
         return xml
 
+    # Minimum number of strings for which a process pool is worthwhile
+    min_prerender_count = 500
+
+    def prerender(self, items: Iterable[Tuple[str, bool]], jobs: int):
+        '''
+        Render Markdown strings in a pool of `jobs` worker processes, so that
+        later calls to `.md_to_html_xml()` with the same arguments are cache
+        lookups.  `items` are `(markdown_string, strip_p_tags)` pairs.
+
+        Strings that may contain local images are skipped, since rendering
+        them registers images, and image names depend on the order in which
+        images are found.  Those strings, and any that fail to render, are
+        rendered by `.md_to_html_xml()` as usual, so images and errors are
+        the same as when everything is rendered serially.
+
+        With Pandoc MathML, equations in the strings that need Pandoc and are
+        not in the Pandoc cache are first converted in batches, whatever the
+        value of `jobs`, so that later conversions find them in the cache.
+        Workers then get an in-memory copy of the cache, since the database
+        connection belongs to this process.
+        '''
+        if self.config is None:
+            return
+        if self.config['pandoc_mathml']:
+            items = list(items)
+            self.batch_latex_to_pandoc_mathml(self.find_latex(x[0] for x in items))
+        if jobs <= 1:
+            return
+        items = list(dict.fromkeys(x for x in items if '![' not in x[0] and x not in self._prerendered))
+        if not items or len(items) < self.min_prerender_count:
+            return
+        batch_size = -(-len(items)//(jobs*4))
+        batches = [items[n:n+batch_size] for n in range(0, len(items), batch_size)]
+        if self.config['pandoc_mathml']:
+            mathml_cache = self._mathml_cache.in_memory_copy()
+        else:
+            mathml_cache = None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs,
+                                                    initializer=_prerender_worker_init,
+                                                    initargs=(dict(self.config), mathml_cache)) as executor:
+            for batch, results in zip(batches, executor.map(_prerender_worker_batch, batches)):
+                for item, xml in zip(batch, results):
+                    if xml is not None:
+                        self._prerendered[item] = xml
+
+
     def _md_to_pandoc_dispatch(self, match: typing.Match[str],
                                      _passthrough=set(['escape', 'skip', 'block_code', 'inline_code'])) -> str:
         '''
@@ -558,3 +1119,44 @@ class Markdown(object):
         Pandoc.
         '''
         return self.skip_or_html_comment_or_code_math_siunitx_re.sub(self._md_to_pandoc_dispatch, string)
+
+
+
+
+class RecordingMarkdown(Markdown):
+    '''
+    Markdown stand-in that records the strings that would be converted to
+    HTML, without converting them.  Each string is returned with a prefix
+    that cannot occur in real output, so that different strings still give
+    different results.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.recorded: List[Tuple[str, bool]] = []
+
+    def md_to_html_xml(self, markdown_string: str, strip_p_tags: bool=False) -> str:
+        self.recorded.append((markdown_string, strip_p_tags))
+        return f'\x00{markdown_string}'
+
+
+
+
+_prerender_worker_markdown: Optional[Markdown] = None
+
+def _prerender_worker_init(config_dict: dict, mathml_cache: Optional[MathMLCache]):
+    global _prerender_worker_markdown
+    _prerender_worker_markdown = Markdown(Config(config_dict), mathml_cache=mathml_cache)
+
+def _prerender_worker_batch(items: List[Tuple[str, bool]]) -> List[Optional[str]]:
+    '''
+    Render a batch of Markdown strings in a worker process.  Failures give
+    `None`, so that the error is raised when the string is rendered again
+    during parsing, with the correct line number.
+    '''
+    results: List[Optional[str]] = []
+    for markdown_string, strip_p_tags in items:
+        try:
+            results.append(_prerender_worker_markdown.md_to_html_xml(markdown_string, strip_p_tags))
+        except Exception:
+            results.append(None)
+    return results
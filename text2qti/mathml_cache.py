@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import json
+import os
+import pathlib
+import platform
+import sqlite3
+import time
+import warnings
+import zipfile
+from typing import Dict, Iterable, Optional, Tuple, Union
+from .version import __version__ as version
+
+
+
+
+def shared_cache_dir() -> pathlib.Path:
+    '''
+    Directory for caches that are shared by all quizzes for the current
+    user:  `$XDG_CACHE_HOME/text2qti`, which defaults to `~/.cache/text2qti`
+    (`%LOCALAPPDATA%\\text2qti` on Windows).
+    '''
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    if cache_home and os.path.isabs(cache_home):
+        return pathlib.Path(cache_home) / 'text2qti'
+    if platform.system() == 'Windows' and os.environ.get('LOCALAPPDATA'):
+        return pathlib.Path(os.environ['LOCALAPPDATA']) / 'text2qti'
+    return pathlib.Path('~/.cache/text2qti').expanduser()
+
+
+
+
+class MathMLCache(object):
+    '''
+    Cache of MathML converted from LaTeX by Pandoc, stored in an SQLite
+    database in WAL mode.  Entries are read and written individually, and
+    several text2qti processes can use the same cache at once.
+
+    By default, the cache is in the current directory.  Each time it is
+    opened counts as a run, and entries that have not been used in the last
+    `max_unused_runs` runs are deleted when it is closed.  A cache in the
+    zip format used by earlier versions is migrated automatically.
+
+    With `max_size` (bytes of LaTeX plus MathML), entries are instead
+    deleted in least recently used order whenever the cache is closed while
+    larger than `max_size`.  This is used for the cache shared by all
+    quizzes (`shared=True`), which is in `shared_cache_dir()`.
+
+    The cache is cleared when the text2qti version changes.  With
+    `in_memory=True`, or if the database cannot be used, entries are only
+    kept in memory.
+    '''
+    default_path = pathlib.Path('_text2qti_cache.sqlite3')
+    shared_name = 'mathml_cache.sqlite3'
+    legacy_zip_path = pathlib.Path('_text2qti_cache.zip')
+    max_unused_runs = 10
+    # Seconds to wait for another process that is writing to the cache
+    busy_timeout = 60
+    # Version of the database tables, which are recreated when it changes
+    schema = '2'
+
+    def __init__(self, path: Optional[Union[str, pathlib.Path]]=None, *,
+                 shared: bool=False, max_size: Optional[int]=None, in_memory: bool=False):
+        if path is None:
+            if shared:
+                path = shared_cache_dir() / self.shared_name
+            else:
+                path = self.default_path
+        elif isinstance(path, str):
+            path = pathlib.Path(path)
+        elif not isinstance(path, pathlib.Path):
+            raise TypeError
+        if max_size is not None and max_size <= 0:
+            raise ValueError
+        self.path = path
+        self.shared = shared
+        self.max_size = max_size
+        # Entries read or written during this run
+        self._entries: Dict[str, str] = {}
+        # Time each entry was last used during this run, for updating the
+        # database when the cache is closed
+        self._used: Dict[str, float] = {}
+        self._connection: Optional[sqlite3.Connection] = None
+        self._run = 0
+        if not in_memory:
+            try:
+                if shared:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._open()
+            except (OSError, sqlite3.Error) as e:
+                self._close_connection()
+                warnings.warn(f'Could not use the MathML cache "{self.path}", so MathML will not be cached:\n{e}')
+
+
+    def __getstate__(self):
+        # Pickled caches are in memory only
+        state = self.__dict__.copy()
+        state['_used'] = {}
+        state['_connection'] = None
+        return state
+
+
+    def in_memory_copy(self) -> 'MathMLCache':
+        '''
+        Return a copy of the cache with only the entries that are in memory,
+        for use in other processes.
+        '''
+        cache = MathMLCache(self.path, shared=self.shared, max_size=self.max_size, in_memory=True)
+        cache._entries = self._entries.copy()
+        return cache
+
+
+    def _open(self):
+        connection = sqlite3.connect(str(self.path), timeout=self.busy_timeout, isolation_level=None)
+        self._connection = connection
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            meta = dict(connection.execute('SELECT key, value FROM meta'))
+            if meta.get('schema') != self.schema:
+                connection.execute('DROP TABLE IF EXISTS pandoc_mathml')
+            connection.execute('CREATE TABLE IF NOT EXISTS pandoc_mathml '
+                               '(latex TEXT PRIMARY KEY, mathml TEXT NOT NULL, size INTEGER NOT NULL, '
+                               'last_run INTEGER NOT NULL, last_used REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS pandoc_mathml_last_run ON pandoc_mathml (last_run)')
+            connection.execute('CREATE INDEX IF NOT EXISTS pandoc_mathml_last_used ON pandoc_mathml (last_used)')
+            if meta.get('version') != version:
+                connection.execute('DELETE FROM pandoc_mathml')
+            self._run = int(meta.get('run', 0)) + 1
+            connection.executemany('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                                   [('schema', self.schema), ('version', version), ('run', str(self._run))])
+            if self.shared:
+                # A zip cache belongs to the directory it is in
+                migrated = False
+            else:
+                migrated = self._migrate_zip()
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if migrated:
+            try:
+                self.legacy_zip_path.unlink()
+            except OSError:
+                pass
+
+
+    def _migrate_zip(self) -> bool:
+        '''
+        Copy entries from a cache in the zip format into the database.
+        Entries keep the number of runs for which they have been unused.
+        Return whether there was a zip cache.
+        '''
+        try:
+            with zipfile.ZipFile(str(self.legacy_zip_path)) as zf:
+                with zf.open('cache.json') as f:
+                    cache = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+            return True
+        if not isinstance(cache, dict) or cache.get('version') != version:
+            return True
+        rows = []
+        now = time.time()
+        for latex, data in cache.get('pandoc_mathml', {}).items():
+            try:
+                unused_count = int(data['unused_count'])
+                rows.append(self._row(latex, data['mathml'], self._run - 1 - unused_count, now - unused_count))
+            except (TypeError, KeyError, ValueError, AttributeError):
+                pass
+        self._connection.executemany('INSERT OR IGNORE INTO pandoc_mathml (latex, mathml, size, last_run, last_used) '
+                                     'VALUES (?, ?, ?, ?, ?)',
+                                     rows)
+        return True
+
+
+    @staticmethod
+    def _row(latex: str, mathml: str, last_run: int, last_used: float) -> Tuple[str, str, int, int, float]:
+        size = len(latex.encode('utf8')) + len(mathml.encode('utf8'))
+        return (latex, mathml, size, last_run, last_used)
+
+
+    def get(self, latex: str) -> Optional[str]:
+        '''
+        Return the cached MathML for LaTeX, or `None` if there is no entry.
+        '''
+        mathml = self._entries.get(latex)
+        if self._connection is None:
+            return mathml
+        if mathml is None:
+            try:
+                row = self._connection.execute('SELECT mathml FROM pandoc_mathml WHERE latex = ?', (latex,)).fetchone()
+            except sqlite3.Error:
+                return None
+            if row is None:
+                return None
+            mathml = row[0]
+            self._entries[latex] = mathml
+        self._used[latex] = time.time()
+        return mathml
+
+
+    def put(self, latex: str, mathml: str):
+        '''
+        Save MathML for LaTeX.
+        '''
+        self.put_many([(latex, mathml)])
+
+
+    def put_many(self, items: Iterable[Tuple[str, str]]):
+        '''
+        Save MathML for several LaTeX equations at once.  Failing to write to
+        the database is not an error, since the cache is only an
+        optimization.
+        '''
+        items = list(items)
+        self._entries.update(items)
+        if self._connection is None:
+            return
+        now = time.time()
+        try:
+            with self._connection:
+                self._connection.execute('BEGIN IMMEDIATE')
+                self._connection.executemany('INSERT OR REPLACE INTO pandoc_mathml (latex, mathml, size, last_run, last_used) '
+                                             'VALUES (?, ?, ?, ?, ?)',
+                                             [self._row(latex, mathml, self._run, now) for latex, mathml in items])
+        except sqlite3.Error:
+            pass
+
+
+    def close(self):
+        '''
+        Record which entries were used in this run, delete entries that have
+        not been used recently, and close the database.  Entries from this
+        run are still available in memory afterward.
+        '''
+        if self._connection is None:
+            return
+        try:
+            with self._connection:
+                self._connection.execute('BEGIN IMMEDIATE')
+                self._connection.executemany('UPDATE pandoc_mathml SET last_run = max(last_run, ?), last_used = max(last_used, ?) '
+                                             'WHERE latex = ?',
+                                             [(self._run, last_used, latex) for latex, last_used in self._used.items()])
+                if self.max_size is None:
+                    self._connection.execute('DELETE FROM pandoc_mathml WHERE last_run < ?',
+                                             (self._run - self.max_unused_runs,))
+                else:
+                    self._evict_to_max_size()
+        except sqlite3.Error:
+            pass
+        self._used = {}
+        self._close_connection()
+
+
+    def _evict_to_max_size(self):
+        '''
+        Delete least recently used entries until the cache is no larger than
+        `max_size`.
+        '''
+        excess = self._connection.execute('SELECT total(size) FROM pandoc_mathml').fetchone()[0] - self.max_size
+        if excess <= 0:
+            return
+        evicted = []
+        for latex, size in self._connection.execute('SELECT latex, size FROM pandoc_mathml ORDER BY last_used'):
+            evicted.append((latex,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._connection.executemany('DELETE FROM pandoc_mathml WHERE latex = ?', evicted)
+
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020-2021, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+'''
+Long-lived Pandoc process for conversions.  Recent versions of Pandoc can
+run Lua scripts with the Pandoc API (`pandoc lua`), which avoids starting a
+new Pandoc process for each conversion.  The process communicates over
+pipes rather than a network port, so it is not reachable from other
+processes or hosts.  (`pandoc server` is not used, since it listens on all
+network interfaces.)
+'''
+
+
+import atexit
+import platform
+import shutil
+import subprocess
+import threading
+import urllib.parse
+from typing import Dict, Optional, Union
+from .err import Text2qtiError
+
+
+
+
+class PandocServer(object):
+    '''
+    Local `pandoc lua` process that converts text with Pandoc's Lua API.
+
+    Each request and response is a single line, with `%`, carriage returns,
+    and newlines percent-encoded, so that newline translation cannot change
+    the data.  A request is `<from>\t<to>\t<html-math-method>\t<standalone>\t<text>`,
+    and a response is `ok\t<output>` or `error\t<message>`.
+
+    `pandoc lua` is only available in recent versions of Pandoc.  If the
+    process cannot be started, `.available` is false and the caller should
+    run Pandoc as a subprocess instead.
+    '''
+    lua_script = r'''
+local function decode(s)
+  return (s:gsub('%%(%x%x)', function(h) return string.char(tonumber(h, 16)) end))
+end
+local function encode(s)
+  return (s:gsub('[%%\r\n]', function(c) return string.format('%%%02X', c:byte()) end))
+end
+local function convert(from, to, math_method, standalone, text)
+  local options = {}
+  if math_method ~= '' then
+    options.html_math_method = math_method
+  end
+  local doc = pandoc.read(text, from)
+  if standalone == '1' then
+    options.template = pandoc.template.default(to)
+    -- Like the command line with stdin, "-" is the fallback title
+    if doc.meta.title == nil and doc.meta.pagetitle == nil then
+      doc.meta.pagetitle = '-'
+    end
+  end
+  return pandoc.write(doc, to, options)
+end
+for line in io.lines() do
+  local from, to, math_method, standalone, text = line:match('^([^\t]*)\t([^\t]*)\t([^\t]*)\t([^\t]*)\t(.*)$')
+  local ok, result
+  if from == nil then
+    ok, result = false, 'Invalid request'
+  else
+    ok, result = pcall(convert, from, to, math_method, standalone, decode(text))
+  end
+  io.write(ok and 'ok' or 'error', '\t', encode(tostring(result)), '\n')
+  io.flush()
+end
+'''
+
+    def __init__(self, executable: str='pandoc'):
+        self.executable = executable
+        self.available = False
+        self._lock = threading.Lock()
+        self._proc: Optional[subprocess.Popen] = None
+        which_executable = shutil.which(executable)
+        if which_executable is None:
+            return
+        if platform.system() == 'Windows':
+            # Prevent console from appearing for an instant
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        else:
+            startupinfo = None
+        try:
+            self._proc = subprocess.Popen([which_executable, 'lua', '-e', self.lua_script],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, startupinfo=startupinfo)
+        except Exception:
+            return
+        # Pandoc without `pandoc lua` exits with an error
+        try:
+            status, _ = self._request('markdown', 'html', '', False, '')
+        except (OSError, ValueError):
+            self.close()
+            return
+        if status != 'ok':
+            self.close()
+            return
+        self.available = True
+
+
+    def _request(self, from_format: str, to_format: str, math_method: str, standalone: bool, text: str):
+        '''
+        Send a request and return the response as `(status, data)`.  Raise
+        `OSError` or `ValueError` if the process does not respond properly.
+        '''
+        fields = (from_format, to_format, math_method, '1' if standalone else '0', self._encode(text))
+        self._proc.stdin.write('\t'.join(fields).encode('utf8') + b'\n')
+        self._proc.stdin.flush()
+        response = self._proc.stdout.readline()
+        if not response.endswith(b'\n'):
+            raise OSError('Pandoc process exited')
+        status, sep, data = response.decode('utf8').rstrip('\r\n').partition('\t')
+        if not sep:
+            raise ValueError('Invalid response from Pandoc process')
+        return status, urllib.parse.unquote(data, errors='strict')
+
+
+    @staticmethod
+    def _encode(text: str) -> str:
+        return text.replace('%', '%25').replace('\r', '%0D').replace('\n', '%0A')
+
+
+    def convert(self, text: str, options: Dict[str, Union[str, bool]]) -> Optional[str]:
+        '''
+        Convert text with Pandoc.  `options` are named as in the Pandoc
+        server API, for example `{"from": "markdown", "to": "html",
+        "html-math-method": "mathml"}`, and other options are not supported.
+        Return `None` if the process is no longer running, so that the caller
+        can run Pandoc as a subprocess instead.  Raise `Text2qtiError` if
+        Pandoc reports an error.
+        '''
+        unsupported = set(options) - {'from', 'to', 'html-math-method', 'standalone'}
+        if unsupported:
+            raise ValueError(f'Unsupported Pandoc options: {", ".join(sorted(unsupported))}')
+        fields = [options.get('from', 'markdown'), options.get('to', 'html'), options.get('html-math-method', '')]
+        if any(not isinstance(x, str) or '\t' in x or '\n' in x or '\r' in x for x in fields):
+            raise ValueError('Invalid Pandoc options')
+        with self._lock:
+            if not self.available:
+                return None
+            try:
+                status, data = self._request(*fields, bool(options.get('standalone')), text)
+            except (OSError, ValueError):
+                self.close()
+                return None
+        if status != 'ok':
+            raise Text2qtiError(f'Running Pandoc failed:\n{data}')
+        # Like the Pandoc command line, end output with a newline
+        if not data.endswith('\n'):
+            data += '\n'
+        return data
+
+
+    def close(self):
+        self.available = False
+        if self._proc is None:
+            return
+        for stream in (self._proc.stdin, self._proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc = None
+
+
+
+
+_server: Optional[PandocServer] = None
+_server_lock = threading.Lock()
+
+def get_pandoc_server() -> Optional[PandocServer]:
+    '''
+    Return a running Pandoc server, starting one if necessary.  There is at
+    most one server per process, and it lasts for the life of the process.
+    Return `None` if a server is not available.
+    '''
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = PandocServer()
+    # A server that could not start, or that has exited, is not restarted
+    if not _server.available:
+        return None
+    return _server
+
+@atexit.register
+def _close_server():
+    if _server is not None:
+        _server.close()
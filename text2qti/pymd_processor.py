@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+'''
+Python-Markdown processor used by `text2qti.markdown.Markdown`.  This is a
+separate module so that Python-Markdown and its extensions are only imported
+when Markdown is actually converted.
+'''
+
+
+import pathlib
+import typing
+from typing import Dict, Tuple
+
+import markdown
+# Markdown extensions are imported and initialized explicitly to ensure that
+# pyinstaller identifies them.
+import markdown.extensions
+import markdown.extensions.smarty
+import markdown.extensions.sane_lists
+import markdown.extensions.def_list
+import markdown.extensions.fenced_code
+import markdown.extensions.footnotes
+import markdown.extensions.tables
+import markdown.extensions.md_in_html
+from markdown.inlinepatterns import ImageInlineProcessor, IMAGE_LINK_RE
+
+from .err import Text2qtiError
+from .markdown import Image
+from . import pymd_pandoc_attr
+if typing.TYPE_CHECKING:
+    from .markdown import Markdown
+
+
+md_extensions = [
+    markdown.extensions.smarty.makeExtension(),
+    markdown.extensions.sane_lists.makeExtension(),
+    markdown.extensions.def_list.makeExtension(),
+    markdown.extensions.fenced_code.makeExtension(),
+    markdown.extensions.footnotes.makeExtension(),
+    markdown.extensions.tables.makeExtension(),
+    markdown.extensions.md_in_html.makeExtension(),
+    pymd_pandoc_attr.makeExtension(),
+]
+
+
+
+
+class Text2qtiImagePattern(ImageInlineProcessor):
+    '''
+    Custom image processor for Python-Markdown that modifies local image
+    paths to their final QTI form and also accumulates all images for QTI
+    inclusion.
+
+    Image ids are cached by resolved path, size, and modification time, so
+    an image that is used many times is only read and hashed once.
+    '''
+    def __init__(self, pattern_re, markdown_md, text2qti_md):
+        super().__init__(pattern_re, markdown_md)
+        self.text2qti_md = text2qti_md
+        self._image_ids: Dict[Tuple[pathlib.Path, int, int], str] = {}
+
+    def handleMatch(self, match, data):
+        node, start, end = super().handleMatch(match, data)
+        src = node.attrib.get('src')
+        if src and not any(src.startswith(x) for x in ('http://', 'https://')):
+            src_path = pathlib.Path(src).expanduser()
+            try:
+                resolved_path = src_path.resolve()
+                stat = resolved_path.stat()
+                key = (resolved_path, stat.st_size, stat.st_mtime_ns)
+                image_id = self._image_ids.get(key)
+                if image_id is None:
+                    image_id = Image.file_id(resolved_path)
+                    self._image_ids[key] = image_id
+            except FileNotFoundError:
+                raise Text2qtiError(f'File "{src_path}" does not exist')
+            except PermissionError as e:
+                raise Text2qtiError(f'File "{src_path}" cannot be read due to permission error:\n{e}')
+            if image_id in self.text2qti_md.images:
+                image = self.text2qti_md.images[image_id]
+            else:
+                image = Image(src_path.name, image_id, path=resolved_path)
+                if image.name in self.text2qti_md.image_name_set:
+                    n = 8
+                    while image.name in self.text2qti_md.image_name_set:
+                        image.name = f'{src_path.stem}_{image.id[:n]}{src_path.suffix}'
+                        n *= 2
+                        if n >= len(image.id)*2:
+                            raise Text2qtiError('Hash collision occurred during image deduplication')
+                self.text2qti_md.image_name_set.add(image.name)
+                self.text2qti_md.images[image.id] = image
+            self.text2qti_md.add_image_ref(src_path.as_posix(), image)
+            node.attrib['src'] = image.src_path
+        return node, start, end
+
+
+
+
+def new_markdown_processor(text2qti_md: 'Markdown') -> markdown.Markdown:
+    '''
+    Create a Python-Markdown processor that registers local images with a
+    text2qti Markdown instance.
+    '''
+    markdown_processor = markdown.Markdown(extensions=md_extensions)
+    markdown_image_processor = Text2qtiImagePattern(IMAGE_LINK_RE, markdown_processor, text2qti_md)
+    markdown_processor.inlinePatterns.register(markdown_image_processor, 'image_link', 150)
+    return markdown_processor
@@ -9,13 +9,16 @@
 
 
 import io
+import os
 import pathlib
-from typing import Union, BinaryIO
+import time
+from typing import BinaryIO, Iterable, Iterator, Union
 import zipfile
+from .err import Text2qtiError
 from .quiz import Quiz
-from .xml_imsmanifest import imsmanifest
+from .xml_imsmanifest import iter_imsmanifest
 from .xml_assessment_meta import assessment_meta
-from .xml_assessment import assessment
+from .xml_assessment import iter_assessment
 
 
 class QTI(object):
@@ -23,6 +26,8 @@ class QTI(object):
     Create QTI from a Quiz object.
     '''
     def __init__(self, quiz: Quiz):
+        if not quiz.md.render:
+            raise Text2qtiError('Cannot create QTI from a quiz that was only validated (render=False)')
         self.quiz = quiz
         id_base = 'text2qti'
         self.manifest_identifier = f'{id_base}_manifest_{quiz.id}'
@@ -31,10 +36,6 @@ class QTI(object):
         self.assignment_identifier = f'{id_base}_assignment_{quiz.id}'
         self.assignment_group_identifier = f'{id_base}_assignment-group_{quiz.id}'
 
-        self.imsmanifest_xml = imsmanifest(manifest_identifier=self.manifest_identifier,
-                                           assessment_identifier=self.assessment_identifier,
-                                           dependency_identifier=self.dependency_identifier,
-                                           images=self.quiz.images)
         self.assessment_meta = assessment_meta(assessment_identifier=self.assessment_identifier,
                                                assignment_identifier=self.assignment_identifier,
                                                assignment_group_identifier=self.assignment_group_identifier,
@@ -45,19 +46,86 @@ class QTI(object):
                                                show_correct_answers=quiz.show_correct_answers_xml,
                                                one_question_at_a_time=quiz.one_question_at_a_time_xml,
                                                cant_go_back=quiz.cant_go_back_xml)
-        self.assessment = assessment(quiz=quiz,
-                                     assessment_identifier=self.assessment_identifier,
-                                     title_xml=quiz.title_xml)
+
+
+    def _iter_imsmanifest(self) -> Iterator[str]:
+        return iter_imsmanifest(manifest_identifier=self.manifest_identifier,
+                                assessment_identifier=self.assessment_identifier,
+                                dependency_identifier=self.dependency_identifier,
+                                images=self.quiz.images)
+
+    def _iter_assessment(self) -> Iterator[str]:
+        return iter_assessment(quiz=self.quiz,
+                               assessment_identifier=self.assessment_identifier,
+                               title_xml=self.quiz.title_xml)
+
+    @property
+    def imsmanifest_xml(self) -> str:
+        '''
+        `imsmanifest.xml`, generated on each access.
+        '''
+        return ''.join(self._iter_imsmanifest())
+
+    @property
+    def assessment(self) -> str:
+        '''
+        Assessment XML, generated on each access.  `.write()` and `.save()`
+        do not need the complete string, since they write the XML into the
+        archive as it is generated.
+        '''
+        return ''.join(self._iter_assessment())
+
+
+    # Characters of XML that are encoded and written to the archive at once
+    xml_chunk_size = 64*1024
+
+    @staticmethod
+    def _zip_info(zf: zipfile.ZipFile, name: str, file_size: int=0) -> zipfile.ZipInfo:
+        '''
+        Entry with the same attributes as `zf.writestr(<name>, <data>)`, for
+        writing with `zf.open(<zinfo>, 'w')`.  `file_size` determines whether
+        the entry needs ZIP64.
+        '''
+        zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = zf.compression
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = file_size
+        return zinfo
+
+    def _write_xml(self, zf: zipfile.ZipFile, name: str, xml_fragments: Iterable[str]):
+        '''
+        Write XML into an archive entry as it is generated, buffering at most
+        about `xml_chunk_size` characters.
+        '''
+        with zf.open(self._zip_info(zf, name), 'w') as f:
+            buffer = []
+            buffer_size = 0
+            for fragment in xml_fragments:
+                buffer.append(fragment)
+                buffer_size += len(fragment)
+                if buffer_size >= self.xml_chunk_size:
+                    f.write(''.join(buffer).encode('utf8'))
+                    buffer = []
+                    buffer_size = 0
+            if buffer:
+                f.write(''.join(buffer).encode('utf8'))
 
 
     def write(self, bytes_stream: BinaryIO):
+        '''
+        Write the QTI zip archive to a stream.  XML is written into the
+        archive as it is generated, and images are copied in chunks, so
+        memory use does not depend on the size of the quiz or its images.
+        '''
         with zipfile.ZipFile(bytes_stream, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-            zf.writestr('imsmanifest.xml', self.imsmanifest_xml)
+            self._write_xml(zf, 'imsmanifest.xml', self._iter_imsmanifest())
             zf.writestr(zipfile.ZipInfo('non_cc_assessments/'), b'')
             zf.writestr(f'{self.assessment_identifier}/assessment_meta.xml', self.assessment_meta)
-            zf.writestr(f'{self.assessment_identifier}/{self.assessment_identifier}.xml', self.assessment)
+            self._write_xml(zf, f'{self.assessment_identifier}/{self.assessment_identifier}.xml',
+                            self._iter_assessment())
             for image in self.quiz.images.values():
-                zf.writestr(image.qti_zip_path, image.data)
+                with zf.open(self._zip_info(zf, image.qti_zip_path, image.size), 'w') as f:
+                    image.copy_to(f)
 
 
     def zip_bytes(self) -> bytes:
@@ -67,8 +135,23 @@ class QTI(object):
 
 
     def save(self, qti_path: Union[str, pathlib.Path]):
+        '''
+        Write the QTI zip archive to a file.  The archive is written to a
+        temporary file in the same directory, which then replaces `qti_path`,
+        so that a failure does not leave an incomplete archive.
+        '''
         if isinstance(qti_path, str):
             qti_path = pathlib.Path(qti_path)
         elif not isinstance(qti_path, pathlib.Path):
             raise TypeError
-        qti_path.write_bytes(self.zip_bytes())
+        temp_path = qti_path.with_name(f'{qti_path.name}.tmp')
+        try:
+            with temp_path.open('wb') as f:
+                self.write(f)
+            os.replace(temp_path, qti_path)
+        except BaseException:
+            try:
+                temp_path.unlink()
+            except OSError:
+                pass
+            raise
@@ -14,20 +14,31 @@ of which contains a list of Choice objects.
 '''
 
 
+import bisect
+import concurrent.futures
+import copy
+import functools
 import hashlib
 import io
 import itertools
 import locale
+import os
 import pathlib
 import platform
 import re
 import shutil
+import signal
 import subprocess
+import sys
 import tempfile
-from typing import Dict, List, Optional, Set, Union
+import time
+import typing
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from .code_cache import CodeOutputCache
+from .code_server import PythonSession, get_python_fork_server, resource_limits, resource_limits_command
 from .config import Config
-from .err import Text2qtiError
-from .markdown import Image, Markdown
+from .err import Diagnostic, Text2qtiError
+from .markdown import Image, Markdown, RecordingMarkdown
 
 
 
@@ -86,47 +97,337 @@ multi_line = set([x for x in start_patterns
                   if x not in no_content and x not in single_line])
 # whether parser needs to check for multi-paragraph content
 multi_para = set([x for x in multi_line if 'title' not in x])
-start_re = re.compile('|'.join(r'(?P<{0}>{1}[ \t]+(?=\S))'.format(name, pattern)
-                               if name not in no_content else
-                               r'(?P<{0}>{1}\s*)$'.format(name, pattern)
-                               for name, pattern in start_patterns.items()))
-start_missing_content_re = re.compile('|'.join(r'(?P<{0}>{1}[ \t]*$)'.format(name, pattern)
-                                               for name, pattern in start_patterns.items()
-                                               if name not in no_content))
-start_missing_whitespace_re = re.compile('|'.join(r'(?P<{0}>{1}(?=\S))'.format(name, pattern)
-                                                  for name, pattern in start_patterns.items()
-                                                  if name not in no_content))
+# first characters that each start pattern can match, for dispatching on
+# the first character of a line; `question` also matches any other Unicode
+# decimal digit, like `\d`
+start_pattern_first_chars = {
+    'question': '0123456789',
+    'mctf_correct_choice': '*',
+    'mctf_incorrect_choice': 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    'multans_correct_choice': '[',
+    'multans_incorrect_choice': '[',
+    'shortans_correct_choice': '*',
+    'feedback': '.',
+    'correct_feedback': '+',
+    'incorrect_feedback': '-',
+    'solution': '!',
+    'essay': '_',
+    'upload': '^',
+    'numerical': '=',
+    'question_title': 'Tt',
+    'question_points': 'Pp',
+    'text_title': 'Tt',
+    'text': 'Tt',
+    'quiz_title': 'Qq',
+    'quiz_description': 'Qq',
+    'start_group': 'G',
+    'end_group': 'E',
+    'group_pick': 'Pp',
+    'group_solutions_pick': 'Ss',
+    'group_points_per_question': 'Pp',
+    'start_code': '`',
+    'end_code': '`',
+    'quiz_shuffle_answers': 'Ss',
+    'quiz_show_correct_answers': 'Ss',
+    'quiz_one_question_at_a_time': 'Oo',
+    'quiz_cant_go_back': 'Cc',
+    'quiz_feedback_is_solution': 'Ff',
+    'quiz_solutions_sample_groups': 'Ss',
+    'quiz_solutions_randomize_groups': 'Ss',
+}
+
+
+class StartPatternMatcher(object):
+    '''
+    Match the start of a line against start patterns.  This gives the same
+    result as a regex alternation of all patterns, but dispatches on the
+    first character of the line so that only an alternation of the patterns
+    that can start with that character is tried.  Lines that cannot start
+    with any pattern, like indented continuation lines, never invoke a regex.
+    Each alternation is compiled the first time that it is needed, since most
+    quizzes only use a few of them.
+    '''
+    def __init__(self, group_template: Callable[[str, str], str], names: Iterable[str]):
+        names = list(names)
+        dispatch_names: Dict[str, List[str]] = {}
+        for name in names:
+            for char in start_pattern_first_chars[name]:
+                dispatch_names.setdefault(char, []).append(name)
+        self._dispatch_patterns: Dict[str, str] = {}
+        for char, char_names in dispatch_names.items():
+            # Pattern order is preserved, so alternation priority is as well
+            self._dispatch_patterns[char] = '|'.join(group_template(name, start_patterns[name])
+                                                     for name in char_names)
+        self._dispatch: Dict[str, typing.Pattern[str]] = {}
+
+    def match(self, line: str) -> Optional[typing.Match[str]]:
+        first_char = line[:1]
+        pattern_re = self._dispatch.get(first_char)
+        if pattern_re is None:
+            if first_char not in self._dispatch_patterns:
+                if '0' not in self._dispatch_patterns or not first_char.isdecimal():
+                    return None
+                first_char = '0'
+            pattern_re = self._dispatch.get(first_char)
+            if pattern_re is None:
+                pattern_re = re.compile(self._dispatch_patterns[first_char])
+                self._dispatch[first_char] = pattern_re
+        return pattern_re.match(line)
+
+
+start_re = StartPatternMatcher(lambda name, pattern: r'(?P<{0}>{1}[ \t]+(?=\S))'.format(name, pattern)
+                                                    if name not in no_content else
+                                                    r'(?P<{0}>{1}\s*)$'.format(name, pattern),
+                               start_patterns)
+start_missing_content_re = StartPatternMatcher(lambda name, pattern: r'(?P<{0}>{1}[ \t]*$)'.format(name, pattern),
+                                               (name for name in start_patterns if name not in no_content))
+start_missing_whitespace_re = StartPatternMatcher(lambda name, pattern: r'(?P<{0}>{1}(?=\S))'.format(name, pattern),
+                                                  (name for name in start_patterns if name not in no_content))
 start_code_supported_info_re = re.compile(r'\{\s*'
                                           r'\.(?P<lang>[a-zA-Z](?:[a-zA-Z0-9]+|[\._\-]+[a-zA-Z0-9]+)*)'
                                           r'\s+'
                                           r'\.run'
-                                          r'(?:\s+executable=(?P<executable>[~\w/\.\-]+|"[^\\\"\']+"))?'
+                                          r'(?P<attrs>(?:\s+(?:executable|seed|session)=(?:[~\w/\.\-]+|"[^\\\"\']+"))*)'
                                           r'\s*\}$')
+# Attributes of executable code blocks, in any order
+start_code_attr_re = re.compile(r'(?P<key>executable|seed|session)=(?P<value>[~\w/\.\-]+|"[^\\\"\']+")')
+code_session_name_re = re.compile(r'[\w\-]+$')
+# Choices that make a multiple-choice question a true/false question.  These
+# are interned, since they are repeated across many questions.
+true_false_choices = ('true', 'True', 'false', 'False')
+
 int_re = re.compile('(?:0|[+-]?[1-9](?:[0-9]+|_[0-9]+)*)$')
 
 
 
 
+@functools.lru_cache(maxsize=None)
+def _which(executable: str) -> Optional[str]:
+    '''
+    `shutil.which()`, with results cached for the life of the process.
+    '''
+    return shutil.which(executable)
+
+
+@functools.lru_cache(maxsize=None)
+def _python_executable() -> str:
+    '''
+    Determine how to interpret `.python` for executable code blocks.  If
+    `python3` exists, use it instead of `python` if `python` does not exist
+    or if `python` is equivalent to `python2`.  This is only determined once
+    per process, when the first Python code block is found.
+    '''
+    if not _which('python2') or not _which('python3'):
+        return 'python'
+    if not _which('python'):
+        return 'python3'
+    if pathlib.Path(_which('python')).resolve() == pathlib.Path(_which('python2')).resolve():
+        return 'python3'
+    return 'python'
+
+
+
+
+def _iter_stream_lines(stream: Iterable[str], source_lines: Optional[List[str]]=None) -> Iterator[str]:
+    '''
+    Normalize an iterable of text into lines equivalent to `str.splitlines()`.
+    Each item is one line, with or without a line terminator; an empty item
+    is an empty line.  If `source_lines` is a list, lines are also appended
+    to it.
+    '''
+    for chunk in stream:
+        lines = chunk.splitlines()
+        if not lines:
+            lines = ['']
+        if source_lines is not None:
+            source_lines.extend(lines)
+        yield from lines
+
+
+
+
+
+# actions that start a new block of source for the source map
+block_start_actions = set(['question_title', 'question_points', 'question', 'text_title', 'text',
+                           'start_group', 'end_group'])
+# actions that finalize the preceding question
+question_end_actions = set(['question', 'text_title', 'text', 'start_group', 'end_group'])
+# actions that add to the current question, so that an error in them makes
+# the question invalid
+question_part_actions = set(['mctf_correct_choice', 'mctf_incorrect_choice',
+                             'multans_correct_choice', 'multans_incorrect_choice', 'shortans_correct_choice',
+                             'feedback', 'correct_feedback', 'incorrect_feedback', 'solution',
+                             'essay', 'upload', 'numerical'])
+
+
+class SourceBlock(object):
+    '''
+    A block of source lines.  A block starts at a question (including any
+    title and points that precede it), a text region, a group delimiter, or
+    an executable code block, and extends to the start of the next block.
+    '''
+    __slots__ = ('start', 'end', '_hasher', 'digest', 'has_code', 'has_images', 'objects')
+
+    def __init__(self, start: int):
+        # Zero-based index of first line, and index after last line
+        self.start = start
+        self.end = start
+        self._hasher = hashlib.blake2b()
+        self.digest: Optional[bytes] = None
+        self.has_code = False
+        self.has_images = False
+        self.objects: List[Union['Question', 'GroupStart', 'GroupEnd', 'TextRegion']] = []
+
+    def update(self, n: int, line: str):
+        self.end = n + 1
+        self._hasher.update(line.encode('utf8'))
+        self._hasher.update(b'\n')
+
+    def finalize(self):
+        self.digest = self._hasher.digest()
+        self._hasher = None
+
+
+class SourceMap(object):
+    '''
+    Split source lines into blocks as they are read.  This only looks at
+    which lines start questions, text regions, group delimiters, comments,
+    and executable code blocks, so it gives the same blocks whether or not
+    the source is valid.
+    '''
+    def __init__(self):
+        self.blocks: List[SourceBlock] = [SourceBlock(0)]
+        self._block_starts: List[int] = [0]
+        self._pending: Optional[str] = None
+        self._in_comment = False
+        self._code_delim: Optional[str] = None
+
+    def _open_block(self, n: int) -> SourceBlock:
+        block = self.blocks[-1]
+        if block.end == block.start:
+            block.start = block.end = n
+            self._block_starts[-1] = n
+        else:
+            block = SourceBlock(n)
+            self.blocks.append(block)
+            self._block_starts.append(n)
+        return block
+
+    def feed(self, n: int, line: str):
+        block = self.blocks[-1]
+        if self._in_comment:
+            if line.startswith(comment_patterns['end_multiline_comment']):
+                self._in_comment = False
+        elif self._code_delim is not None:
+            delim = self._code_delim
+            if line.startswith(delim) and line[len(delim):] == line.lstrip('`'):
+                self._code_delim = None
+        else:
+            match = start_re.match(line)
+            if match:
+                action = match.lastgroup
+                if action == 'start_code':
+                    if start_code_supported_info_re.match(line.lstrip('`').strip()):
+                        block = self._open_block(n)
+                        block.has_code = True
+                        self._code_delim = '`'*(len(line) - len(line.lstrip('`')))
+                        self._pending = None
+                elif action in block_start_actions:
+                    # Question title and points belong to the following
+                    # question, and text belongs to a preceding text title.
+                    if not ((self._pending == 'question' and action in ('question_points', 'question')) or
+                            (self._pending == 'text_title' and action == 'text')):
+                        block = self._open_block(n)
+                    if action in ('question_title', 'question_points'):
+                        self._pending = 'question'
+                    elif action == 'text_title':
+                        self._pending = 'text_title'
+                    else:
+                        self._pending = None
+            elif line.startswith(comment_patterns['start_multiline_comment']):
+                self._in_comment = True
+        if '![' in line:
+            # Content with images depends on image files as well as on
+            # source text, so it is never reused
+            block.has_images = True
+        block.update(n, line)
+
+    def block_at(self, n: int) -> SourceBlock:
+        return self.blocks[bisect.bisect_right(self._block_starts, n) - 1]
+
+    def finalize(self):
+        for block in self.blocks:
+            block.finalize()
+
+
+
+
+class RenderedMarkdown(object):
+    '''
+    HTML/XML attribute converted from the raw Markdown in another attribute.
+
+    Conversion happens on first access, and the result is cached on the
+    instance.  `.prepare()` is called when the raw Markdown is set.  For
+    rendered quizzes, it converts immediately, so that errors are reported
+    with the line where they occur and images are found in source order.
+    Otherwise, it only checks the Markdown.
+    '''
+    def __init__(self, raw_attr: str, default: Optional[str]=None):
+        self.raw_attr = raw_attr
+        self.default = default
+
+    def __set_name__(self, owner, name: str):
+        self.cache_attr = f'_{name}'
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        html_xml = getattr(obj, self.cache_attr, None)
+        if html_xml is None:
+            raw = getattr(obj, self.raw_attr)
+            if raw is None:
+                return self.default
+            html_xml = obj.md.md_to_html_xml(raw)
+            setattr(obj, self.cache_attr, html_xml)
+        return html_xml
+
+    def prepare(self, obj):
+        if obj.md.render:
+            self.__get__(obj)
+        else:
+            obj.md.check_markdown(getattr(obj, self.raw_attr))
+
+
+
+
 class TextRegion(object):
     '''
     A text region between questions.
     '''
+    __slots__ = ('title_raw', 'title_xml', 'text_raw', '_text_html_xml', 'md', '_index',
+                 'source_span', 'source_hash')
+
+    text_html_xml = RenderedMarkdown('text_raw', default='')
+
     def __init__(self, *, index: int, md: Markdown):
         self.title_raw: Optional[str] = None
         self.title_xml = ''
         self.text_raw: Optional[str] = None
-        self.text_html_xml = ''
         self.md = md
         self._index = index
+        # 1-based first and last lines, and hash of source block
+        self.source_span: Optional[Tuple[int, int]] = None
+        self.source_hash: Optional[bytes] = None
 
-    def _set_id(self):
+    @property
+    def id(self) -> str:
         h = hashlib.blake2b()
         h.update(f'{self._index}'.encode('utf8'))
         h.update(h.digest())
         h.update(self.title_xml.encode('utf8'))
         h.update(h.digest())
         h.update(self.text_html_xml.encode('utf8'))
-        self.id = h.hexdigest()[:64]
+        return h.hexdigest()[:64]
 
     def set_title(self, text: str):
         if self.title_raw is not None:
@@ -135,14 +436,20 @@ class TextRegion(object):
             raise Text2qtiError('Must set text title before text itself')
         self.title_raw = text
         self.title_xml = self.md.xml_escape(text)
-        self._set_id()
 
     def set_text(self, text: str):
         if self.text_raw is not None:
             raise Text2qtiError('Text has already been set')
         self.text_raw = text
-        self.text_html_xml = self.md.md_to_html_xml(text)
-        self._set_id()
+        TextRegion.text_html_xml.prepare(self)
+
+    def drop_raw(self):
+        '''
+        Free raw text once HTML/XML has been produced.
+        '''
+        self.text_html_xml
+        self.title_raw = None
+        self.text_raw = None
 
 
 
@@ -154,25 +461,60 @@ class Choice(object):
     The id is based on a hash of both the question and the choice itself.
     The presence of feedback does not affect the id.
     '''
+    __slots__ = ('choice_raw', 'choice_xml', '_choice_html_xml', 'correct', 'shortans',
+                 'feedback_raw', '_feedback_html_xml', '_question')
+
+    choice_html_xml = RenderedMarkdown('choice_raw')
+    feedback_html_xml = RenderedMarkdown('feedback_raw')
+
     def __init__(self, text: str, *,
                  correct: bool, shortans: bool=False,
-                 question_hash_digest: bytes, md: Markdown):
+                 question: 'Question', md: Markdown):
+        if text in true_false_choices:
+            text = sys.intern(text)
         self.choice_raw = text
+        self._question = question
         if shortans:
             self.choice_xml = md.xml_escape(text)
         else:
-            self.choice_html_xml = md.md_to_html_xml(text)
+            Choice.choice_html_xml.prepare(self)
+            if text in true_false_choices and md.render:
+                self._choice_html_xml = sys.intern(self._choice_html_xml)
         self.correct = correct
         self.shortans = shortans
         self.feedback_raw: Optional[str] = None
-        self.feedback_html_xml: Optional[str] = None
+
+    @property
+    def md(self) -> Markdown:
+        return self._question.md
+
+    @property
+    def id(self) -> str:
         # ID is based on hash of choice XML as well as question XML.  This
         # gives different IDs for identical choices in different questions.
-        if shortans:
-            self.id = hashlib.blake2b(self.choice_xml.encode('utf8'), key=question_hash_digest).hexdigest()[:64]
+        if self.shortans:
+            choice_xml = self.choice_xml
         else:
-            self.id = hashlib.blake2b(self.choice_html_xml.encode('utf8'), key=question_hash_digest).hexdigest()[:64]
-        self.md = md
+            choice_xml = self.choice_html_xml
+        return hashlib.blake2b(choice_xml.encode('utf8'), key=self._question.hash_digest).hexdigest()[:64]
+
+    @property
+    def duplicate_key(self) -> str:
+        '''
+        Key for detecting duplicate choices.  This uses the XML version of the
+        choice when available, to avoid the issue of multiple Markdown
+        representations of the same XML.
+
+        Without rendering, this is the raw Markdown.  Identical Markdown
+        always gives identical XML, so any duplicate found this way is also a
+        duplicate when rendering.  Markdown that differs but gives the same
+        XML, such as `*x*` and `_x_`, is only found when rendering.
+        '''
+        if self.shortans:
+            return self.choice_xml
+        if self.md.render:
+            return self.choice_html_xml
+        return self.choice_raw
 
     def append_feedback(self, text: str):
         if self.shortans:
@@ -180,7 +522,17 @@ class Choice(object):
         if self.feedback_raw is not None:
             raise Text2qtiError('Feedback can only be specified once')
         self.feedback_raw = text
-        self.feedback_html_xml = self.md.md_to_html_xml(text)
+        Choice.feedback_html_xml.prepare(self)
+
+    def drop_raw(self):
+        '''
+        Free raw text once HTML/XML has been produced.
+        '''
+        if not self.shortans:
+            self.choice_html_xml
+        self.feedback_html_xml
+        self.choice_raw = None
+        self.feedback_raw = None
 
 
 class Question(object):
@@ -188,6 +540,20 @@ class Question(object):
     A question, along with a list of possible choices and optional feedback of
     various types.
     '''
+    __slots__ = ('type', 'quiz', 'title_raw', 'title_xml', 'question_raw', '_question_html_xml',
+                 'choices', '_choice_set',
+                 'numerical_raw', 'numerical_min', 'numerical_min_html_xml',
+                 'numerical_exact', 'numerical_exact_html_xml', 'numerical_max', 'numerical_max_html_xml',
+                 'correct_choices', 'points_possible_raw', 'points_possible',
+                 'feedback_raw', '_feedback_html_xml', 'correct_feedback_raw', '_correct_feedback_html_xml',
+                 'incorrect_feedback_raw', '_incorrect_feedback_html_xml',
+                 'solution', '_hash_digest', 'md', 'source_span', 'source_hash')
+
+    question_html_xml = RenderedMarkdown('question_raw')
+    feedback_html_xml = RenderedMarkdown('feedback_raw')
+    correct_feedback_html_xml = RenderedMarkdown('correct_feedback_raw')
+    incorrect_feedback_html_xml = RenderedMarkdown('incorrect_feedback_raw')
+
     def __init__(self, text: str, *, quiz: 'Quiz', title: Optional[str], points: Optional[str], md: Markdown):
         # Question type is set once it is known.  For true/false or multiple
         # choice, this is done during .finalize(), once all choices are
@@ -201,12 +567,11 @@ class Question(object):
         else:
             self.title_raw: Optional[str] = title
             self.title_xml = md.xml_escape(title)
+        self.md = md
         self.question_raw = text
-        self.question_html_xml = md.md_to_html_xml(text)
+        Question.question_html_xml.prepare(self)
         self.choices: List[Choice] = []
-        # The set for detecting duplicate choices uses the XML version of the
-        # choices, to avoid the issue of multiple Markdown representations of
-        # the same XML.
+        # Set of `Choice.duplicate_key` for detecting duplicate choices
         self._choice_set: Set[str] = set()
         self.numerical_raw: Optional[str] = None
         self.numerical_min: Optional[Union[int, float]] = None
@@ -233,16 +598,34 @@ class Question(object):
                 raise Text2qtiError(f'Invalid points value "{points}"; need positive integer or half-integer')
             self.points_possible: Union[int, float] = points_num
         self.feedback_raw: Optional[str] = None
-        self.feedback_html_xml: Optional[str] = None
         self.correct_feedback_raw: Optional[str] = None
-        self.correct_feedback_html_xml: Optional[str] = None
         self.incorrect_feedback_raw: Optional[str] = None
-        self.incorrect_feedback_html_xml: Optional[str] = None
         self.solution: Optional[str] = None
-        h = hashlib.blake2b(self.question_html_xml.encode('utf8'))
-        self.hash_digest = h.digest()
-        self.id = h.hexdigest()[:64]
-        self.md = md
+        self._hash_digest: Optional[bytes] = None
+        # 1-based first and last lines, and hash of source block
+        self.source_span: Optional[Tuple[int, int]] = None
+        self.source_hash: Optional[bytes] = None
+
+    @property
+    def hash_digest(self) -> bytes:
+        if self._hash_digest is None:
+            self._hash_digest = hashlib.blake2b(self.question_html_xml.encode('utf8')).digest()
+        return self._hash_digest
+
+    @property
+    def id(self) -> str:
+        return self.hash_digest.hex()[:64]
+
+    @property
+    def duplicate_key(self) -> str:
+        '''
+        Key for detecting duplicate questions.  This is the XML version of the
+        question when it is rendered, and otherwise the raw Markdown, which
+        finds fewer duplicates (see `Choice.duplicate_key`).
+        '''
+        if self.md.render:
+            return self.question_html_xml
+        return self.question_raw
 
 
     def append_feedback(self, text: str):
@@ -252,7 +635,7 @@ class Question(object):
             if self.feedback_raw is not None:
                 raise Text2qtiError('Feedback can only be specified once')
             self.feedback_raw = text
-            self.feedback_html_xml = self.md.md_to_html_xml(text)
+            Question.feedback_html_xml.prepare(self)
             if self.quiz.feedback_is_solution:
                 self.solution = text
         else:
@@ -264,7 +647,7 @@ class Question(object):
         if self.correct_feedback_raw is not None:
             raise Text2qtiError('Feedback can only be specified once')
         self.correct_feedback_raw = text
-        self.correct_feedback_html_xml = self.md.md_to_html_xml(text)
+        Question.correct_feedback_html_xml.prepare(self)
 
     def append_incorrect_feedback(self, text: str):
         if self.type is not None:
@@ -272,7 +655,7 @@ class Question(object):
         if self.incorrect_feedback_raw is not None:
             raise Text2qtiError('Feedback can only be specified once')
         self.incorrect_feedback_raw = text
-        self.incorrect_feedback_html_xml = self.md.md_to_html_xml(text)
+        Question.incorrect_feedback_html_xml.prepare(self)
 
     def append_solution(self, text: str):
         if self.type is not None:
@@ -288,10 +671,10 @@ class Question(object):
             self.type = 'multiple_choice_question'
         elif self.type != 'multiple_choice_question':
             raise Text2qtiError(f'Question type "{self.type}" does not support multiple choice')
-        choice = Choice(text, correct=True, question_hash_digest=self.hash_digest, md=self.md)
-        if choice.choice_html_xml in self._choice_set:
-            raise Text2qtiError('Duplicate choice for question')
-        self._choice_set.add(choice.choice_html_xml)
+        choice = Choice(text, correct=True, question=self, md=self.md)
+        if choice.duplicate_key in self._choice_set:
+            raise Text2qtiError('Duplicate choice for question', code='duplicate-choice')
+        self._choice_set.add(choice.duplicate_key)
         self.choices.append(choice)
         self.correct_choices += 1
 
@@ -300,10 +683,10 @@ class Question(object):
             self.type = 'multiple_choice_question'
         elif self.type != 'multiple_choice_question':
             raise Text2qtiError(f'Question type "{self.type}" does not support multiple choice')
-        choice = Choice(text, correct=False, question_hash_digest=self.hash_digest, md=self.md)
-        if choice.choice_html_xml in self._choice_set:
-            raise Text2qtiError('Duplicate choice for question')
-        self._choice_set.add(choice.choice_html_xml)
+        choice = Choice(text, correct=False, question=self, md=self.md)
+        if choice.duplicate_key in self._choice_set:
+            raise Text2qtiError('Duplicate choice for question', code='duplicate-choice')
+        self._choice_set.add(choice.duplicate_key)
         self.choices.append(choice)
 
     def append_shortans_correct_choice(self, text: str):
@@ -311,10 +694,10 @@ class Question(object):
             self.type = 'short_answer_question'
         elif self.type != 'short_answer_question':
             raise Text2qtiError(f'Question type "{self.type}" does not support short answer')
-        choice = Choice(text, correct=True, shortans=True, question_hash_digest=self.hash_digest, md=self.md)
-        if choice.choice_xml in self._choice_set:
-            raise Text2qtiError('Duplicate choice for question')
-        self._choice_set.add(choice.choice_xml)
+        choice = Choice(text, correct=True, shortans=True, question=self, md=self.md)
+        if choice.duplicate_key in self._choice_set:
+            raise Text2qtiError('Duplicate choice for question', code='duplicate-choice')
+        self._choice_set.add(choice.duplicate_key)
         self.choices.append(choice)
         self.correct_choices += 1
 
@@ -323,10 +706,10 @@ class Question(object):
             self.type = 'multiple_answers_question'
         elif self.type != 'multiple_answers_question':
             raise Text2qtiError(f'Question type "{self.type}" does not support multiple answers')
-        choice = Choice(text, correct=True, question_hash_digest=self.hash_digest, md=self.md)
-        if choice.choice_html_xml in self._choice_set:
-            raise Text2qtiError('Duplicate choice for question')
-        self._choice_set.add(choice.choice_html_xml)
+        choice = Choice(text, correct=True, question=self, md=self.md)
+        if choice.duplicate_key in self._choice_set:
+            raise Text2qtiError('Duplicate choice for question', code='duplicate-choice')
+        self._choice_set.add(choice.duplicate_key)
         self.choices.append(choice)
         self.correct_choices += 1
 
@@ -335,10 +718,10 @@ class Question(object):
             self.type = 'multiple_answers_question'
         elif self.type != 'multiple_answers_question':
             raise Text2qtiError(f'Question type "{self.type}" does not support multiple answers')
-        choice = Choice(text, correct=False, question_hash_digest=self.hash_digest, md=self.md)
-        if choice.choice_html_xml in self._choice_set:
-            raise Text2qtiError('Duplicate choice for question')
-        self._choice_set.add(choice.choice_html_xml)
+        choice = Choice(text, correct=False, question=self, md=self.md)
+        if choice.duplicate_key in self._choice_set:
+            raise Text2qtiError('Duplicate choice for question', code='duplicate-choice')
+        self._choice_set.add(choice.duplicate_key)
         self.choices.append(choice)
 
     def append_essay(self, text: str):
@@ -441,26 +824,44 @@ class Question(object):
 
     def finalize(self):
         if self.type is None:
-            raise Text2qtiError('Question must specify a response type')
+            raise Text2qtiError('Question must specify a response type', code='incomplete-question')
         elif self.type == 'multiple_choice_question':
-            if len(self.choices) == 2 and all(c.choice_raw in ('true', 'True', 'false', 'False') for c in self.choices):
+            if len(self.choices) == 2 and all(c.choice_raw in true_false_choices for c in self.choices):
                 self.type = 'true_false_question'
             if not self.choices:
-                raise Text2qtiError('Question must provide choices')
+                raise Text2qtiError('Question must provide choices', code='incomplete-question')
             if len(self.choices) < 2:
-                raise Text2qtiError('Question must provide more than one choice')
+                raise Text2qtiError('Question must provide more than one choice', code='incomplete-question')
             if self.correct_choices < 1:
-                raise Text2qtiError('Question must specify a correct choice')
+                raise Text2qtiError('Question must specify a correct choice', code='incomplete-question')
             if self.correct_choices > 1:
-                raise Text2qtiError('Question must specify only one correct choice')
+                raise Text2qtiError('Question must specify only one correct choice', code='incomplete-question')
         elif self.type == 'short_answer_question':
             if not self.choices:
-                raise Text2qtiError('Question must provide at least one answer')
+                raise Text2qtiError('Question must provide at least one answer', code='incomplete-question')
         elif self.type == 'multiple_answers_question':
             if len(self.choices) < 2:
-                raise Text2qtiError('Question must provide more than one choice')
+                raise Text2qtiError('Question must provide more than one choice', code='incomplete-question')
             if self.correct_choices < 1:
-                raise Text2qtiError('Question must specify a correct choice')
+                raise Text2qtiError('Question must specify a correct choice', code='incomplete-question')
+
+    def drop_raw(self):
+        '''
+        Free raw text once HTML/XML has been produced.  This must follow
+        `.finalize()`.
+        '''
+        for attr in ('question_html_xml', 'feedback_html_xml', 'correct_feedback_html_xml',
+                     'incorrect_feedback_html_xml', 'hash_digest'):
+            getattr(self, attr)
+        for choice in self.choices:
+            choice.drop_raw()
+        self.title_raw = None
+        self.question_raw = None
+        self.numerical_raw = None
+        self.points_possible_raw = None
+        self.feedback_raw = None
+        self.correct_feedback_raw = None
+        self.incorrect_feedback_raw = None
 
 
 
@@ -470,6 +871,10 @@ class Group(object):
     A group of questions.  A random subset of the questions in a group is
     actually displayed.
     '''
+    __slots__ = ('pick', '_pick_is_set', 'solutions_pick', 'points_per_question',
+                 '_points_per_question_is_set', 'questions', '_question_points_possible',
+                 'title_raw', 'title_xml', 'source_span', 'source_hash')
+
     def __init__(self):
         self.pick = 1
         self._pick_is_set = False
@@ -480,6 +885,9 @@ class Group(object):
         self._question_points_possible: Optional[Union[int, float]] = None
         self.title_raw: Optional[str] = None
         self.title_xml = 'Group'
+        # 1-based first and last lines, and hash of source blocks
+        self.source_span: Optional[Tuple[int, int]] = None
+        self.source_hash: Optional[bytes] = None
 
     def append_group_pick(self, text: str):
         if self.questions:
@@ -535,16 +943,24 @@ class Group(object):
             raise Text2qtiError(f'Question group only contains {len(self.questions)} questions, needs at least {self.pick+1}')
         if self.solutions_pick is not None and len(self.questions) < self.solutions_pick:
             raise Text2qtiError(f'Question group only contains {len(self.questions)} questions, needs at least {self.solutions_pick}')
+
+    @property
+    def hash_digest(self) -> bytes:
         h = hashlib.blake2b()
         for digest in sorted(q.hash_digest for q in self.questions):
             h.update(digest)
-        self.hash_digest = h.digest()
-        self.id = h.hexdigest()[:64]
+        return h.digest()
+
+    @property
+    def id(self) -> str:
+        return self.hash_digest.hex()[:64]
 
 class GroupStart(object):
     '''
     Start delim for a group of questions.
     '''
+    __slots__ = ('group',)
+
     def __init__(self, group: Group):
         self.group = group
 
@@ -552,6 +968,8 @@ class GroupEnd(object):
     '''
     End delim for a group of questions.
     '''
+    __slots__ = ('group',)
+
     def __init__(self, group: Group):
         self.group = group
 
@@ -563,10 +981,138 @@ class Quiz(object):
     A quiz or assessment.  Contains a list of questions along with possible
     choices and feedback.
     '''
+    description_html_xml = RenderedMarkdown('description_raw', default='')
+
     def __init__(self, string: str, *, config: Config,
                  source_name: Optional[str]=None,
-                 resource_path: Optional[Union[str, pathlib.Path]]=None):
-        self.string = string
+                 resource_path: Optional[Union[str, pathlib.Path]]=None,
+                 previous: Optional['Quiz']=None,
+                 jobs: int=1,
+                 render: bool=True,
+                 low_memory: bool=False,
+                 collect_errors: bool=False):
+        '''
+        If `previous` is a quiz parsed from an earlier version of the source,
+        questions and text regions whose source blocks are unchanged are
+        reused rather than parsed and rendered again.
+
+        If `jobs` is greater than 1, Markdown for large quizzes is rendered
+        in a pool of `jobs` worker processes before parsing, and executable
+        code blocks are run up to `jobs` at a time.  Code output is still
+        inserted where each code block is, and is parsed in order.  With
+        Pandoc MathML, equations are converted in batches before parsing.
+
+        If `render` is false, the quiz is only validated:  all syntax and
+        semantic checks are performed, but Markdown is not converted to HTML,
+        so LaTeX is not converted and image files are not checked.  Duplicate
+        questions and choices are then detected based on their Markdown
+        rather than their HTML.  HTML attributes are still converted on
+        demand if accessed, but a validated quiz cannot be used for QTI.
+
+        If `low_memory` is true, raw text for questions, choices, feedback,
+        and text regions is freed once parsing is complete, keeping only the
+        HTML/XML that is needed for QTI.  Such quizzes cannot be exported as
+        solutions.
+
+        If `collect_errors` is true, parsing continues after an error at the
+        next question, text region, group delimiter, code block, or comment,
+        and the `Text2qtiError` raised at the end has `diagnostics` for every
+        error found.  The quiz is also left with these in `.diagnostics`.
+        '''
+        self.string: Optional[str] = string
+        self._setup(config=config, source_name=source_name, resource_path=resource_path,
+                    render=render, low_memory=low_memory, collect_errors=collect_errors)
+        lines = string.splitlines()
+        if previous is not None:
+            self._plan_source_reuse(previous, lines)
+        if self._use_prerender(jobs):
+            self._prerender(lines, jobs)
+        try:
+            self._parse(lines)
+        finally:
+            self._shutdown_code_execution()
+
+    @classmethod
+    def from_stream(cls, stream: Iterable[str], *, config: Config,
+                    source_name: Optional[str]=None,
+                    resource_path: Optional[Union[str, pathlib.Path]]=None,
+                    keep_source: bool=False,
+                    jobs: int=1,
+                    render: bool=True,
+                    low_memory: bool=False,
+                    collect_errors: bool=False) -> 'Quiz':
+        '''
+        Create a quiz from an iterable of text, such as a file object opened in
+        text mode, a generator, or `sys.stdin`.  Lines are parsed one at a
+        time as they are read, so the full source is never held in memory.
+        Keyword arguments other than `keep_source` are as for `Quiz()`, but
+        `jobs` only applies to seekable file objects, since the source must be
+        read twice.
+
+        Each item is treated as a line, with or without its line terminator.
+        Items containing additional line breaks are split with the same rules
+        as `str.splitlines()`, so line numbers in errors are identical to
+        those for `Quiz(string)`.  If `keep_source` is true, the source lines
+        are retained in `.string` (joined with `\\n`); otherwise `.string` is
+        `None`.
+        '''
+        quiz = cls.__new__(cls)
+        quiz.string = None
+        quiz._setup(config=config, source_name=source_name, resource_path=resource_path,
+                    render=render, low_memory=low_memory, collect_errors=collect_errors)
+        if quiz._use_prerender(jobs) and getattr(stream, 'seekable', lambda: False)():
+            quiz._prerender(_iter_stream_lines(stream), jobs)
+            stream.seek(0)
+        source_lines: Optional[List[str]] = [] if keep_source else None
+        try:
+            quiz._parse(_iter_stream_lines(stream, source_lines))
+        finally:
+            quiz._shutdown_code_execution()
+        if source_lines is not None:
+            quiz.string = '\n'.join(source_lines)
+        return quiz
+
+    @classmethod
+    def from_path(cls, path: Union[str, pathlib.Path], *, config: Config,
+                  source_name: Optional[str]=None,
+                  resource_path: Optional[Union[str, pathlib.Path]]=None,
+                  keep_source: bool=False,
+                  jobs: int=1,
+                  render: bool=True,
+                  low_memory: bool=False,
+                  collect_errors: bool=False) -> 'Quiz':
+        '''
+        Create a quiz by streaming a UTF-8 file (with optional BOM) from disk.
+        See `.from_stream()`.
+        '''
+        if isinstance(path, str):
+            path = pathlib.Path(path)
+        elif not isinstance(path, pathlib.Path):
+            raise TypeError
+        if source_name is None:
+            source_name = path.as_posix()
+        try:
+            f = path.open(encoding='utf-8-sig')  # Handle BOM for Windows
+        except FileNotFoundError:
+            raise Text2qtiError(f'File "{path}" does not exist')
+        except PermissionError as e:
+            raise Text2qtiError(f'File "{path}" cannot be read due to permission error:\n{e}')
+        with f:
+            try:
+                return cls.from_stream(f, config=config, source_name=source_name,
+                                       resource_path=resource_path, keep_source=keep_source,
+                                       jobs=jobs, render=render, low_memory=low_memory,
+                                       collect_errors=collect_errors)
+            except UnicodeDecodeError as e:
+                raise Text2qtiError(f'File "{path}" is not encoded in valid UTF-8:\n{e}')
+
+    def _setup(self, *, config: Config,
+               source_name: Optional[str],
+               resource_path: Optional[Union[str, pathlib.Path]],
+               md: Optional[Markdown]=None,
+               render: bool=True,
+               low_memory: bool=False,
+               collect_errors: bool=False):
         self.config = config
         self.source_name = '<string>' if source_name is None else f'"{source_name}"'
         if resource_path is not None:
@@ -580,7 +1126,6 @@ class Quiz(object):
         self.title_raw = None
         self.title_xml = 'Quiz'
         self.description_raw = None
-        self.description_html_xml = ''
         self.shuffle_answers_raw = None
         self.shuffle_answers_xml = 'false'
         self.show_correct_answers_raw = None
@@ -594,26 +1139,318 @@ class Quiz(object):
         self.solutions_randomize_groups: Optional[bool] = None
         self.questions_and_delims: List[Union[Question, GroupStart, GroupEnd, TextRegion]] = []
         self._current_group: Optional[Group] = None
-        # The set for detecting duplicate questions uses the XML version of
-        # the question, to avoid the issue of multiple Markdown
-        # representations of the same XML.
+        # Set of `Question.duplicate_key` for detecting duplicate questions
         self.question_set: Set[str] = set()
-        self.md = Markdown(config)
+        self.md = Markdown(config, render=render) if md is None else md
         self.images: Dict[str, Image] = self.md.images
+        # Whether this is only a structural parse for `._prerender()`
+        self._recording = False
+        self._low_memory = low_memory
+        self._collect_errors = collect_errors
+        self.diagnostics: List[Diagnostic] = []
+        # Whether any code blocks were executed, so that output may differ
+        # between runs
+        self.ran_code = False
+        # Code blocks started in advance by `._prerender()`, keyed by the
+        # index of the line where the block starts, executable, code, and
+        # seed
+        self._code_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._code_jobs = 1
+        self._code_futures: Dict[Tuple[int, str, str, Optional[str]], concurrent.futures.Future] = {}
+        # For `._prerender()`, function that starts a code block in advance
+        self._code_submit: Optional[Callable[[int, str, str, Optional[str]], None]] = None
+        # Python sessions for code blocks with `session=<name>`, by name
+        self._code_sessions: Dict[str, PythonSession] = {}
+        # Wall-clock deadline for running code blocks, from the per-quiz
+        # time limit
+        if config['code_quiz_timeout'] is None:
+            self._code_deadline: Optional[float] = None
+        else:
+            self._code_deadline = time.monotonic() + config['code_quiz_timeout']
         self._next_question_attr = {}
-
-        # Determine how to interpret `.python` for executable code blocks.
-        # If `python3` exists, use it instead of `python` if `python` does not
-        # exist or if `python` is equivalent to `python2`.
-        if not shutil.which('python2') or not shutil.which('python3'):
-            python_executable = 'python'
-        elif not shutil.which('python'):
-            python_executable = 'python3'
-        elif pathlib.Path(shutil.which('python')).resolve() == pathlib.Path(shutil.which('python2')).resolve():
-            python_executable = 'python3'
+        self._source_line_count = 0
+        self._source_map = SourceMap()
+        self._reuse_plan: Dict[int, Tuple[SourceBlock, Union[Question, TextRegion]]] = {}
+        self._reusable_blocks: Dict[bytes, Union[Question, TextRegion]] = {}
+        # IDs of questions and text regions that were modified by a later
+        # source block, for example choices from code output
+        self._extended_objects: Set[int] = set()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Only needed during parsing, and refers to a previous quiz
+        state['_reuse_plan'] = {}
+        return state
+
+    def _enumerate_source_lines(self, lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+        '''
+        Enumerate source lines while keeping a running count, so that errors
+        at the end of the source can report the last line number without
+        needing the source itself.
+        '''
+        source_map = self._source_map
+        for n, line in enumerate(lines):
+            self._source_line_count = n + 1
+            source_map.feed(n, line)
+            yield n, line
+
+    def _use_prerender(self, jobs: int) -> bool:
+        '''
+        Whether `._prerender()` is worthwhile before the actual parse.
+        '''
+        if self.md.render and self.config['pandoc_mathml']:
+            return True
+        return jobs > 1 and (self.md.render or self.config['run_code_blocks'])
+
+    def _prerender(self, lines: Iterable[str], jobs: int):
+        '''
+        Do a structural parse that records all Markdown that will need to be
+        rendered, without rendering it, and then render the Markdown in a
+        process pool.  Executable code blocks found during the structural
+        parse are started in a thread pool, up to `jobs` at a time.  The
+        actual parse then finds the rendered strings in the Markdown cache
+        and the output of each code block at its position, while images,
+        errors, and anything generated by code are still handled serially,
+        in order.
+
+        With Pandoc MathML, this is also worthwhile with a single job, since
+        all equations that are not in the Pandoc cache are then converted
+        with one Pandoc process rather than one process per equation.
+        '''
+        recorder = type(self).__new__(type(self))
+        recorder.string = None
+        recorder._setup(config=self.config, source_name=None, resource_path=None, md=RecordingMarkdown())
+        recorder._recording = True
+        if self.config['run_code_blocks'] and jobs > 1:
+            self._code_jobs = jobs
+            recorder._code_submit = self._submit_code_block
+        try:
+            recorder._parse(lines)
+        except Text2qtiError:
+            # Everything before the error can still be rendered in advance
+            pass
+        if self.md.render:
+            self.md.prerender(recorder.md.recorded, jobs)
+
+    def _submit_code_block(self, n_code_start: int, executable: str, code: str, seed: Optional[str]):
+        if self._code_executor is None:
+            self._code_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._code_jobs)
+        key = (n_code_start, executable, code, seed)
+        if key not in self._code_futures:
+            self._code_futures[key] = self._code_executor.submit(self._run_code, executable, code, seed)
+
+    def _shutdown_code_execution(self):
+        '''
+        Cancel code blocks that were started in advance but never reached,
+        for example due to an error, and end code sessions.
+        '''
+        for future in self._code_futures.values():
+            future.cancel()
+        self._code_futures = {}
+        if self._code_executor is not None:
+            self._code_executor.shutdown(wait=True)
+            self._code_executor = None
+        for code_session in self._code_sessions.values():
+            code_session.close()
+        self._code_sessions = {}
+
+    def _code_output(self, n_code_start: int, executable: str, code: str,
+                     seed: Optional[str], session: Optional[str]) -> str:
+        '''
+        Output of a code block, using the result of a block started in
+        advance by `._prerender()` if there is one.  Blocks in a session
+        depend on the blocks before them, so they are always run in order
+        during the actual parse.
+        '''
+        if self._recording:
+            if self._code_submit is not None and session is None:
+                self._code_submit(n_code_start, executable, code, seed)
+            return ''
+        if session is None:
+            future = self._code_futures.pop((n_code_start, executable, code, seed), None)
+            if future is not None:
+                return future.result()
+        return self._run_code(executable, code, seed, session)
+
+    def _plan_source_reuse(self, previous: 'Quiz', lines: List[str]):
+        '''
+        Find source blocks that are unchanged from a previous parse.
+        '''
+        if (previous.config != self.config or previous.md.render != self.md.render or
+                (previous._low_memory and not self._low_memory) or not previous._reusable_blocks):
+            return
+        source_map = SourceMap()
+        for n, line in enumerate(lines):
+            source_map.feed(n, line)
+        source_map.finalize()
+        for block in source_map.blocks:
+            if block.has_code or block.has_images:
+                continue
+            obj = previous._reusable_blocks.get(block.digest)
+            if obj is not None:
+                self._reuse_plan[block.start] = (block, obj)
+
+    def _reuse_source_block(self, obj: Union[Question, TextRegion]) -> bool:
+        '''
+        Append a question or text region from a previous parse.  Return
+        false if anything about the current context could make parsing the
+        source block give a different result, including an error.
+        '''
+        if self._next_question_attr:
+            return False
+        if isinstance(obj, Question):
+            if obj.quiz.feedback_is_solution != self.feedback_is_solution:
+                return False
+            if obj.duplicate_key in self.question_set:
+                return False
+            if (self._current_group is not None and
+                    self._current_group._question_points_possible not in (None, obj.points_possible)):
+                return False
+        if self.questions_and_delims:
+            last_question_or_delim = self.questions_and_delims[-1]
+            if isinstance(last_question_or_delim, Question):
+                try:
+                    last_question_or_delim.finalize()
+                except Text2qtiError:
+                    return False
+        obj = copy.copy(obj)
+        obj.md = self.md
+        if isinstance(obj, Question):
+            # Later source blocks can still add choices and choice feedback,
+            # so these must not be shared with the previous quiz
+            obj.choices = [copy.copy(choice) for choice in obj.choices]
+            for choice in obj.choices:
+                choice._question = obj
+            obj._choice_set = set(obj._choice_set)
+            obj.quiz = self
+            self.question_set.add(obj.duplicate_key)
+            self.questions_and_delims.append(obj)
+            if self._current_group is not None:
+                self._current_group.append_question(obj)
         else:
-            python_executable = 'python'
+            obj._index = len(self.questions_and_delims)
+            self.questions_and_delims.append(obj)
+        return True
+
+    def _note_extended_object(self, n_action: int):
+        '''
+        Record when an action modifies the last question or text region from
+        a different source block, so that its own block is not reused.
+        '''
+        if not self.questions_and_delims:
+            return
+        last_question_or_delim = self.questions_and_delims[-1]
+        if not isinstance(last_question_or_delim, (Question, TextRegion)):
+            return
+        if all(obj is not last_question_or_delim for obj in self._source_map.block_at(n_action).objects):
+            self._extended_objects.add(id(last_question_or_delim))
+
+    def _finalize_source_map(self):
+        '''
+        Record line spans and source hashes, and determine which source
+        blocks may be reused by a later incremental parse.
+        '''
+        source_map = self._source_map
+        source_map.finalize()
+        group_start_blocks = {}
+        for index, block in enumerate(source_map.blocks):
+            for obj in block.objects:
+                if isinstance(obj, (Question, TextRegion)):
+                    obj.source_span = (block.start + 1, block.end)
+                    obj.source_hash = block.digest
+                elif isinstance(obj, GroupStart):
+                    group_start_blocks[id(obj.group)] = index
+                elif isinstance(obj, GroupEnd):
+                    start_index = group_start_blocks[id(obj.group)]
+                    h = hashlib.blake2b()
+                    for group_block in source_map.blocks[start_index:index+1]:
+                        h.update(group_block.digest)
+                    obj.group.source_span = (source_map.blocks[start_index].start + 1, block.end)
+                    obj.group.source_hash = h.digest()
+            if len(block.objects) == 1 and not block.has_code and not block.has_images:
+                obj = block.objects[0]
+                if id(obj) in self._extended_objects:
+                    continue
+                if isinstance(obj, Question) or (isinstance(obj, TextRegion) and obj.text_raw is not None):
+                    self._reusable_blocks[block.digest] = obj
+        self._source_map = None
+        self._extended_objects = set()
+        self._reuse_plan = {}
+
+    def _source_error(self, line_number: int, message: Union[str, Exception], *,
+                      code: str, column: Optional[int]=None) -> Text2qtiError:
+        '''
+        Create an error for a location in the quiz source.
+        '''
+        message = str(message)
+        diagnostic = Diagnostic(message, code=code, line=line_number, column=column, source_name=self.source_name)
+        return Text2qtiError(str(diagnostic), code=code, diagnostics=[diagnostic])
+
+    def _action_error(self, e: Text2qtiError, action: Optional[str],
+                      n_error: int, n_action: int, action_line: str) -> Text2qtiError:
+        '''
+        Locate an error from a parse action.  `n_error` is the zero-based
+        index of the line where the error is reported, which is the last
+        line of the action's content for multi-line actions.
+        '''
+        if e.code is not None:
+            code = e.code
+        elif action is None:
+            code = 'syntax'
+        else:
+            code = f'invalid-{action.replace("_", "-")}'
+        column = None
+        if n_error == n_action:
+            if code in ('missing-whitespace', 'missing-content'):
+                match = start_missing_whitespace_re.match(action_line) or start_missing_content_re.match(action_line)
+                column = match.end() + 1
+            else:
+                column = len(action_line) - len(action_line.lstrip()) + 1
+        return self._source_error(n_error + 1, e, code=code, column=column)
 
+    def _record_error(self, e: Text2qtiError):
+        if e.diagnostics:
+            self.diagnostics.extend(e.diagnostics)
+        else:
+            self.diagnostics.append(Diagnostic(str(e), code=e.code or 'error'))
+
+    def _drop_last_question(self):
+        '''
+        Discard the last question after an error, so that it does not cause
+        further errors when errors are collected.
+        '''
+        if self.questions_and_delims and isinstance(self.questions_and_delims[-1], Question):
+            question = self.questions_and_delims.pop()
+            if self._current_group is not None and self._current_group.questions[-1:] == [question]:
+                self._current_group.questions.pop()
+
+    def _finalize_before_resync(self, action: str, n_action: int, action_line: str):
+        '''
+        When a line that would end the preceding question has an error,
+        finalize the question there, as a valid line would, and discard it if
+        it is incomplete.  Otherwise, it would be finalized wherever parsing
+        resumes, and any error would be reported there.
+        '''
+        if not self.questions_and_delims or not isinstance(self.questions_and_delims[-1], Question):
+            return
+        try:
+            self.questions_and_delims[-1].finalize()
+        except Text2qtiError as e:
+            self._record_error(self._action_error(e, action, n_action, n_action, action_line))
+            self._drop_last_question()
+
+    def _is_resync_line(self, line: str) -> bool:
+        '''
+        Whether parsing can resume at a line after an error.  This includes
+        lines that would start a new block if not for a syntax error, so that
+        the error is reported.
+        '''
+        if line.startswith(comment_patterns['start_multiline_comment']):
+            return True
+        match = start_re.match(line) or start_missing_whitespace_re.match(line) or start_missing_content_re.match(line)
+        return match is not None and (match.lastgroup in block_start_actions or match.lastgroup == 'start_code')
+
+    def _parse(self, lines: Iterable[str]):
         try:
             parse_actions = {}
             for k in start_patterns:
@@ -622,134 +1459,227 @@ class Quiz(object):
             start_multiline_comment_pattern = comment_patterns['start_multiline_comment']
             end_multiline_comment_pattern = comment_patterns['end_multiline_comment']
             line_comment_pattern = comment_patterns['line_comment']
-            n_line_iter = iter(x for x in enumerate(string.splitlines()))
+            n_line_iter = self._enumerate_source_lines(lines)
             n, line = next(n_line_iter, (0, None))
             lookahead = False
             n_code_start = 0
             while line is not None:
-                match = start_re.match(line)
-                if match:
-                    action = match.lastgroup
-                    text = line[match.end():].strip()
-                    if action == 'start_code':
-                        info = line.lstrip('`').strip()
-                        info_match = start_code_supported_info_re.match(info)
-                        if info_match is None:
-                            pass
-                        else:
-                            executable = info_match.group('executable')
-                            if executable is not None:
-                                if executable.startswith('"'):
-                                    executable = executable[1:-1]
-                                executable = pathlib.Path(executable).expanduser().as_posix()
+                if self._reuse_plan:
+                    reuse = self._reuse_plan.get(n)
+                    if reuse is not None and self._reuse_source_block(reuse[1]):
+                        source_block, _ = reuse
+                        self._source_map.block_at(n).objects.append(self.questions_and_delims[-1])
+                        while n < source_block.end - 1:
+                            n, line = next(n_line_iter)
+                        n, line = next(n_line_iter, (0, None))
+                        lookahead = False
+                        continue
+                n_action = n
+                action_line = line
+                action = None
+                try:
+                    match = start_re.match(line)
+                    if match:
+                        action = match.lastgroup
+                        text = line[match.end():].strip()
+                        if action == 'start_code':
+                            info = line.lstrip('`').strip()
+                            info_match = start_code_supported_info_re.match(info)
+                            if info_match is None:
+                                pass
+                            else:
+                                code_attrs = {}
+                                for attr_match in start_code_attr_re.finditer(info_match.group('attrs')):
+                                    key = attr_match.group('key')
+                                    if key in code_attrs:
+                                        raise self._source_error(n+1, f'Duplicate code block attribute "{key}"',
+                                                                 code='code-fence')
+                                    value = attr_match.group('value')
+                                    if value.startswith('"'):
+                                        value = value[1:-1]
+                                    code_attrs[key] = value
+                                executable = code_attrs.get('executable')
+                                if executable is not None:
+                                    executable = pathlib.Path(executable).expanduser().as_posix()
+                                else:
+                                    executable = info_match.group('lang')
+                                    if executable == 'python':
+                                        executable = _python_executable()
+                                seed = code_attrs.get('seed')
+                                session = code_attrs.get('session')
+                                if session is not None and not code_session_name_re.match(session):
+                                    raise self._source_error(n+1, f'Invalid code session name "{session}"',
+                                                             code='code-fence')
+                                delim = '`'*(len(line) - len(line.lstrip('`')))
+                                n_code_start = n
+                                code_lines = []
+                                n, line = next(n_line_iter, (0, None))
+                                # No lookahead here; all lines are consumed
+                                while line is not None and not (line.startswith(delim) and line[len(delim):] == line.lstrip('`')):
+                                    code_lines.append(line)
+                                    n, line = next(n_line_iter, (0, None))
+                                if line is None:
+                                    raise self._source_error(n, 'Code closing fence is missing', code='code-fence')
+                                if line.lstrip('`').strip():
+                                    raise self._source_error(n+1, 'Code closing fence is missing', code='code-fence',
+                                                             column=len(delim)+1)
+                                if session is not None and info_match.group('lang') != 'python':
+                                    raise self._source_error(n_code_start+1, 'Code block sessions are only supported for Python code blocks',
+                                                             code='code-session')
+                                code_lines.append('\n')
+                                code = '\n'.join(code_lines)
+                                try:
+                                    stdout = self._code_output(n_code_start, executable, code, seed, session)
+                                except Exception as e:
+                                    raise self._source_error(n_code_start+1, e,
+                                                             code=getattr(e, 'code', None) or 'code-execution')
+                                code_n_line_iter = ((n_code_start, stdout_line) for stdout_line in stdout.splitlines())
+                                n_line_iter = itertools.chain(code_n_line_iter, n_line_iter)
+                                n, line = next(n_line_iter, (0, None))
+                                continue
+                        elif action in multi_line:
+                            if start_patterns[action].endswith(':'):
+                                indent_expandtabs = None
                             else:
-                                executable = info_match.group('lang')
-                                if executable == 'python':
-                                    executable = python_executable
-                            delim = '`'*(len(line) - len(line.lstrip('`')))
-                            n_code_start = n
-                            code_lines = []
+                                indent_expandtabs = ' '*len(line[:match.end()].expandtabs(4))
+                            text_lines = [text]
                             n, line = next(n_line_iter, (0, None))
-                            # No lookahead here; all lines are consumed
-                            while line is not None and not (line.startswith(delim) and line[len(delim):] == line.lstrip('`')):
-                                code_lines.append(line)
+                            line_expandtabs = line.expandtabs(4) if line is not None else None
+                            lookahead = True
+                            while (line is not None and
+                                    (not line or line.isspace() or
+                                        indent_expandtabs is None or line_expandtabs.startswith(indent_expandtabs))):
+                                if not line or line.isspace():
+                                    if action in multi_para:
+                                        text_lines.append('')
+                                    else:
+                                        break
+                                else:
+                                    if indent_expandtabs is None:
+                                        if not line.startswith((' ', '\t')):
+                                            break
+                                        indent_expandtabs = ' '*(len(line_expandtabs)-len(line_expandtabs.lstrip(' ')))
+                                        if len(indent_expandtabs) < 2:
+                                            lookahead = False
+                                            raise self._source_error(n+1, 'Indentation must be at least 2 spaces or 1 tab here',
+                                                                     code='indentation', column=1)
+                                    # The `rstrip()` prevents trailing double
+                                    # spaces from becoming `<br />`.
+                                    text_lines.append(line_expandtabs[len(indent_expandtabs):].rstrip())
                                 n, line = next(n_line_iter, (0, None))
-                            if line is None:
-                                raise Text2qtiError(f'In {self.source_name} on line {n}:\nCode closing fence is missing')
-                            if line.lstrip('`').strip():
-                                raise Text2qtiError(f'In {self.source_name} on line {n+1}:\nCode closing fence is missing')
-                            code_lines.append('\n')
-                            code = '\n'.join(code_lines)
-                            try:
-                                stdout = self._run_code(executable, code)
-                            except Exception as e:
-                                raise Text2qtiError(f'In {self.source_name} on line {n_code_start+1}:\n{e}')
-                            code_n_line_iter = ((n_code_start, stdout_line) for stdout_line in stdout.splitlines())
-                            n_line_iter = itertools.chain(code_n_line_iter, n_line_iter)
+                                line_expandtabs = line.expandtabs(4) if line is not None else None
+                            if text_lines and not text_lines[-1]:
+                                while text_lines and not text_lines[-1]:
+                                    text_lines.pop()
+                            text = '\n'.join(text_lines)
+                    elif line.startswith(line_comment_pattern):
+                        n, line = next(n_line_iter, (0, None))
+                        continue
+                    elif line.startswith(start_multiline_comment_pattern):
+                        if line.strip() != start_multiline_comment_pattern:
+                            raise self._source_error(n+1, f'Unexpected content after "{start_multiline_comment_pattern}"',
+                                                     code='comment', column=len(start_multiline_comment_pattern)+1)
+                        n, line = next(n_line_iter, (0, None))
+                        while line is not None and not line.startswith(end_multiline_comment_pattern):
                             n, line = next(n_line_iter, (0, None))
-                            continue
-                    elif action in multi_line:
-                        if start_patterns[action].endswith(':'):
-                            indent_expandtabs = None
+                        if line is None:
+                            raise self._source_error(n+1, f'f"{start_multiline_comment_pattern}" without following "{end_multiline_comment_pattern}"',
+                                                     code='comment')
+                        if line.strip() != end_multiline_comment_pattern:
+                            raise self._source_error(n+1, f'Unexpected content after "{end_multiline_comment_pattern}"',
+                                                     code='comment', column=len(end_multiline_comment_pattern)+1)
+                        n, line = next(n_line_iter, (0, None))
+                        continue
+                    elif line.startswith(end_multiline_comment_pattern):
+                        raise self._source_error(n+1, f'"{end_multiline_comment_pattern}" without preceding "{start_multiline_comment_pattern}"',
+                                                 code='comment', column=1)
+                    else:
+                        action = None
+                        text = line
+                    n_questions_and_delims = len(self.questions_and_delims)
+                    try:
+                        parse_actions[action](text)
+                    except Text2qtiError as e:
+                        if lookahead and n != n_code_start:
+                            n_error = n - 1
                         else:
-                            indent_expandtabs = ' '*len(line[:match.end()].expandtabs(4))
-                        text_lines = [text]
+                            n_error = n
+                        if (self._collect_errors and e.code == 'incomplete-question' and
+                                action in block_start_actions):
+                            # The preceding question is incomplete.  Report
+                            # it, then discard it and try the action again.
+                            self._record_error(self._action_error(e, action, n_error, n_action, action_line))
+                            self._drop_last_question()
+                            try:
+                                parse_actions[action](text)
+                            except Text2qtiError as e:
+                                raise self._action_error(e, action, n_error, n_action, action_line)
+                        else:
+                            raise self._action_error(e, action, n_error, n_action, action_line)
+                    if len(self.questions_and_delims) > n_questions_and_delims:
+                        source_block = self._source_map.block_at(n_action)
+                        source_block.objects.extend(self.questions_and_delims[n_questions_and_delims:])
+                    if len(self.questions_and_delims) == n_questions_and_delims:
+                        self._note_extended_object(n_action)
+                except Text2qtiError as e:
+                    if not self._collect_errors:
+                        raise
+                    # For lines with a syntax error, such as missing
+                    # whitespace, this is the action that was intended
+                    intended_action = action
+                    if intended_action is None and action_line is not None:
+                        match = start_missing_whitespace_re.match(action_line) or start_missing_content_re.match(action_line)
+                        if match is not None:
+                            intended_action = match.lastgroup
+                    # The error is recorded first, since it is the error
+                    # that stops parsing without collected errors
+                    self._record_error(e)
+                    if intended_action in question_end_actions:
+                        self._finalize_before_resync(intended_action, n_action, action_line)
+                    # Resynchronize at the next question, text region, group
+                    # delimiter, code block, or comment.  Whatever was being
+                    # assembled is discarded, so that it does not cause
+                    # further errors.
+                    self._next_question_attr = {}
+                    if intended_action in question_part_actions:
+                        self._drop_last_question()
+                    if not lookahead and line is not None:
                         n, line = next(n_line_iter, (0, None))
-                        line_expandtabs = line.expandtabs(4) if line is not None else None
-                        lookahead = True
-                        while (line is not None and
-                                (not line or line.isspace() or
-                                    indent_expandtabs is None or line_expandtabs.startswith(indent_expandtabs))):
-                            if not line or line.isspace():
-                                if action in multi_para:
-                                    text_lines.append('')
-                                else:
-                                    break
-                            else:
-                                if indent_expandtabs is None:
-                                    if not line.startswith((' ', '\t')):
-                                        break
-                                    indent_expandtabs = ' '*(len(line_expandtabs)-len(line_expandtabs.lstrip(' ')))
-                                    if len(indent_expandtabs) < 2:
-                                        raise Text2qtiError(f'In {self.source_name} on line {n+1}:\nIndentation must be at least 2 spaces or 1 tab here')
-                                # The `rstrip()` prevents trailing double
-                                # spaces from becoming `<br />`.
-                                text_lines.append(line_expandtabs[len(indent_expandtabs):].rstrip())
-                            n, line = next(n_line_iter, (0, None))
-                            line_expandtabs = line.expandtabs(4) if line is not None else None
-                        if text_lines and not text_lines[-1]:
-                            while text_lines and not text_lines[-1]:
-                                text_lines.pop()
-                        text = '\n'.join(text_lines)
-                elif line.startswith(line_comment_pattern):
-                    n, line = next(n_line_iter, (0, None))
-                    continue
-                elif line.startswith(start_multiline_comment_pattern):
-                    if line.strip() != start_multiline_comment_pattern:
-                        raise Text2qtiError(f'In {self.source_name} on line {n+1}:\nUnexpected content after "{start_multiline_comment_pattern}"')
-                    n, line = next(n_line_iter, (0, None))
-                    while line is not None and not line.startswith(end_multiline_comment_pattern):
+                    while line is not None and not self._is_resync_line(line):
                         n, line = next(n_line_iter, (0, None))
-                    if line is None:
-                        raise Text2qtiError(f'In {self.source_name} on line {n+1}:\nf"{start_multiline_comment_pattern}" without following "{end_multiline_comment_pattern}"')
-                    if line.strip() != end_multiline_comment_pattern:
-                        raise Text2qtiError(f'In {self.source_name} on line {n+1}:\nUnexpected content after "{end_multiline_comment_pattern}"')
-                    n, line = next(n_line_iter, (0, None))
+                    lookahead = False
                     continue
-                elif line.startswith(end_multiline_comment_pattern):
-                    raise Text2qtiError(f'In {self.source_name} on line {n+1}:\n"{end_multiline_comment_pattern}" without preceding "{start_multiline_comment_pattern}"')
-                else:
-                    action = None
-                    text = line
-                try:
-                    parse_actions[action](text)
-                except Text2qtiError as e:
-                    if lookahead and n != n_code_start:
-                        raise Text2qtiError(f'In {self.source_name} on line {n}:\n{e}')
-                    raise Text2qtiError(f'In {self.source_name} on line {n+1}:\n{e}')
                 if not lookahead:
                     n, line = next(n_line_iter, (0, None))
                 lookahead = False
-            if not self.questions_and_delims:
-                raise Text2qtiError('No questions were found')
-            if self._current_group is not None:
-                raise Text2qtiError(f'In {self.source_name} on line {len(string.splitlines())}:\nQuestion group never ended')
-            last_question_or_delim = self.questions_and_delims[-1]
-            if isinstance(last_question_or_delim, Question):
-                try:
-                    last_question_or_delim.finalize()
-                except Text2qtiError as e:
-                    raise Text2qtiError(f'In {self.source_name} on line {len(string.splitlines())}:\n{e}')
+            try:
+                # With collected errors, there may be no questions left
+                # because questions with errors were discarded
+                if not self.questions_and_delims and not self.diagnostics:
+                    raise Text2qtiError('No questions were found', code='no-questions',
+                                        diagnostics=[Diagnostic('No questions were found', code='no-questions')])
+                if self._current_group is not None:
+                    raise self._source_error(self._source_line_count, 'Question group never ended', code='group')
+                last_question_or_delim = self.questions_and_delims[-1] if self.questions_and_delims else None
+                if isinstance(last_question_or_delim, Question):
+                    try:
+                        last_question_or_delim.finalize()
+                    except Text2qtiError as e:
+                        raise self._source_error(self._source_line_count, e, code=e.code or 'incomplete-question')
+            except Text2qtiError as e:
+                if not self._collect_errors:
+                    raise
+                self._record_error(e)
+            if self.diagnostics:
+                raise Text2qtiError('\n\n'.join(str(d) for d in self.diagnostics), code=self.diagnostics[0].code,
+                                    diagnostics=self.diagnostics)
 
             points_possible = 0
-            digests = []
             for x in self.questions_and_delims:
                 if isinstance(x, Question):
                     points_possible += x.points_possible
-                    digests.append(x.hash_digest)
                 elif isinstance(x, GroupStart):
                     points_possible += x.group.points_per_question*x.group.pick
-                    digests.append(x.group.hash_digest)
                 elif isinstance(x, GroupEnd):
                     pass
                 elif isinstance(x, TextRegion):
@@ -757,17 +1687,89 @@ class Quiz(object):
                 else:
                     raise TypeError
             self.points_possible = points_possible
-            h = hashlib.blake2b()
-            for digest in sorted(digests):
-                h.update(digest)
-            self.hash_digest = h.digest()
-            self.id = h.hexdigest()[:64]
+            self._finalize_source_map()
+            if self._low_memory and self.md.render:
+                for x in self.questions_and_delims:
+                    if isinstance(x, (Question, TextRegion)):
+                        x.drop_raw()
         finally:
             self.md.finalize()
 
-    def _run_code(self, executable: str, code: str) -> str:
+    @property
+    def hash_digest(self) -> bytes:
+        digests = []
+        for x in self.questions_and_delims:
+            if isinstance(x, Question):
+                digests.append(x.hash_digest)
+            elif isinstance(x, GroupStart):
+                digests.append(x.group.hash_digest)
+        h = hashlib.blake2b()
+        for digest in sorted(digests):
+            h.update(digest)
+        return h.digest()
+
+    @property
+    def id(self) -> str:
+        return self.hash_digest.hex()[:64]
+
+    def _code_time_limit(self) -> Tuple[Optional[float], str]:
+        '''
+        Time limit in seconds for the next code block, from the per-block
+        limit and the time left for the quiz, plus a description of the limit
+        for error messages.
+        '''
+        timeout = self.config['code_timeout']
+        if timeout is None:
+            description = 'no time limit'
+        else:
+            description = f'the per-block time limit ({timeout:g} s)'
+        if self._code_deadline is not None:
+            quiz_description = f'the per-quiz time limit for running code ({self.config["code_quiz_timeout"]:g} s)'
+            remaining = self._code_deadline - time.monotonic()
+            if remaining <= 0:
+                raise Text2qtiError(f'Code execution was not started because the quiz reached {quiz_description}',
+                                    code='code-timeout')
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+                description = quiz_description
+        return timeout, description
+
+    def _run_code(self, executable: str, code: str, seed: Optional[str]=None,
+                  session: Optional[str]=None) -> str:
+        '''
+        Run code and return its stdout.  If the code block has a seed, it is
+        available to the code in the environment variable `TEXT2QTI_SEED`.
+        If the code block has a session name, it runs in the Python session
+        with that name, which is started by the first block that uses it.
+        Output from sessions is not cached, since it depends on the blocks
+        that ran before.
+
+        Code is stopped when it reaches the per-block or per-quiz time limit,
+        and on Linux it runs with the configured memory and CPU time limits.
+        '''
         if not self.config['run_code_blocks']:
             raise Text2qtiError('Code execution for code blocks is not enabled; use --run-code-blocks, or set run_code_blocks = true in config')
+        self.ran_code = True
+        if self.config['cache_code_output'] and session is None:
+            code_cache = CodeOutputCache()
+            which_executable = _which(executable)
+            if which_executable is None:
+                resolved_executable = executable
+            else:
+                resolved_executable = pathlib.Path(which_executable).resolve().as_posix()
+            code_cache_key = code_cache.key(code, executable=resolved_executable, seed=seed)
+            stdout_str = code_cache.get(code_cache_key)
+            if stdout_str is not None:
+                return stdout_str
+        else:
+            code_cache = None
+        timeout, time_limit = self._code_time_limit()
+        rlimits = resource_limits(memory_limit=self.config['code_memory_limit'],
+                                  cpu_limit=self.config['code_cpu_limit'])
+        if seed is None:
+            env = None
+        else:
+            env = dict(os.environ, TEXT2QTI_SEED=seed)
         h = hashlib.blake2b()
         h.update(code.encode('utf8'))
         if platform.system() == 'Windows':
@@ -780,40 +1782,89 @@ class Quiz(object):
             tempdir_path = pathlib.Path(tempdir)
             code_path = tempdir_path / f'{h.hexdigest()[:16]}.code'
             code_path.write_text(code, encoding='utf8')
-            if platform.system() == 'Windows':
-                # Modify executable since subprocess.Popen() ignores PATH
-                # * https://bugs.python.org/issue15451
-                # * https://bugs.python.org/issue8557
-                which_executable = shutil.which(executable)
-                if which_executable is None:
-                    raise Text2qtiError(f'Failed to execute code (missing executable "{executable}")')
-                cmd = [which_executable, code_path.as_posix()]
-            else:
-                cmd = [executable, code_path.as_posix()]
+            server = None
+            if session is None and self.config['python_fork_server'] and executable == _python_executable():
+                server = get_python_fork_server(_which(executable) or executable,
+                                                self.config['python_preload_modules'])
             try:
-                # stdin is needed for GUI because standard file handles can't
-                # be inherited
-                proc = subprocess.run(cmd,
-                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE,
-                                      startupinfo=startupinfo)
-            except FileNotFoundError as e:
-                raise Text2qtiError(f'Failed to execute code (missing executable "{executable}"?):\n{e}')
-            except Exception as e:
-                raise Text2qtiError(f'Failed to execute code with command "{cmd}":\n{e}')
+                if session is not None:
+                    code_session = self._code_sessions.get(session)
+                    if code_session is None:
+                        code_session = PythonSession(_which(executable) or executable, session, startupinfo=startupinfo)
+                        self._code_sessions[session] = code_session
+                    returncode, stdout, stderr = code_session.run(code_path, seed=seed, rlimits=rlimits, timeout=timeout)
+                elif server is not None:
+                    returncode, stdout, stderr = server.run(code_path, env=env, rlimits=rlimits, timeout=timeout)
+                else:
+                    returncode, stdout, stderr = self._run_code_subprocess(executable, code_path,
+                                                                           env=env, startupinfo=startupinfo,
+                                                                           rlimits=rlimits, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                raise Text2qtiError(f'Code execution was stopped after reaching {time_limit}', code='code-timeout')
+        if 'RLIMIT_CPU' in rlimits and returncode == -signal.SIGXCPU:
+            raise Text2qtiError(f'Code execution was stopped after reaching the CPU time limit ({self.config["code_cpu_limit"]:g} s)',
+                                code='code-cpu-limit')
         # Use io to handle output as if read from a file in terms of newline
         # treatment
-        if proc.returncode != 0:
-            stderr_str = io.TextIOWrapper(io.BytesIO(proc.stderr),
+        if returncode != 0:
+            stderr_str = io.TextIOWrapper(io.BytesIO(stderr),
                                           encoding=locale.getpreferredencoding(False),
                                           errors='backslashreplace').read()
+            if 'RLIMIT_AS' in rlimits and 'MemoryError' in stderr_str:
+                raise Text2qtiError(f'Code execution ran out of memory under the memory limit ({self.config["code_memory_limit"]} MB):\n'
+                                    f'{"-"*50}\n{stderr_str}\n{"-"*50}', code='code-memory-limit')
             raise Text2qtiError(f'Code execution resulted in errors:\n{"-"*50}\n{stderr_str}\n{"-"*50}')
         try:
-            stdout_str = io.TextIOWrapper(io.BytesIO(proc.stdout),
+            stdout_str = io.TextIOWrapper(io.BytesIO(stdout),
                                           encoding=locale.getpreferredencoding(False)).read()
         except Exception as e:
             raise Text2qtiError(f'Failed to decode output of executed code:\n{e}')
+        if code_cache is not None:
+            code_cache.put(code_cache_key, stdout_str)
         return stdout_str
 
+    def _run_code_subprocess(self, executable: str, code_path: pathlib.Path, *,
+                             env: Optional[Dict[str, str]], startupinfo, rlimits: Dict[str, int],
+                             timeout: Optional[float]) -> Tuple[int, bytes, bytes]:
+        '''
+        Run a code file with an executable in a subprocess, and return exit
+        code, stdout, and stderr.
+        '''
+        if platform.system() == 'Windows':
+            # Modify executable since subprocess.Popen() ignores PATH
+            # * https://bugs.python.org/issue15451
+            # * https://bugs.python.org/issue8557
+            which_executable = _which(executable)
+            if which_executable is None:
+                raise Text2qtiError(f'Failed to execute code (missing executable "{executable}")')
+            cmd = [which_executable, code_path.as_posix()]
+        elif rlimits:
+            # Limits are applied by a launcher that needs the full path
+            which_executable = _which(executable)
+            if which_executable is None:
+                raise Text2qtiError(f'Failed to execute code (missing executable "{executable}")')
+            cmd = resource_limits_command(rlimits, [which_executable, code_path.as_posix()])
+        else:
+            cmd = [executable, code_path.as_posix()]
+        try:
+            # stdin is needed for GUI because standard file handles can't be
+            # inherited
+            proc = subprocess.Popen(cmd,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE,
+                                    startupinfo=startupinfo, env=env)
+        except FileNotFoundError as e:
+            raise Text2qtiError(f'Failed to execute code (missing executable "{executable}"?):\n{e}')
+        except Exception as e:
+            raise Text2qtiError(f'Failed to execute code with command "{cmd}":\n{e}')
+        with proc:
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                raise
+        return proc.returncode, stdout, stderr
+
     def append_quiz_title(self, text: str):
         if any(x is not None for x in (self.shuffle_answers_raw, self.show_correct_answers_raw,
                                        self.one_question_at_a_time_raw, self.cant_go_back_raw)):
@@ -840,7 +1891,7 @@ class Quiz(object):
         if self.questions_and_delims:
             raise Text2qtiError('Must give quiz description before questions')
         self.description_raw = text
-        self.description_html_xml = self.md.md_to_html_xml(text)
+        Quiz.description_html_xml.prepare(self)
 
     def append_quiz_shuffle_answers(self, text: str):
         if self._next_question_attr:
@@ -974,9 +2025,9 @@ class Quiz(object):
                             points=self._next_question_attr.get('points'),
                             md=self.md)
         self._next_question_attr = {}
-        if question.question_html_xml in self.question_set:
-            raise Text2qtiError('Duplicate question')
-        self.question_set.add(question.question_html_xml)
+        if question.duplicate_key in self.question_set:
+            raise Text2qtiError('Duplicate question', code='duplicate-question')
+        self.question_set.add(question.duplicate_key)
         self.questions_and_delims.append(question)
         if self._current_group is not None:
             self._current_group.append_question(question)
@@ -1175,12 +2226,14 @@ class Quiz(object):
 
     def append_unknown(self, text: str):
         if self._next_question_attr:
-            raise Text2qtiError('Expected question; question title and/or points were set but not used')
+            raise Text2qtiError('Expected question; question title and/or points were set but not used',
+                                code='expected-question')
         if text and not text.isspace():
             match = start_missing_whitespace_re.match(text)
             if match:
-                raise Text2qtiError(f'Missing whitespace after "{match.group().strip()}"')
+                raise Text2qtiError(f'Missing whitespace after "{match.group().strip()}"', code='missing-whitespace')
             match = start_missing_content_re.match(text)
             if match:
-                raise Text2qtiError(f'Missing content after "{match.group().strip()}"')
-            raise Text2qtiError(f'Syntax error; unexpected text, or incorrect indentation for a wrapped paragraph:\n"{text}"')
+                raise Text2qtiError(f'Missing content after "{match.group().strip()}"', code='missing-content')
+            raise Text2qtiError(f'Syntax error; unexpected text, or incorrect indentation for a wrapped paragraph:\n"{text}"',
+                                code='syntax')
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, Geoffrey M. Poore
+# All rights reserved.
+#
+# Licensed under the BSD 3-Clause License:
+# http://opensource.org/licenses/BSD-3-Clause
+#
+
+
+import hashlib
+import os
+import pathlib
+import pickle
+import tempfile
+from typing import Optional, Union
+
+from .config import Config
+from .err import Text2qtiError
+from .markdown import Image
+from .mathml_cache import shared_cache_dir
+from .quiz import Quiz
+from .version import __version__ as version
+
+
+
+
+class QuizCache(object):
+    '''
+    On-disk cache of parsed quizzes, so that an unchanged quiz can go straight
+    to QTI packaging.
+
+    Entries are keyed on a hash of the quiz source, the directory that
+    images are relative to, the config values that affect the result
+    (including code execution settings), and the text2qti and
+    Python-Markdown versions.  Each entry also records hashes of the local
+    images that the quiz references, and these are checked against the image
+    files on lookup.  Quizzes that execute code blocks are only cached when
+    `include_code` is true, since code may give different output each time it
+    runs.  When the total size of all entries exceeds `max_bytes`, the least
+    recently used entries are deleted.
+
+    Entries are pickled, and loading a pickle can run arbitrary code.  By
+    default, the cache is in a per-user directory under `shared_cache_dir()`.
+    The cache directory is created so that only the user can access it, and
+    on POSIX systems the cache is not used if the directory belongs to
+    another user or is writable by anyone else.
+    '''
+    default_dirname = 'quizzes'
+    default_max_bytes = 100*1024**2
+    entry_suffix = '.pickle'
+    # Config values that can change the parsed quiz
+    config_keys = ('latex_render_url', 'pandoc_mathml',
+                   'run_code_blocks', 'cache_code_output', 'python_fork_server', 'python_preload_modules',
+                   'code_timeout', 'code_quiz_timeout', 'code_memory_limit', 'code_cpu_limit')
+
+    def __init__(self, path: Optional[Union[str, pathlib.Path]]=None, *,
+                 max_bytes: Optional[int]=None, include_code: bool=False):
+        if path is None:
+            path = shared_cache_dir() / self.default_dirname
+        elif isinstance(path, str):
+            path = pathlib.Path(path)
+        elif not isinstance(path, pathlib.Path):
+            raise TypeError
+        self.path = path
+        self.max_bytes = self.default_max_bytes if max_bytes is None else max_bytes
+        self.include_code = include_code
+        self._usable: Optional[bool] = None
+        self.hits = 0
+        self.misses = 0
+
+
+    def _check_path(self) -> bool:
+        '''
+        Create the cache directory if it does not exist, and check that it is
+        safe to load pickles from it.
+        '''
+        if self._usable is None:
+            try:
+                self.path.mkdir(mode=0o700, parents=True, exist_ok=True)
+                stat = self.path.stat()
+            except OSError:
+                self._usable = False
+            else:
+                if os.name == 'posix':
+                    self._usable = stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+                else:
+                    self._usable = True
+        return self._usable
+
+
+    def key(self, source_digest: bytes, *, config: Config,
+            resource_path: Optional[Union[str, pathlib.Path]]=None,
+            low_memory: bool=False) -> str:
+        '''
+        Cache key for a quiz source with the given hash, parsed with the given
+        settings.  Without a resource path, images are relative to the
+        working directory, so it is part of the key instead.
+        '''
+        if resource_path is None:
+            resource_path = pathlib.Path.cwd()
+        resource_path = pathlib.Path(resource_path).resolve().as_posix()
+        # Python-Markdown is imported here rather than at module level, since
+        # a cache hit does not otherwise need it
+        import markdown
+        h = hashlib.blake2b(source_digest)
+        for x in (version, markdown.__version__,
+                  *((k, config[k]) for k in self.config_keys),
+                  resource_path, low_memory):
+            h.update(h.digest())
+            h.update(repr(x).encode('utf8'))
+        return h.hexdigest()[:64]
+
+
+    def _entry_path(self, key: str) -> pathlib.Path:
+        return self.path / f'{key}{self.entry_suffix}'
+
+
+    def get(self, key: str) -> Optional[Quiz]:
+        '''
+        Return the cached quiz for a key, or `None` if there is no valid entry.
+        '''
+        if not self._check_path():
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            with entry_path.open('rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupt entry, or entry from an incompatible version
+            self._unlink(entry_path)
+            return None
+        for image_path, image_id in entry['image_ids'].items():
+            try:
+                if Image.file_id(pathlib.Path(image_path)) != image_id:
+                    return None
+            except OSError:
+                return None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return entry['quiz']
+
+
+    def put(self, key: str, quiz: Quiz):
+        '''
+        Save a quiz under a key, unless it is uncacheable.  Failing to write
+        to the cache is not an error, since the cache is only an optimization.
+        '''
+        if quiz.ran_code and not self.include_code:
+            return
+        if not quiz.md.render:
+            return
+        if not self._check_path():
+            return
+        entry = {'image_ids': quiz.md.image_ids, 'quiz': quiz}
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._entry_path(key))
+        except Exception:
+            self._unlink(pathlib.Path(temp_path))
+            return
+        self._evict()
+
+
+    def _unlink(self, path: pathlib.Path):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+    def _evict(self):
+        '''
+        Delete least recently used entries until the cache is within its size
+        limit.
+        '''
+        entries = []
+        total_bytes = 0
+        for entry_path in self.path.glob(f'*{self.entry_suffix}'):
+            try:
+                stat = entry_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+            total_bytes += stat.st_size
+        entries.sort()
+        for _, size, entry_path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            self._unlink(entry_path)
+            total_bytes -= size
+
+
+    def quiz_from_path(self, path: Union[str, pathlib.Path], *, config: Config,
+                       source_name: Optional[str]=None,
+                       resource_path: Optional[Union[str, pathlib.Path]]=None,
+                       jobs: int=1,
+                       low_memory: bool=False) -> Quiz:
+        '''
+        Load a quiz from the cache if its source file is unchanged, and
+        otherwise create it with `Quiz.from_path()` and cache it.
+        '''
+        if isinstance(path, str):
+            path = pathlib.Path(path)
+        elif not isinstance(path, pathlib.Path):
+            raise TypeError
+        h = hashlib.blake2b()
+        try:
+            with path.open('rb') as f:
+                for chunk in iter(lambda: f.read(1024*1024), b''):
+                    h.update(chunk)
+        except FileNotFoundError:
+            raise Text2qtiError(f'File "{path}" does not exist')
+        except PermissionError as e:
+            raise Text2qtiError(f'File "{path}" cannot be read due to permission error:\n{e}')
+        key = self.key(h.digest(), config=config, resource_path=resource_path, low_memory=low_memory)
+        quiz = self.get(key)
+        if quiz is not None:
+            self.hits += 1
+            if source_name is None:
+                source_name = path.as_posix()
+            quiz.source_name = f'"{source_name}"'
+            quiz.config = config
+            return quiz
+        self.misses += 1
+        quiz = Quiz.from_path(path, config=config, source_name=source_name, resource_path=resource_path,
+                              jobs=jobs, low_memory=low_memory)
+        self.put(key, quiz)
+        return quiz
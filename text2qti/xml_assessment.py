@@ -8,6 +8,8 @@
 #
 
 
+import string
+from typing import Callable, Dict, Iterator, List
 from .quiz import Quiz, Question, GroupStart, GroupEnd, TextRegion
 
 
@@ -427,195 +429,281 @@ ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INDIVIDUAL = '''\
 
 
 
-def assessment(*, quiz: Quiz, assessment_identifier: str, title_xml: str) -> str:
+class _Template(object):
     '''
-    Generate assessment XML from Quiz.
+    Template that is split once into literal text and `{field}` slots.
+    Rendering joins the pieces, rather than parsing the whole template on
+    each call as `str.format()` does, and gives the same result as
+    `template.format(**values)`.
     '''
-    xml = []
-    xml.append(BEFORE_ITEMS.format(assessment_identifier=assessment_identifier,
-                                   title=title_xml))
-    for question_or_delim in quiz.questions_and_delims:
-        if isinstance(question_or_delim, TextRegion):
-            xml.append(TEXT.format(ident=f'text2qti_text_{question_or_delim.id}',
-                                   text_title_xml=question_or_delim.title_xml,
-                                   assessment_question_identifierref=f'text2qti_question_ref_{question_or_delim.id}',
-                                   text_html_xml=question_or_delim.text_html_xml))
-            continue
-        if isinstance(question_or_delim, GroupStart):
-            xml.append(GROUP_START.format(ident=f'text2qti_group_{question_or_delim.group.id}',
-                                          group_title=question_or_delim.group.title_xml,
-                                          pick=question_or_delim.group.pick,
-                                          points_per_item=question_or_delim.group.points_per_question))
-            continue
-        if isinstance(question_or_delim, GroupEnd):
-            xml.append(GROUP_END)
-            continue
-        if not isinstance(question_or_delim, Question):
-            raise TypeError
-        question = question_or_delim
-
-        xml.append(START_ITEM.format(question_identifier=f'text2qti_question_{question.id}',
-                                     question_title=question.title_xml))
-
-        if question.type in ('true_false_question', 'multiple_choice_question',
-                             'short_answer_question', 'multiple_answers_question'):
-            item_metadata = ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM
-            original_answer_ids = ','.join(f'text2qti_choice_{c.id}' for c in question.choices)
-        elif question.type == 'numerical_question':
-            item_metadata = ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM
-            original_answer_ids = f'text2qti_numerical_{question.id}'
-        elif question.type == 'essay_question':
-            item_metadata = ITEM_METADATA_ESSAY
-            original_answer_ids = f'text2qti_essay_{question.id}'
-        elif question.type == 'file_upload_question':
-            item_metadata = ITEM_METADATA_UPLOAD
-            original_answer_ids = f'text2qti_upload_{question.id}'
+    __slots__ = ('start', 'slots')
+
+    def __init__(self, template: str):
+        literals = ['']
+        fields = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(template):
+            literals[-1] += literal
+            if field is not None:
+                if not field.isidentifier() or format_spec or conversion:
+                    raise ValueError(f'Unsupported template field "{field}"')
+                fields.append(field)
+                literals.append('')
+        self.start = literals[0]
+        self.slots = tuple(zip(fields, literals[1:]))
+
+    def render(self, **values) -> str:
+        parts = [self.start]
+        for field, literal in self.slots:
+            parts.append(format(values[field]))
+            parts.append(literal)
+        return ''.join(parts)
+
+
+_BEFORE_ITEMS = _Template(BEFORE_ITEMS)
+_GROUP_START = _Template(GROUP_START)
+_TEXT = _Template(TEXT)
+_START_ITEM = _Template(START_ITEM)
+_ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM = _Template(ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM)
+_ITEM_METADATA_ESSAY = _Template(ITEM_METADATA_ESSAY)
+_ITEM_METADATA_UPLOAD = _Template(ITEM_METADATA_UPLOAD)
+_ITEM_PRESENTATION_MCTF = _Template(ITEM_PRESENTATION_MCTF)
+_ITEM_PRESENTATION_MCTF_CHOICE = _Template(ITEM_PRESENTATION_MCTF_CHOICE)
+_ITEM_PRESENTATION_MULTANS = _Template(ITEM_PRESENTATION_MULTANS)
+_ITEM_PRESENTATION_MULTANS_CHOICE = _Template(ITEM_PRESENTATION_MULTANS_CHOICE)
+_ITEM_PRESENTATION_SHORTANS = _Template(ITEM_PRESENTATION_SHORTANS)
+_ITEM_PRESENTATION_ESSAY = _Template(ITEM_PRESENTATION_ESSAY)
+_ITEM_PRESENTATION_UPLOAD = _Template(ITEM_PRESENTATION_UPLOAD)
+_ITEM_PRESENTATION_NUM = _Template(ITEM_PRESENTATION_NUM)
+_ITEM_RESPROCESSING_MCTF_CHOICE_FEEDBACK = _Template(ITEM_RESPROCESSING_MCTF_CHOICE_FEEDBACK)
+_ITEM_RESPROCESSING_MCTF_SET_CORRECT_WITH_FEEDBACK = _Template(ITEM_RESPROCESSING_MCTF_SET_CORRECT_WITH_FEEDBACK)
+_ITEM_RESPROCESSING_MCTF_SET_CORRECT_NO_FEEDBACK = _Template(ITEM_RESPROCESSING_MCTF_SET_CORRECT_NO_FEEDBACK)
+_ITEM_RESPROCESSING_SHORTANS_CHOICE_FEEDBACK = _Template(ITEM_RESPROCESSING_SHORTANS_CHOICE_FEEDBACK)
+_ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_WITH_FEEDBACK = _Template(ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_WITH_FEEDBACK)
+_ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_NO_FEEDBACK = _Template(ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_NO_FEEDBACK)
+_ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_VAREQUAL = _Template(ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_VAREQUAL)
+_ITEM_RESPROCESSING_MULTANS_CHOICE_FEEDBACK = _Template(ITEM_RESPROCESSING_MULTANS_CHOICE_FEEDBACK)
+_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_WITH_FEEDBACK = _Template(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_WITH_FEEDBACK)
+_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_NO_FEEDBACK = _Template(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_NO_FEEDBACK)
+_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_CORRECT = _Template(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_CORRECT)
+_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_INCORRECT = _Template(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_INCORRECT)
+_ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_WITH_FEEDBACK = _Template(ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_WITH_FEEDBACK)
+_ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_NO_FEEDBACK = _Template(ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_NO_FEEDBACK)
+_ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_WITH_FEEDBACK = _Template(ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_WITH_FEEDBACK)
+_ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_NO_FEEDBACK = _Template(ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_NO_FEEDBACK)
+_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_GENERAL = _Template(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_GENERAL)
+_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_CORRECT = _Template(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_CORRECT)
+_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INCORRECT = _Template(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INCORRECT)
+_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INDIVIDUAL = _Template(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INDIVIDUAL)
+
+
+
+
+def _item_start(question: Question, item_metadata: _Template, original_answer_ids: str) -> List[str]:
+    '''
+    Start of the XML for a question, through the item metadata.
+    '''
+    return [_START_ITEM.render(question_identifier=f'text2qti_question_{question.id}',
+                               question_title=question.title_xml),
+            item_metadata.render(question_type=question.type,
+                                 points_possible=question.points_possible,
+                                 original_answer_ids=original_answer_ids,
+                                 assessment_question_identifierref=f'text2qti_question_ref_{question.id}')]
+
+def _item_end(question: Question, xml: List[str], choice_feedback: bool=False) -> str:
+    '''
+    Add feedback and the end of the item to the XML for a question, and
+    return the complete XML.
+    '''
+    if question.feedback_html_xml is not None:
+        xml.append(_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_GENERAL.render(feedback=question.feedback_html_xml))
+    if question.correct_feedback_html_xml is not None:
+        xml.append(_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_CORRECT.render(feedback=question.correct_feedback_html_xml))
+    if question.incorrect_feedback_html_xml is not None:
+        xml.append(_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INCORRECT.render(feedback=question.incorrect_feedback_html_xml))
+    if choice_feedback:
+        for choice in question.choices:
+            if choice.feedback_html_xml is not None:
+                xml.append(_ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INDIVIDUAL.render(ident=f'text2qti_choice_{choice.id}',
+                                                                                      feedback=choice.feedback_html_xml))
+    xml.append(END_ITEM)
+    return ''.join(xml)
+
+
+def _mctf_item(question: Question) -> str:
+    correct_choice = None
+    for choice in question.choices:
+        if choice.correct:
+            correct_choice = choice
+            break
+    if correct_choice is None:
+        raise TypeError
+    xml = _item_start(question, _ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM,
+                      ','.join(f'text2qti_choice_{c.id}' for c in question.choices))
+    choices = '\n'.join(_ITEM_PRESENTATION_MCTF_CHOICE.render(ident=f'text2qti_choice_{c.id}', choice_html_xml=c.choice_html_xml)
+                        for c in question.choices)
+    xml.append(_ITEM_PRESENTATION_MCTF.render(question_html_xml=question.question_html_xml, choices=choices))
+    xml.append(ITEM_RESPROCESSING_START)
+    if question.feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_MCTF_GENERAL_FEEDBACK)
+    for choice in question.choices:
+        if choice.feedback_html_xml is not None:
+            xml.append(_ITEM_RESPROCESSING_MCTF_CHOICE_FEEDBACK.render(ident=f'text2qti_choice_{choice.id}'))
+    if question.correct_feedback_html_xml is not None:
+        xml.append(_ITEM_RESPROCESSING_MCTF_SET_CORRECT_WITH_FEEDBACK.render(ident=f'text2qti_choice_{correct_choice.id}'))
+    else:
+        xml.append(_ITEM_RESPROCESSING_MCTF_SET_CORRECT_NO_FEEDBACK.render(ident=f'text2qti_choice_{correct_choice.id}'))
+    if question.incorrect_feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_MCTF_INCORRECT_FEEDBACK)
+    xml.append(ITEM_RESPROCESSING_END)
+    return _item_end(question, xml, choice_feedback=True)
+
+
+def _shortans_item(question: Question) -> str:
+    xml = _item_start(question, _ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM,
+                      ','.join(f'text2qti_choice_{c.id}' for c in question.choices))
+    xml.append(_ITEM_PRESENTATION_SHORTANS.render(question_html_xml=question.question_html_xml))
+    xml.append(ITEM_RESPROCESSING_START)
+    if question.feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_SHORTANS_GENERAL_FEEDBACK)
+    for choice in question.choices:
+        if choice.feedback_html_xml is not None:
+            xml.append(_ITEM_RESPROCESSING_SHORTANS_CHOICE_FEEDBACK.render(ident=f'text2qti_choice_{choice.id}', answer_xml=choice.choice_xml))
+    varequal = '\n'.join(_ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_VAREQUAL.render(answer_xml=choice.choice_xml)
+                         for choice in question.choices)
+    if question.correct_feedback_html_xml is not None:
+        xml.append(_ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_WITH_FEEDBACK.render(varequal=varequal))
+    else:
+        xml.append(_ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_NO_FEEDBACK.render(varequal=varequal))
+    if question.incorrect_feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_SHORTANS_INCORRECT_FEEDBACK)
+    xml.append(ITEM_RESPROCESSING_END)
+    return _item_end(question, xml, choice_feedback=True)
+
+
+def _multans_item(question: Question) -> str:
+    xml = _item_start(question, _ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM,
+                      ','.join(f'text2qti_choice_{c.id}' for c in question.choices))
+    choices = '\n'.join(_ITEM_PRESENTATION_MULTANS_CHOICE.render(ident=f'text2qti_choice_{c.id}', choice_html_xml=c.choice_html_xml)
+                        for c in question.choices)
+    xml.append(_ITEM_PRESENTATION_MULTANS.render(question_html_xml=question.question_html_xml, choices=choices))
+    xml.append(ITEM_RESPROCESSING_START)
+    if question.feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_MULTANS_GENERAL_FEEDBACK)
+    for choice in question.choices:
+        if choice.feedback_html_xml is not None:
+            xml.append(_ITEM_RESPROCESSING_MULTANS_CHOICE_FEEDBACK.render(ident=f'text2qti_choice_{choice.id}'))
+    varequal = []
+    for choice in question.choices:
+        if choice.correct:
+            varequal.append(_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_CORRECT.render(ident=f'text2qti_choice_{choice.id}'))
         else:
-            raise ValueError
-        xml.append(item_metadata.format(question_type=question.type,
-                                        points_possible=question.points_possible,
-                                        original_answer_ids=original_answer_ids,
-                                        assessment_question_identifierref=f'text2qti_question_ref_{question.id}'))
-
-        if question.type in ('true_false_question', 'multiple_choice_question', 'multiple_answers_question'):
-            if question.type in ('true_false_question', 'multiple_choice_question'):
-                item_presentation_choice = ITEM_PRESENTATION_MCTF_CHOICE
-                item_presentation = ITEM_PRESENTATION_MCTF
-            elif question.type == 'multiple_answers_question':
-                item_presentation_choice = ITEM_PRESENTATION_MULTANS_CHOICE
-                item_presentation = ITEM_PRESENTATION_MULTANS
-            else:
-                raise ValueError
-            choices = '\n'.join(item_presentation_choice.format(ident=f'text2qti_choice_{c.id}', choice_html_xml=c.choice_html_xml)
-                                                                for c in question.choices)
-            xml.append(item_presentation.format(question_html_xml=question.question_html_xml, choices=choices))
-        elif question.type == 'short_answer_question':
-            xml.append(ITEM_PRESENTATION_SHORTANS.format(question_html_xml=question.question_html_xml))
-        elif question.type == 'numerical_question':
-            xml.append(ITEM_PRESENTATION_NUM.format(question_html_xml=question.question_html_xml))
-        elif question.type == 'essay_question':
-            xml.append(ITEM_PRESENTATION_ESSAY.format(question_html_xml=question.question_html_xml))
-        elif question.type == 'file_upload_question':
-            xml.append(ITEM_PRESENTATION_UPLOAD.format(question_html_xml=question.question_html_xml))
+            varequal.append(_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_INCORRECT.render(ident=f'text2qti_choice_{choice.id}'))
+    if question.correct_feedback_html_xml is not None:
+        xml.append(_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_WITH_FEEDBACK.render(varequal='\n'.join(varequal)))
+    else:
+        xml.append(_ITEM_RESPROCESSING_MULTANS_SET_CORRECT_NO_FEEDBACK.render(varequal='\n'.join(varequal)))
+    if question.incorrect_feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_MULTANS_INCORRECT_FEEDBACK)
+    xml.append(ITEM_RESPROCESSING_END)
+    return _item_end(question, xml, choice_feedback=True)
+
+
+def _num_item(question: Question) -> str:
+    xml = _item_start(question, _ITEM_METADATA_MCTF_SHORTANS_MULTANS_NUM, f'text2qti_numerical_{question.id}')
+    xml.append(_ITEM_PRESENTATION_NUM.render(question_html_xml=question.question_html_xml))
+    xml.append(ITEM_RESPROCESSING_START)
+    if question.feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_NUM_GENERAL_FEEDBACK)
+    if question.correct_feedback_html_xml is None:
+        if question.numerical_exact is None:
+            item_resprocessing_num_set_correct = _ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_NO_FEEDBACK
+        else:
+            item_resprocessing_num_set_correct = _ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_NO_FEEDBACK
+    else:
+        if question.numerical_exact is None:
+            item_resprocessing_num_set_correct = _ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_WITH_FEEDBACK
         else:
-            raise ValueError
-
-        if question.type in ('true_false_question', 'multiple_choice_question'):
-            correct_choice = None
-            for choice in question.choices:
-                if choice.correct:
-                  correct_choice = choice
-                  break
-            if correct_choice is None:
-                raise TypeError
-            resprocessing = []
-            resprocessing.append(ITEM_RESPROCESSING_START)
-            if question.feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_MCTF_GENERAL_FEEDBACK)
-            for choice in question.choices:
-                if choice.feedback_raw is not None:
-                    resprocessing.append(ITEM_RESPROCESSING_MCTF_CHOICE_FEEDBACK.format(ident=f'text2qti_choice_{choice.id}'))
-            if question.correct_feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_MCTF_SET_CORRECT_WITH_FEEDBACK.format(ident=f'text2qti_choice_{correct_choice.id}'))
-            else:
-                resprocessing.append(ITEM_RESPROCESSING_MCTF_SET_CORRECT_NO_FEEDBACK.format(ident=f'text2qti_choice_{correct_choice.id}'))
-            if question.incorrect_feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_MCTF_INCORRECT_FEEDBACK)
-            resprocessing.append(ITEM_RESPROCESSING_END)
-            xml.extend(resprocessing)
-        elif question.type == 'short_answer_question':
-            resprocessing = []
-            resprocessing.append(ITEM_RESPROCESSING_START)
-            if question.feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_SHORTANS_GENERAL_FEEDBACK)
-            for choice in question.choices:
-                if choice.feedback_raw is not None:
-                    resprocessing.append(ITEM_RESPROCESSING_SHORTANS_CHOICE_FEEDBACK.format(ident=f'text2qti_choice_{choice.id}', answer_xml=choice.choice_xml))
-            varequal = []
-            for choice in question.choices:
-                varequal.append(ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_VAREQUAL.format(answer_xml=choice.choice_xml))
-            if question.correct_feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_WITH_FEEDBACK.format(varequal='\n'.join(varequal)))
-            else:
-                resprocessing.append(ITEM_RESPROCESSING_SHORTANS_SET_CORRECT_NO_FEEDBACK.format(varequal='\n'.join(varequal)))
-            if question.incorrect_feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_SHORTANS_INCORRECT_FEEDBACK)
-            resprocessing.append(ITEM_RESPROCESSING_END)
-            xml.extend(resprocessing)
-        elif question.type == 'multiple_answers_question':
-            resprocessing = []
-            resprocessing.append(ITEM_RESPROCESSING_START)
-            if question.feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_MULTANS_GENERAL_FEEDBACK)
-            for choice in question.choices:
-                if choice.feedback_raw is not None:
-                    resprocessing.append(ITEM_RESPROCESSING_MULTANS_CHOICE_FEEDBACK.format(ident=f'text2qti_choice_{choice.id}'))
-            varequal = []
-            for choice in question.choices:
-                if choice.correct:
-                    varequal.append(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_CORRECT.format(ident=f'text2qti_choice_{choice.id}'))
-                else:
-                    varequal.append(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_VAREQUAL_INCORRECT.format(ident=f'text2qti_choice_{choice.id}'))
-            if question.correct_feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_WITH_FEEDBACK.format(varequal='\n'.join(varequal)))
-            else:
-                resprocessing.append(ITEM_RESPROCESSING_MULTANS_SET_CORRECT_NO_FEEDBACK.format(varequal='\n'.join(varequal)))
-            if question.incorrect_feedback_raw is not None:
-                resprocessing.append(ITEM_RESPROCESSING_MULTANS_INCORRECT_FEEDBACK)
-            resprocessing.append(ITEM_RESPROCESSING_END)
-            xml.extend(resprocessing)
-        elif question.type == 'numerical_question':
-            xml.append(ITEM_RESPROCESSING_START)
-            if question.feedback_raw is not None:
-              xml.append(ITEM_RESPROCESSING_NUM_GENERAL_FEEDBACK)
-            if question.correct_feedback_raw is None:
-                if question.numerical_exact is None:
-                    item_resprocessing_num_set_correct = ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_NO_FEEDBACK
-                else:
-                    item_resprocessing_num_set_correct = ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_NO_FEEDBACK
-            else:
-                if question.numerical_exact is None:
-                    item_resprocessing_num_set_correct = ITEM_RESPROCESSING_NUM_RANGE_SET_CORRECT_WITH_FEEDBACK
-                else:
-                    item_resprocessing_num_set_correct = ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_WITH_FEEDBACK
-            xml.append(item_resprocessing_num_set_correct.format(num_min=question.numerical_min_html_xml,
-                                                                 num_exact=question.numerical_exact_html_xml,
-                                                                 num_max=question.numerical_max_html_xml))
-            if question.incorrect_feedback_raw is not None:
-                xml.append(ITEM_RESPROCESSING_NUM_INCORRECT_FEEDBACK)
-            xml.append(ITEM_RESPROCESSING_END)
-        elif question.type == 'essay_question':
-            xml.append(ITEM_RESPROCESSING_START)
-            xml.append(ITEM_RESPROCESSING_ESSAY)
-            if question.feedback_raw is not None:
-                xml.append(ITEM_RESPROCESSING_ESSAY_GENERAL_FEEDBACK)
-            xml.append(ITEM_RESPROCESSING_END)
-        elif question.type == 'file_upload_question':
-            xml.append(ITEM_RESPROCESSING_START)
-            if question.feedback_raw is not None:
-                xml.append(ITEM_RESPROCESSING_UPLOAD_GENERAL_FEEDBACK)
-            xml.append(ITEM_RESPROCESSING_END)
+            item_resprocessing_num_set_correct = _ITEM_RESPROCESSING_NUM_EXACT_SET_CORRECT_WITH_FEEDBACK
+    xml.append(item_resprocessing_num_set_correct.render(num_min=question.numerical_min_html_xml,
+                                                         num_exact=question.numerical_exact_html_xml,
+                                                         num_max=question.numerical_max_html_xml))
+    if question.incorrect_feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_NUM_INCORRECT_FEEDBACK)
+    xml.append(ITEM_RESPROCESSING_END)
+    return _item_end(question, xml)
+
+
+def _essay_item(question: Question) -> str:
+    xml = _item_start(question, _ITEM_METADATA_ESSAY, f'text2qti_essay_{question.id}')
+    xml.append(_ITEM_PRESENTATION_ESSAY.render(question_html_xml=question.question_html_xml))
+    xml.append(ITEM_RESPROCESSING_START)
+    xml.append(ITEM_RESPROCESSING_ESSAY)
+    if question.feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_ESSAY_GENERAL_FEEDBACK)
+    xml.append(ITEM_RESPROCESSING_END)
+    return _item_end(question, xml)
+
+
+def _upload_item(question: Question) -> str:
+    xml = _item_start(question, _ITEM_METADATA_UPLOAD, f'text2qti_upload_{question.id}')
+    xml.append(_ITEM_PRESENTATION_UPLOAD.render(question_html_xml=question.question_html_xml))
+    xml.append(ITEM_RESPROCESSING_START)
+    if question.feedback_html_xml is not None:
+        xml.append(ITEM_RESPROCESSING_UPLOAD_GENERAL_FEEDBACK)
+    xml.append(ITEM_RESPROCESSING_END)
+    return _item_end(question, xml)
+
+
+# Function that generates the complete XML for each type of question
+_ITEM_EMITTERS: Dict[str, Callable[[Question], str]] = {
+    'true_false_question': _mctf_item,
+    'multiple_choice_question': _mctf_item,
+    'short_answer_question': _shortans_item,
+    'multiple_answers_question': _multans_item,
+    'numerical_question': _num_item,
+    'essay_question': _essay_item,
+    'file_upload_question': _upload_item,
+}
+
+
+
+
+def iter_assessment(*, quiz: Quiz, assessment_identifier: str, title_xml: str) -> Iterator[str]:
+    '''
+    Generate assessment XML from Quiz, as a sequence of fragments that can be
+    written out as they are generated.  Each question is a single fragment,
+    from the emitter for its type.
+    '''
+    yield _BEFORE_ITEMS.render(assessment_identifier=assessment_identifier,
+                               title=title_xml)
+    for question_or_delim in quiz.questions_and_delims:
+        if isinstance(question_or_delim, Question):
+            try:
+                item_emitter = _ITEM_EMITTERS[question_or_delim.type]
+            except KeyError:
+                raise ValueError
+            yield item_emitter(question_or_delim)
+        elif isinstance(question_or_delim, TextRegion):
+            yield _TEXT.render(ident=f'text2qti_text_{question_or_delim.id}',
+                               text_title_xml=question_or_delim.title_xml,
+                               assessment_question_identifierref=f'text2qti_question_ref_{question_or_delim.id}',
+                               text_html_xml=question_or_delim.text_html_xml)
+        elif isinstance(question_or_delim, GroupStart):
+            yield _GROUP_START.render(ident=f'text2qti_group_{question_or_delim.group.id}',
+                                      group_title=question_or_delim.group.title_xml,
+                                      pick=question_or_delim.group.pick,
+                                      points_per_item=question_or_delim.group.points_per_question)
+        elif isinstance(question_or_delim, GroupEnd):
+            yield GROUP_END
         else:
-            raise ValueError
-
-        if question.type in ('true_false_question', 'multiple_choice_question',
-                             'short_answer_question', 'multiple_answers_question',
-                             'numerical_question', 'essay_question', 'file_upload_question'):
-            if question.feedback_raw is not None:
-                xml.append(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_GENERAL.format(feedback=question.feedback_html_xml))
-            if question.correct_feedback_raw is not None:
-                xml.append(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_CORRECT.format(feedback=question.correct_feedback_html_xml))
-            if question.incorrect_feedback_raw is not None:
-                xml.append(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INCORRECT.format(feedback=question.incorrect_feedback_html_xml))
-        if question.type in ('true_false_question', 'multiple_choice_question',
-                             'short_answer_question', 'multiple_answers_question'):
-            for choice in question.choices:
-                if choice.feedback_raw is not None:
-                    xml.append(ITEM_FEEDBACK_MCTF_SHORTANS_MULTANS_NUM_INDIVIDUAL.format(ident=f'text2qti_choice_{choice.id}',
-                                                                                         feedback=choice.feedback_html_xml))
-
-        xml.append(END_ITEM)
-
-    xml.append(AFTER_ITEMS)
+            raise TypeError
+    yield AFTER_ITEMS
 
-    return ''.join(xml)
+
+
+
+def assessment(*, quiz: Quiz, assessment_identifier: str, title_xml: str) -> str:
+    '''
+    Generate assessment XML from Quiz.
+    '''
+    return ''.join(iter_assessment(quiz=quiz, assessment_identifier=assessment_identifier, title_xml=title_xml))
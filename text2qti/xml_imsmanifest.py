@@ -9,7 +9,7 @@
 
 
 import datetime
-from typing import Dict, Optional
+from typing import Dict, Iterator, Optional
 from .quiz import Image
 
 
@@ -65,6 +65,27 @@ MANIFEST_END = '''\
 '''
 
 
+def iter_imsmanifest(*,
+                     manifest_identifier: str,
+                     assessment_identifier: str,
+                     dependency_identifier: str,
+                     images: Dict[str, Image],
+                     date: Optional[str]=None) -> Iterator[str]:
+    '''
+    Generate `imsmanifest.xml`, as a sequence of fragments that can be
+    written out as they are generated.
+    '''
+    if date is None:
+        date = str(datetime.date.today())
+    yield MANIFEST_START.format(manifest_identifier=manifest_identifier,
+                                assessment_identifier=assessment_identifier,
+                                dependency_identifier=dependency_identifier,
+                                date=date)
+    for image in images.values():
+        yield IMAGE.format(ident=image.id, path=image.qti_xml_path)
+    yield MANIFEST_END
+
+
 def imsmanifest(*,
                 manifest_identifier: str,
                 assessment_identifier: str,
@@ -74,14 +95,8 @@ def imsmanifest(*,
     '''
     Generate `imsmanifest.xml`.
     '''
-    if date is None:
-        date = str(datetime.date.today())
-    xml = []
-    xml.append(MANIFEST_START.format(manifest_identifier=manifest_identifier,
-                                     assessment_identifier=assessment_identifier,
-                                     dependency_identifier=dependency_identifier,
-                                     date=date))
-    for image in images.values():
-        xml.append(IMAGE.format(ident=image.id, path=image.qti_xml_path))
-    xml.append(MANIFEST_END)
-    return ''.join(xml)
+    return ''.join(iter_imsmanifest(manifest_identifier=manifest_identifier,
+                                    assessment_identifier=assessment_identifier,
+                                    dependency_identifier=dependency_identifier,
+                                    images=images,
+                                    date=date))
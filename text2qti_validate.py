@@ -8,8 +8,7 @@ from contextlib import contextmanager
 from pathlib import Path
 
 from text2qti.config import Config
-from text2qti.err import Text2qtiError
-from text2qti.qti import QTI
+from text2qti.err import Diagnostic, Text2qtiError
 from text2qti.quiz import GroupStart, Question, Quiz, TextRegion
 
 
@@ -61,6 +60,11 @@ def _parse_args() -> argparse.Namespace:
         action="store_true",
         help='Print only "VALID" or "INVALID"',
     )
+    parser.add_argument(
+        "--all-errors",
+        action="store_true",
+        help="Report every problem found in the file instead of stopping at the first one",
+    )
     return parser.parse_args()
 
 
@@ -75,25 +79,17 @@ def _resolve_file(args: argparse.Namespace) -> Path:
     return Path(selected).expanduser().resolve()
 
 
-def _validate_file(file_path: Path) -> tuple[int, int, int, int | float]:
+def _validate_file(file_path: Path, *, all_errors: bool = False) -> tuple[int, int, int, int | float]:
     if file_path.suffix.lower() != ".txt":
         raise Text2qtiError(f'Expected a ".txt" file, got "{file_path.name}"')
-    try:
-        text = file_path.read_text(encoding="utf-8-sig")
-    except FileNotFoundError:
-        raise Text2qtiError(f'File "{file_path}" does not exist')
-    except PermissionError as exc:
-        raise Text2qtiError(f'File "{file_path}" cannot be read due to permission error:\n{exc}')
-    except UnicodeDecodeError as exc:
-        raise Text2qtiError(f'File "{file_path}" is not encoded in valid UTF-8:\n{exc}')
-
     config = Config()
     config.load()
 
     with _pushd(file_path.parent):
-        quiz = Quiz(text, config=config, source_name=file_path.as_posix())
-        # Build QTI in memory to verify that parsing output is fully convertible.
-        QTI(quiz)
+        # Validation only needs structural checks and counts, so Markdown is
+        # not rendered.
+        quiz = Quiz.from_path(file_path, config=config, source_name=file_path.as_posix(), render=False,
+                              collect_errors=all_errors)
 
     question_count = sum(isinstance(item, Question) for item in quiz.questions_and_delims)
     group_count = sum(isinstance(item, GroupStart) for item in quiz.questions_and_delims)
@@ -101,18 +97,36 @@ def _validate_file(file_path: Path) -> tuple[int, int, int, int | float]:
     return question_count, group_count, text_region_count, quiz.points_possible
 
 
+def _format_diagnostic(diagnostic: Diagnostic) -> str:
+    if diagnostic.line is None:
+        location = ""
+    elif diagnostic.column is None:
+        location = f"Line {diagnostic.line}"
+    else:
+        location = f"Line {diagnostic.line}, column {diagnostic.column}"
+    message = diagnostic.message.strip().replace("\n", "\n    ")
+    if location:
+        return f"{location} [{diagnostic.code}]: {message}"
+    return f"[{diagnostic.code}]: {message}"
+
+
 def main() -> int:
     args = _parse_args()
     try:
         file_path = _resolve_file(args)
-        question_count, group_count, text_region_count, points_possible = _validate_file(file_path)
+        question_count, group_count, text_region_count, points_possible = _validate_file(file_path, all_errors=args.all_errors)
     except Text2qtiError as exc:
         if args.quiet:
             print("INVALID")
         else:
             print("INVALID")
             print(f"File: {file_path if 'file_path' in locals() else '(not selected)'}")
-            print(str(exc))
+            if args.all_errors and exc.diagnostics:
+                print(f"Errors: {len(exc.diagnostics)}")
+                for diagnostic in exc.diagnostics:
+                    print(_format_diagnostic(diagnostic))
+            else:
+                print(str(exc))
         return 1
     except Exception as exc:  # pragma: no cover - unexpected runtime failure
         if args.quiet:
@@ -14,14 +14,17 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 from pathlib import Path
 
 from text2qti.config import Config
-from text2qti.err import Text2qtiError
-from text2qti.qti import QTI
+from text2qti.err import Diagnostic, Text2qtiError
 from text2qti.quiz import GroupStart, Question, Quiz, TextRegion
 
 
 REPO_ROOT = Path(__file__).resolve().parent
 VENV_TEXT2QTI = REPO_ROOT / ".venv" / "bin" / "text2qti"
 
+# Last successfully validated quiz.  Validating edited text reuses its
+# unchanged questions and text regions instead of rendering them again.
+_last_validated_quiz: Quiz | None = None
+
 
 def _page(title: str, body_html: str) -> bytes:
     doc = f"""<!DOCTYPE html>
@@ -598,7 +601,8 @@ def _result_body(
 """
 
 
-def _strict_validate_text2qti(text: str, *, source_name: str, resource_path: Path) -> tuple[bool, str, dict[str, int | float] | None]:
+def _strict_validate_text2qti(text: str, *, source_name: str, resource_path: Path) -> tuple[bool, list[Diagnostic], dict[str, int | float] | None]:
+    global _last_validated_quiz
     config = Config()
     config.load()
     try:
@@ -607,10 +611,13 @@ def _strict_validate_text2qti(text: str, *, source_name: str, resource_path: Pat
             config=config,
             source_name=source_name,
             resource_path=resource_path.as_posix(),
+            previous=_last_validated_quiz,
+            render=False,
+            collect_errors=True,
         )
-        QTI(quiz)
     except Text2qtiError as exc:
-        return False, str(exc), None
+        return False, exc.diagnostics or [Diagnostic(str(exc), code=exc.code or "error")], None
+    _last_validated_quiz = quiz
 
     question_count = sum(isinstance(item, Question) for item in quiz.questions_and_delims)
     group_count = sum(isinstance(item, GroupStart) for item in quiz.questions_and_delims)
@@ -621,24 +628,15 @@ def _strict_validate_text2qti(text: str, *, source_name: str, resource_path: Pat
         "text_regions": text_region_count,
         "points": quiz.points_possible,
     }
-    return True, "", stats
-
+    return True, [], stats
 
-def _validation_error_html(validation_error: str, text: str) -> str:
-    lines = text.splitlines()
-    line_match = re.search(r"on line (\d+):\n(.+)$", validation_error, flags=re.DOTALL)
-    if line_match:
-        line_number = int(line_match.group(1))
-        issue = line_match.group(2).strip()
-    else:
-        line_number = None
-        issue = validation_error.strip()
 
+def _validation_hints(diagnostic: Diagnostic) -> list[str]:
     hints: list[str] = []
-    issue_lower = issue.lower()
-    if "missing whitespace after" in issue_lower:
+    issue_lower = diagnostic.message.lower()
+    if diagnostic.code == "missing-whitespace":
         hints.append("Add required spacing after the marker (for questions, use two spaces after `1.`).")
-    if "missing content after" in issue_lower:
+    if diagnostic.code == "missing-content":
         hints.append("Add the missing content after the marker on that line.")
     if "cannot have" in issue_lower and "without a question" in issue_lower:
         hints.append("Move this line directly under its question, or add the missing question line first.")
@@ -646,22 +644,38 @@ def _validation_error_html(validation_error: str, text: str) -> str:
         hints.append("Add one response marker under the question (for example `*a)`, `[ ]`, `=`, `*`, `____`, or `^^^^`).")
     if "question must specify a correct choice" in issue_lower:
         hints.append("Mark at least one correct answer with `*` (for example `*b) correct answer`).")
+    return hints
 
-    parts = [
-        "Validation failed. Fix the issue below, then run Validate again.",
-        f"<b>Issue:</b> {html.escape(issue)}",
-    ]
-    if line_number is not None:
-        parts.append(f"<b>Line:</b> {line_number}")
-        if 1 <= line_number <= len(lines):
-            line_text = lines[line_number - 1]
-            shown = line_text if line_text.strip() else "(blank line)"
-            parts.append(f"<b>Line content:</b> <code>{html.escape(shown)}</code>")
-    if hints:
-        hint_lines = "<br>".join(f"- {html.escape(hint)}" for hint in hints)
-        parts.append(f"<b>Suggested fix:</b><br>{hint_lines}")
-    parts.append(f"<details><summary>Full parser message</summary><pre>{html.escape(validation_error)}</pre></details>")
-    return "<br><br>".join(parts)
+
+def _validation_error_html(diagnostics: list[Diagnostic], text: str) -> str:
+    lines = text.splitlines()
+    if len(diagnostics) == 1:
+        intro = "Validation failed. Fix the issue below, then run Validate again."
+    else:
+        intro = f"Validation failed with {len(diagnostics)} issues. Fix the issues below, then run Validate again."
+    sections = [intro]
+    for number, diagnostic in enumerate(diagnostics, start=1):
+        parts = []
+        if len(diagnostics) > 1:
+            parts.append(f"<b>Issue {number}:</b> {html.escape(diagnostic.message.strip())}")
+        else:
+            parts.append(f"<b>Issue:</b> {html.escape(diagnostic.message.strip())}")
+        if diagnostic.line is not None:
+            location = f"<b>Line:</b> {diagnostic.line}"
+            if diagnostic.column is not None:
+                location += f", <b>column:</b> {diagnostic.column}"
+            parts.append(location)
+            if 1 <= diagnostic.line <= len(lines):
+                line_text = lines[diagnostic.line - 1]
+                shown = line_text if line_text.strip() else "(blank line)"
+                parts.append(f"<b>Line content:</b> <code>{html.escape(shown)}</code>")
+        hints = _validation_hints(diagnostic)
+        if hints:
+            hint_lines = "<br>".join(f"- {html.escape(hint)}" for hint in hints)
+            parts.append(f"<b>Suggested fix:</b><br>{hint_lines}")
+        parts.append(f"<details><summary>Full parser message ({html.escape(diagnostic.code)})</summary><pre>{html.escape(str(diagnostic))}</pre></details>")
+        sections.append("<br>".join(parts))
+    return "<br><br>".join(sections)
 
 
 def _validation_success_html(stats: dict[str, int | float]) -> str:
@@ -760,13 +774,13 @@ class Handler(BaseHTTPRequestHandler):
             input_path.write_text(pasted_text, encoding="utf-8")
 
             if submit_action == "validate":
-                valid, validation_error, stats = _strict_validate_text2qti(
+                valid, diagnostics, stats = _strict_validate_text2qti(
                     pasted_text,
                     source_name=input_path.as_posix(),
                     resource_path=tmpdir_path,
                 )
                 if not valid:
-                    msg_html = _validation_error_html(validation_error, pasted_text)
+                    msg_html = _validation_error_html(diagnostics, pasted_text)
                     data = _page("Canvas Quiz Builder", _result_body("Validation Failed", msg_html, True, allow_html=True))
                     self.send_response(HTTPStatus.BAD_REQUEST)
                     self.send_header("Content-Type", "text/html; charset=utf-8")